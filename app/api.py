@@ -1,3 +1,4 @@
+from datetime import datetime, timedelta, timezone
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -11,6 +12,7 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi import Depends
 from app.db.database import get_session
 from fastapi import Request, Response
+from fastapi.responses import JSONResponse
 
 from fastapi.middleware.cors import CORSMiddleware
 from app.routers import user
@@ -20,8 +22,21 @@ from app.routers import model
 from app.routers import prediction
 from app.routers import signed_url
 from app.routers import run
+from app.routers import media
 from app.service.builder_client import builder_client
+from app.service.lambda_warmer.lambda_warmer import lambda_warmer
 from app.db import database
+from app.db import migrations
+from app.db import crud
+from app.db.run_writer import RunWriterFull, run_writer
+from app.helpers import metrics
+from app.helpers.api_helper import NEXT_CURSOR_HEADER
+from app.helpers.boto_helper import lambda_invoker
+from app.helpers.admission import RateLimited
+from app.helpers.asyncwrapper import BulkheadFull
+from app.helpers.circuit_breaker import CircuitOpen
+from app.helpers.load_shedder import load_shedder
+from app.helpers.run_queue import run_queue
 
 get_log(name=__name__).info(f"Starting API Server")
 
@@ -36,23 +51,89 @@ app.include_router(model.router)
 app.include_router(prediction.router)
 app.include_router(signed_url.router)
 app.include_router(run.router)
+app.include_router(media.router)
 
 
 @app.on_event("startup")
 async def startup_event():
-    await database.init_models()
+    await migrations.check_schema_version()
+    await run_writer.start()
+    await expire_pending_runs()
+    await lambda_warmer.start()
+    await load_shedder.start()
+
+
+async def expire_pending_runs():
+    # async runs older than the longest possible job lost their message: the
+    # wait for an admission slot, then every attempt at the lambda timing out
+    longest_job_seconds = (
+        settings.PREDICTION_JOB_QUEUE_SECONDS
+        + settings.LAMBDA_RETRY_ATTEMPTS
+        * (settings.LAMBDA_READ_TIMEOUT_SECONDS + settings.LAMBDA_RETRY_MAX_SECONDS)
+    )
+    before = datetime.now(timezone.utc) - timedelta(seconds=longest_job_seconds + 60)
+    async with database.async_session() as session:
+        expired = await crud.expire_pending_runs(session=session, before=before)
+    if expired > 0:
+        get_log(name=__name__).info(f"Expired {expired} pending runs")
 
 
 @app.on_event("shutdown")
 async def shutdown_event():
+    await load_shedder.stop()
+    await lambda_warmer.stop()
+    await run_queue.stop()
+    await run_writer.stop()
+    await lambda_invoker.close()
     await database.dispose()
 
 
+@app.exception_handler(BulkheadFull)
+async def bulkhead_full_handler(request: Request, exc: BulkheadFull):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+
+@app.exception_handler(CircuitOpen)
+async def circuit_open_handler(request: Request, exc: CircuitOpen):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+
+@app.exception_handler(RunWriterFull)
+async def run_writer_full_handler(request: Request, exc: RunWriterFull):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+
+@app.exception_handler(RateLimited)
+async def rate_limited_handler(request: Request, exc: RateLimited):
+    return JSONResponse(
+        status_code=429,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+
 @app.get("/", tags=["root"])
 async def read_root() -> dict:
     return {"message": "Welcome to inference."}
 
 
+@app.get("/metrics", tags=["root"])
+async def read_metrics() -> dict:
+    return metrics.snapshot()
+
+
 @app.websocket("/ws")
 async def websocket_endpoint(
     websocket: WebSocket, session: AsyncSession = Depends(get_session)
@@ -73,4 +154,5 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER],
 )
@@ -6,6 +6,7 @@ import jwt
 import os
 
 from app.helpers.settings import settings
+from app.helpers.ttl_cache import TTLCache
 from app.db import schema
 
 
@@ -33,13 +34,29 @@ def signCSRF(user: schema.User) -> schema.Token:
     return schema.Token(token=token, user_id=user.id)
 
 
-def decodeJWT(token: str) -> Optional[schema.Token]:
+# user ids of verified tokens, each kept until the token expires (or for
+# JWT_CACHE_TTL_SECONDS at most, so a changed secret takes effect)
+jwt_cache = TTLCache(
+    name="jwt", maxsize=settings.JWT_CACHE_SIZE, ttl=settings.JWT_CACHE_TTL_SECONDS
+)
+
+
+def decodeJWT(token: str, use_cache: bool = True) -> Optional[schema.Token]:
+    if use_cache:
+        user_id = jwt_cache.get(token)
+        if user_id != None:
+            return schema.Token(token=token, user_id=user_id)
+
     try:
         decoded_token = jwt.decode(
             token, settings.JWT_SECRET, algorithms=[settings.JWT_ALGORITHM])
-        if decoded_token["expires"] <= time.time():
+        expires_in = decoded_token["expires"] - time.time()
+        if expires_in <= 0:
             return None
 
+        if use_cache:
+            jwt_cache.set(token, decoded_token['user_id'], ttl=min(
+                expires_in, settings.JWT_CACHE_TTL_SECONDS))
         return schema.Token(token=token, user_id=decoded_token['user_id'])
     except:
         return None
@@ -0,0 +1,79 @@
+import time
+from typing import Callable, Dict, List
+
+import boto3
+
+from app.helpers import boto_helper
+from app.helpers.settings import settings
+
+
+def per_call_ms(func: Callable, iterations: int) -> float:
+    before = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return (time.perf_counter() - before) / iterations * 1000
+
+
+def new_client(service_name: str):
+    # what every helper did before the registry
+    if settings.AWS_ACCESS_KEY == None:
+        return boto3.client(service_name, region_name=settings.AWS_REGION_NAME)
+    return boto3.client(
+        service_name,
+        aws_access_key_id=settings.AWS_ACCESS_KEY,
+        aws_secret_access_key=settings.AWS_SECRET_KEY,
+        region_name=settings.AWS_REGION_NAME,
+    )
+
+
+def new_resource_presign():
+    if settings.AWS_ACCESS_KEY == None:
+        s3 = boto3.resource("s3", region_name=settings.AWS_REGION_NAME)
+    else:
+        s3 = boto3.resource(
+            "s3",
+            aws_access_key_id=settings.AWS_ACCESS_KEY,
+            aws_secret_access_key=settings.AWS_SECRET_KEY,
+            region_name=settings.AWS_REGION_NAME,
+        )
+    return s3.meta.client.generate_presigned_url(
+        "get_object",
+        Params={"Bucket": settings.AWS_REQUESTS_LOG_BUCKET, "Key": "bench/key.jpg"},
+        ExpiresIn=604800,
+    )
+
+
+def run(iterations: int = 50, urls_per_prediction: int = 2) -> List[Dict]:
+    # no requests are sent, this only measures building clients and signing.
+    # a prediction gets a lambda client and signs its s3 inputs and outputs.
+    # the registry is warmed first, its one time cost is the before column.
+    boto_helper.get_lambda_client()
+    boto_helper.get_client("s3")
+    reports = [
+        {
+            "operation": "lambda_client",
+            "before_ms": per_call_ms(lambda: new_client("lambda"), iterations),
+            "after_ms": per_call_ms(boto_helper.get_lambda_client, iterations),
+        },
+        {
+            "operation": "presigned_url",
+            "before_ms": per_call_ms(new_resource_presign, iterations),
+            "after_ms": per_call_ms(
+                lambda: boto_helper.create_presigned_url(
+                    settings.AWS_REQUESTS_LOG_BUCKET, "bench/key.jpg"
+                ),
+                iterations,
+            ),
+        },
+    ]
+
+    reports.append(
+        {
+            "operation": "per_prediction",
+            "before_ms": reports[0]["before_ms"]
+            + reports[1]["before_ms"] * urls_per_prediction,
+            "after_ms": reports[0]["after_ms"]
+            + reports[1]["after_ms"] * urls_per_prediction,
+        }
+    )
+    return reports
@@ -0,0 +1,69 @@
+import time
+from typing import Callable, Dict, List
+
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import asyncpg
+from sqlalchemy.orm import joinedload
+
+from app.db import crud
+from app.db import model
+
+MODEL_ID = "9a4b9f7e-2f0e-4b8e-9d6a-0c1e0d2b7f11"
+USER_ID = "0d8c5c1a-52b5-4a43-a3f7-1c9f3f1f5a2e"
+RUN_ID = "5e0c8d4e-3c4b-11ec-8d3d-0242ac130003"
+
+
+def per_call_us(func: Callable, iterations: int) -> float:
+    before = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return (time.perf_counter() - before) / iterations * 1000000
+
+
+def run(iterations: int = 2000) -> List[Dict]:
+    # "before" builds the statement per call the way crud used to, "after"
+    # reuses the cached statement. SQLAlchemy's own compiled cache still
+    # needs a cache key per execution, which is memoized on a reused
+    # statement, so that is what each column measures. compile_us is the
+    # cost of a full compile, paid whenever the compiled cache misses.
+    dialect = asyncpg.dialect()
+    queries = [
+        (
+            "get_model_by_id",
+            lambda: select(model.Model)
+            .where(model.Model.id == MODEL_ID)
+            .options(
+                joinedload(model.Model.active_build), joinedload(model.Model.user)
+            ),
+            crud.get_model_by_id_stmt,
+        ),
+        (
+            "get_user",
+            lambda: select(model.User).where(model.User.id == USER_ID),
+            crud.get_user_stmt,
+        ),
+        (
+            "get_run_by_id",
+            lambda: select(model.Run).where(model.Run.id == RUN_ID),
+            crud.get_run_by_id_stmt,
+        ),
+    ]
+
+    reports: List[Dict] = []
+    for name, build, cached in queries:
+        reports.append(
+            {
+                "query": name,
+                "compile_us": per_call_us(
+                    lambda: build().compile(dialect=dialect), iterations // 10
+                ),
+                "before_us": per_call_us(
+                    lambda: build()._generate_cache_key(), iterations
+                ),
+                "after_us": per_call_us(
+                    lambda: cached._generate_cache_key(), iterations
+                ),
+            }
+        )
+
+    return reports
@@ -0,0 +1,63 @@
+import asyncio
+import time
+import uuid
+from typing import Callable, Dict, List
+
+from fastapi import Request
+
+from app.auth import auth_handler
+from app.auth.auth_bearer import JWTBearer
+from app.db import schema
+
+
+def per_call_us(func: Callable, iterations: int) -> float:
+    before = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return (time.perf_counter() - before) / iterations * 1000000
+
+
+def bearer_request(token: str) -> Request:
+    return Request(
+        {
+            "type": "http",
+            "method": "GET",
+            "path": "/model/me",
+            "headers": [(b"authorization", f"Bearer {token}".encode())],
+        }
+    )
+
+
+def run(iterations: int = 10000) -> List[Dict]:
+    # "before" verifies the signature on every call, "after" reads the cache.
+    # bearer is the whole dependency an authenticated request goes through.
+    token = auth_handler.signJWT(
+        schema.User(id=str(uuid.uuid4()), type=schema.UserType.GithubVerified)
+    ).token
+    auth_handler.jwt_cache.clear()
+    auth_handler.decodeJWT(token)
+
+    bearer = JWTBearer()
+    loop = asyncio.new_event_loop()
+
+    def call_bearer(use_cache: bool):
+        if not use_cache:
+            auth_handler.jwt_cache.clear()
+        loop.run_until_complete(bearer(bearer_request(token)))
+
+    reports = [
+        {
+            "operation": "decode",
+            "before_us": per_call_us(
+                lambda: auth_handler.decodeJWT(token, use_cache=False), iterations
+            ),
+            "after_us": per_call_us(lambda: auth_handler.decodeJWT(token), iterations),
+        },
+        {
+            "operation": "bearer",
+            "before_us": per_call_us(lambda: call_bearer(use_cache=False), iterations),
+            "after_us": per_call_us(lambda: call_bearer(use_cache=True), iterations),
+        },
+    ]
+    loop.close()
+    return reports
@@ -1,8 +1,12 @@
 from pathlib import Path
+import base64
+import json
+from datetime import datetime
 from app.helpers.boto_helper import create_presigned_url
 from textwrap import shorten
-from typing import List, Optional, Dict
-from sqlalchemy import schema, select, update
+from typing import Any, Callable, List, Optional, Dict, Tuple
+from sqlalchemy import schema, select, update, tuple_, bindparam, and_, func
+from sqlalchemy.sql.sqltypes import Integer, String, TIMESTAMP
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
 from uuid import UUID
@@ -11,6 +15,151 @@ from sqlalchemy.orm import joinedload
 
 from app.db import model
 from app.db import schema
+from app.helpers.settings import settings
+from app.helpers.ttl_cache import TTLCache
+
+# resolved models for the prediction hot path, keyed by model id. Entries are
+# dropped by update_model / update_build in this process, other processes
+# (the builder, other workers) are bounded by the ttl
+model_cache = TTLCache(
+    name="model",
+    maxsize=settings.MODEL_CACHE_SIZE,
+    ttl=settings.MODEL_CACHE_TTL_SECONDS,
+)
+
+
+# statements are built once with bind parameters and reused, so SQLAlchemy
+# only compiles each query shape once per process and per call we skip
+# constructing the statement and generating its cache key. Queries with
+# optional filters get one statement per combination of filters present.
+statement_cache: Dict[Tuple, Any] = {}
+
+
+def cached_statement(key: Tuple, build: Callable) -> Any:
+    stmt = statement_cache.get(key)
+    if stmt == None:
+        stmt = build()
+        statement_cache[key] = stmt
+    return stmt
+
+
+def schema_columns(table, schema_class) -> List:
+    # only the columns the response schema returns, rows are read as plain
+    # tuples instead of ORM entities
+    return [
+        column
+        for column in table.__table__.columns
+        if column.key in schema_class.__fields__
+    ]
+
+
+def from_row(schema_class, row):
+    # validated, so enums and json columns are coerced like any schema object
+    return schema_class.parse_obj(dict(row))
+
+
+def response_from_row(schema_class, row):
+    # for listings that are only returned through a response_model, which
+    # validates them anyway, so pydantic validation is skipped here
+    return schema_class.construct(**row)
+
+
+build_columns = schema_columns(model.Build, schema.Build)
+model_columns = schema_columns(model.Model, schema.Model)
+run_columns = schema_columns(model.Run, schema.Run)
+
+
+def filter_params(filters: Dict[str, Any]) -> Tuple[Tuple, Dict]:
+    names = tuple(name for name, value in filters.items() if value != None)
+    return names, {name: filters[name] for name in names}
+
+
+def filter_where(table, names: Tuple) -> List:
+    return [getattr(table, name) == bindparam(name) for name in names]
+
+
+def encode_cursor(created_at: datetime, id: str) -> str:
+    raw = json.dumps([created_at.isoformat(), str(id)])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    try:
+        created_at, id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(created_at), str(UUID(id))
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+
+def next_cursor(items: List, limit: int) -> Optional[str]:
+    # a short page means there is nothing after it
+    if len(items) == 0 or len(items) < min(limit, 100):
+        return None
+    return encode_cursor(created_at=items[-1].created_at, id=items[-1].id)
+
+
+def paginate(stmt, table, cursor: Optional[str]):
+    # newest first, with id breaking ties so pages are stable and can be
+    # resumed from (created_at, id) using the composite indexes
+    stmt = stmt.order_by(table.created_at.desc(), table.id.desc()).limit(
+        bindparam("limit", type_=Integer)
+    )
+    if cursor != None:
+        return stmt.where(
+            tuple_(table.created_at, table.id)
+            < tuple_(
+                bindparam("cursor_created_at", type_=TIMESTAMP(timezone=True)),
+                bindparam("cursor_id", type_=table.id.type),
+            )
+        )
+
+    return stmt.offset(bindparam("offset", type_=Integer))
+
+
+def paginate_params(cursor: Optional[str], offset: int, limit: int) -> Dict:
+    if cursor != None:
+        created_at, id = decode_cursor(cursor)
+        return {"limit": limit, "cursor_created_at": created_at, "cursor_id": id}
+
+    return {"limit": limit, "offset": offset}
+
+
+def update_statement(table, key_name: str, update_values: Dict):
+    columns = tuple(sorted(update_values.keys()))
+
+    def build():
+        # bind names must not collide with the column names being set
+        return (
+            update(table)
+            .where(table.id == bindparam(key_name))
+            .values(
+                {
+                    column: bindparam(f"v_{column}", type_=getattr(table, column).type)
+                    for column in columns
+                }
+            )
+            .execution_options(synchronize_session="fetch")
+        )
+
+    stmt = cached_statement(("update", table.__tablename__, columns), build)
+    params = {f"v_{column}": value for column, value in update_values.items()}
+    return stmt, params
+
+
+get_user_stmt = select(model.User).where(model.User.id == bindparam("user_id"))
+get_build_by_id_stmt = select(model.Build).where(model.Build.id == bindparam("build_id"))
+get_model_by_id_stmt = (
+    select(model.Model)
+    .where(model.Model.id == bindparam("model_id"))
+    .options(joinedload(model.Model.active_build), joinedload(model.Model.user))
+)
+get_model_from_build_stmt = select(model.Model).where(
+    model.Model.github_username == bindparam("github_username"),
+    model.Model.repository == bindparam("repository"),
+    model.Model.notebook == bindparam("notebook"),
+    model.Model.user_id == bindparam("user_id"),
+)
+get_run_by_id_stmt = select(model.Run).where(model.Run.id == bindparam("run_id"))
 
 
 async def create_user_from_github(
@@ -35,9 +184,7 @@ async def create_user_from_github(
 
 
 async def get_user(session: AsyncSession, user_id: UUID) -> Optional[schema.User]:
-    stmt = select(model.User).where(model.User.id == str(user_id))
-
-    result = await session.execute(stmt)
+    result = await session.execute(get_user_stmt, {"user_id": str(user_id)})
     user = result.scalars().first()
     if user == None:
         return None
@@ -57,9 +204,7 @@ async def get_has_early_access(session: AsyncSession, email: str) -> bool:
 
 
 async def get_build_by_id(session: AsyncSession, build_id: UUID) -> schema.Build:
-    stmt = select(model.Build).where(model.Build.id == str(build_id))
-
-    result = await session.execute(stmt)
+    result = await session.execute(get_build_by_id_stmt, {"build_id": str(build_id)})
     existing_build = result.scalars().first()
     if existing_build == None:
         return None
@@ -78,38 +223,27 @@ async def get_build(
     commit: Optional[str] = None,
     status: Optional[str] = None,
 ) -> List[schema.Build]:
-
-    where_list = []
-    if model_id != None:
-        where_list.append(model.Build.model_id == model_id)
-
-    if user_id != None:
-        where_list.append(model.Build.user_id == user_id)
-
-    if github_username != None:
-        where_list.append(model.Build.github_username == github_username)
-
-    if repository != None:
-        where_list.append(model.Build.repository == repository)
-
-    if branch != None:
-        where_list.append(model.Build.branch == branch)
-
-    if notebook != None:
-        where_list.append(model.Build.notebook == notebook)
-
-    if commit != None:
-        where_list.append(model.Build.commit == commit)
-
-    if status != None:
-        where_list.append(model.Build.status == status)
-
-    stmt = select(model.Build).where(*where_list)
+    names, params = filter_params(
+        {
+            "model_id": model_id,
+            "user_id": user_id,
+            "github_username": github_username,
+            "repository": repository,
+            "branch": branch,
+            "notebook": notebook,
+            "commit": commit,
+            "status": status,
+        },
+    )
+    stmt = cached_statement(
+        ("get_build", names),
+        lambda: select(*build_columns).where(*filter_where(model.Build, names)),
+    )
 
     ret: List[schema.Build] = []
-    result = await session.execute(stmt)
-    for m in result.scalars():
-        build: schema.Build = schema.Build(**m.__dict__)
+    result = await session.execute(stmt, params)
+    for m in result.mappings():
+        build: schema.Build = from_row(schema.Build, m)
         ret.append(build)
 
     return ret
@@ -126,17 +260,14 @@ async def create_build(session: AsyncSession, build: schema.Build) -> schema.Bui
 async def update_build(
     session: AsyncSession, build_id: str, update_values: Dict
 ) -> schema.Build:
-    stmt = (
-        update(model.Build)
-        .where(
-            model.Build.id == str(build_id),
-        )
-        .values(update_values)
-        .execution_options(synchronize_session="fetch")
-    )
+    stmt, params = update_statement(model.Build, "build_id", update_values)
+    params["build_id"] = str(build_id)
 
-    result = await session.execute(stmt)
+    result = await session.execute(stmt, params)
     await session.commit()
+    if set(update_values.keys()) != {"last_run"}:
+        # last_run is bumped on every prediction and not used from the cache
+        model_cache.pop_where(lambda m: m.active_build_id == str(build_id))
     return result.rowcount == 1
 
     # stmt = select(model.Build).where(
@@ -163,14 +294,15 @@ async def update_build(
 async def get_model_from_build(
     session: AsyncSession, build: schema.Build
 ) -> schema.Model:
-    stmt = select(model.Model).where(
-        model.Model.github_username == str(build.github_username),
-        model.Model.repository == str(build.repository),
-        model.Model.notebook == str(build.notebook),
-        model.Model.user_id == str(build.user_id),
+    result = await session.execute(
+        get_model_from_build_stmt,
+        {
+            "github_username": str(build.github_username),
+            "repository": str(build.repository),
+            "notebook": str(build.notebook),
+            "user_id": str(build.user_id),
+        },
     )
-
-    result = await session.execute(stmt)
     existing_model = result.scalars().first()
     if existing_model == None:
         return None
@@ -178,21 +310,23 @@ async def get_model_from_build(
     return schema.Model(**existing_model.__dict__)
 
 
-async def get_model_by_id(session: AsyncSession, model_id: UUID) -> schema.Model:
-    stmt = (
-        select(model.Model)
-        .where(
-            model.Model.id == str(model_id),
-        )
-        .options(joinedload(model.Model.active_build), joinedload(model.Model.user))
-    )
+async def get_model_by_id(
+    session: AsyncSession, model_id: UUID, use_cache: bool = False
+) -> schema.Model:
+    if use_cache:
+        cached_model = model_cache.get(str(model_id))
+        if cached_model != None:
+            return cached_model
 
-    result = await session.execute(stmt)
+    result = await session.execute(get_model_by_id_stmt, {"model_id": str(model_id)})
     existing_model = result.scalars().first()
     if existing_model == None:
         return None
 
-    return schema.Model.from_orm(existing_model)
+    ret = schema.Model.from_orm(existing_model)
+    if use_cache:
+        model_cache.set(str(model_id), ret)
+    return ret
 
 
 async def get_models(
@@ -200,22 +334,25 @@ async def get_models(
     status: schema.ModelStatus = schema.ModelStatus.Public,
     offset: int = 0,
     limit: int = 10,
+    cursor: Optional[str] = None,
 ) -> List[schema.Model]:
     if limit > 100:
         limit = 100
-    stmt = (
-        select(model.Model)
-        .where(
-            model.Model.status == status,
-        )
-        .limit(limit=limit)
-        .offset(offset=offset)
+    stmt = cached_statement(
+        ("get_models", cursor != None),
+        lambda: paginate(
+            select(*model_columns).where(model.Model.status == bindparam("status")),
+            model.Model,
+            cursor=cursor,
+        ),
     )
+    params = paginate_params(cursor=cursor, offset=offset, limit=limit)
+    params["status"] = status
 
     ret: List[schema.Model] = []
-    result = await session.execute(stmt)
-    for m in result.scalars():
-        ret.append(schema.Model(**m.__dict__))
+    result = await session.execute(stmt, params)
+    for m in result.mappings():
+        ret.append(response_from_row(schema.Model, m))
 
     return ret
 
@@ -226,23 +363,29 @@ async def get_models_by_user_id(
     status: schema.ModelStatus = schema.ModelStatus.Public,
     offset: int = 0,
     limit: int = 10,
+    cursor: Optional[str] = None,
 ) -> List[schema.Model]:
     if limit > 100:
         limit = 100
-    stmt = (
-        select(model.Model)
-        .where(
-            model.Model.status == status,
-            model.Model.user_id == user_id,
-        )
-        .limit(limit=limit)
-        .offset(offset=offset)
+    stmt = cached_statement(
+        ("get_models_by_user_id", cursor != None),
+        lambda: paginate(
+            select(*model_columns).where(
+                model.Model.status == bindparam("status"),
+                model.Model.user_id == bindparam("user_id"),
+            ),
+            model.Model,
+            cursor=cursor,
+        ),
     )
+    params = paginate_params(cursor=cursor, offset=offset, limit=limit)
+    params["status"] = status
+    params["user_id"] = str(user_id)
 
     ret: List[schema.Model] = []
-    result = await session.execute(stmt)
-    for m in result.scalars():
-        ret.append(schema.Model(**m.__dict__))
+    result = await session.execute(stmt, params)
+    for m in result.mappings():
+        ret.append(response_from_row(schema.Model, m))
 
     return ret
 
@@ -269,17 +412,12 @@ async def create_model_from_build(
 async def update_model(
     session: AsyncSession, model_id: str, update_values: Dict
 ) -> bool:
-    stmt = (
-        update(model.Model)
-        .where(
-            model.Model.id == str(model_id),
-        )
-        .values(update_values)
-        .execution_options(synchronize_session="fetch")
-    )
+    stmt, params = update_statement(model.Model, "model_id", update_values)
+    params["model_id"] = str(model_id)
 
-    result = await session.execute(stmt)
+    result = await session.execute(stmt, params)
     await session.commit()
+    model_cache.pop(str(model_id))
     return result.rowcount == 1
 
 
@@ -293,6 +431,7 @@ async def create_run(
     model_id: str,
     duration_ms: int,
     build_id: str,
+    status: Optional[schema.RunStatus] = None,
 ) -> schema.Run:
     run = model.Run(
         **{
@@ -304,6 +443,7 @@ async def create_run(
             "model_id": model_id,
             "duration_ms": duration_ms,
             "build_id": build_id,
+            "status": status,
         }
     )
     session.add(run)
@@ -311,6 +451,36 @@ async def create_run(
     return schema.Run(**run.__dict__)
 
 
+async def update_run(session: AsyncSession, run_id: str, update_values: Dict) -> bool:
+    stmt, params = update_statement(model.Run, "run_id", update_values)
+    params["run_id"] = str(run_id)
+
+    result = await session.execute(stmt, params)
+    await session.commit()
+    return result.rowcount == 1
+
+
+expire_pending_runs_stmt = (
+    update(model.Run)
+    .where(
+        model.Run.status.in_([schema.RunStatus.Queued, schema.RunStatus.Running]),
+        model.Run.created_at < bindparam("before", type_=TIMESTAMP(timezone=True)),
+    )
+    .values(status=schema.RunStatus.Error, output_json=bindparam("output_json"))
+    .execution_options(synchronize_session=False)
+)
+
+
+async def expire_pending_runs(session: AsyncSession, before: datetime) -> int:
+    # async runs whose worker went away before the lambda returned
+    result = await session.execute(
+        expire_pending_runs_stmt,
+        {"before": before, "output_json": {"error": "Run did not finish"}},
+    )
+    await session.commit()
+    return result.rowcount
+
+
 async def get_runs(
     session: AsyncSession,
     model_id: str,
@@ -318,26 +488,45 @@ async def get_runs(
     user_id: str,
     offset: int = 0,
     limit: int = 10,
+    input_key: Optional[str] = None,
+    output_key: Optional[str] = None,
+    cursor: Optional[str] = None,
 ) -> List[schema.Run]:
     if limit > 100:
         limit = 100
 
-    where_list = []
-    if model_id != None:
-        where_list.append(model.Run.model_id == model_id)
-
-    if build_id != None:
-        where_list.append(model.Run.build_id == build_id)
-
-    if user_id != None:
-        where_list.append(model.Run.user_id == user_id)
+    names, params = filter_params(
+        {
+            "model_id": model_id,
+            "build_id": build_id,
+            "user_id": user_id,
+            "input_key": input_key,
+            "output_key": output_key,
+        }
+    )
 
-    stmt = select(model.Run).where(*where_list).limit(limit=limit).offset(offset=offset)
+    def build():
+        where_list = filter_where(
+            model.Run, tuple(n for n in names if not n.endswith("_key"))
+        )
+        # the key is a plain string, not a json document
+        if input_key != None:
+            where_list.append(
+                model.Run.input_json.has_key(bindparam("input_key", type_=String))
+            )
+        if output_key != None:
+            where_list.append(
+                model.Run.output_json.has_key(bindparam("output_key", type_=String))
+            )
+        return paginate(select(*run_columns).where(*where_list), model.Run, cursor=cursor)
+
+    stmt = cached_statement(("get_runs", names, cursor != None), build)
+    params.update(paginate_params(cursor=cursor, offset=offset, limit=limit))
 
     ret: List[schema.Run] = []
-    result = await session.execute(stmt)
-    for m in result.scalars():
-        run: schema.Run = schema.Run(**m.__dict__)
+    result = await session.execute(stmt, params)
+    for m in result.mappings():
+        run: schema.Run = response_from_row(schema.Run, m)
         ret.append(run)
 
     return ret
@@ -347,12 +536,43 @@ async def get_run_by_id(
     session: AsyncSession,
     run_id: str,
 ) -> Optional[schema.Run]:
-    stmt = select(model.Run).where(
-        model.Run.id == run_id,
-    )
-
-    result = await session.execute(stmt)
+    result = await session.execute(get_run_by_id_stmt, {"run_id": str(run_id)})
     for m in result.scalars():
         return schema.Run(**m.__dict__)
 
     return None
+
+
+warm_candidates_stmt = (
+    select(
+        model.Build.id,
+        model.Build.lambda_function_arn,
+        model.Build.last_run,
+        func.count(model.Run.id).label("runs"),
+        func.avg(model.Run.duration_ms).label("avg_duration_ms"),
+    )
+    .select_from(model.Model)
+    .join(model.Build, model.Build.id == model.Model.active_build_id)
+    .outerjoin(
+        model.Run,
+        and_(
+            model.Run.build_id == model.Build.id,
+            model.Run.created_at > bindparam("since"),
+        ),
+    )
+    .where(
+        model.Model.status != bindparam("deleted"),
+        model.Build.lambda_function_arn != None,
+        model.Build.last_run > bindparam("since"),
+    )
+    .group_by(model.Build.id)
+)
+
+
+async def get_warm_candidates(session: AsyncSession, since: datetime) -> List[Dict]:
+    # active builds with runs since the given time, for the lambda warmer
+    result = await session.execute(
+        warm_candidates_stmt,
+        {"since": since, "deleted": schema.ModelStatus.Deleted},
+    )
+    return [dict(m) for m in result.mappings()]
@@ -3,23 +3,118 @@
 # from fastapi import FastAPI
 # from pydantic import BaseModel
 
+import os
+import time
+from typing import Dict
 
+from sqlalchemy import event, exc
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.ext.asyncio import AsyncSession, AsyncEngine
 from sqlalchemy.ext.asyncio import create_async_engine
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy.pool import NullPool
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 import sqlalchemy as sa
 
+from app.helpers import metrics
 from app.helpers.settings import settings
+from app.helpers.logger import get_log
 
 
-engine = create_async_engine(
-    settings.SQLALCHEMY_DATABASE_URI, echo=False, poolclass=NullPool
-)
+class InstrumentedPool(AsyncAdaptedQueuePool):
+    waiting = 0
+
+    def _do_get(self):
+        # time spent here is the checkout latency seen by a request, including
+        # waiting on a full pool and opening a new connection
+        self.waiting += 1
+        before = time.time()
+        try:
+            return super()._do_get()
+        finally:
+            self.waiting -= 1
+            metrics.observe("db_pool_checkout_ms", (time.time() - before) * 1000)
+
+
+def create_engine(uri: str) -> AsyncEngine:
+    new_engine = create_async_engine(
+        uri,
+        echo=False,
+        poolclass=InstrumentedPool,
+        pool_size=settings.SQLALCHEMY_DATABASE_MAX_POOL,
+        max_overflow=settings.SQLALCHEMY_DATABASE_MAX_OVERFLOW,
+        pool_timeout=settings.SQLALCHEMY_DATABASE_POOL_TIMEOUT,
+        pool_recycle=settings.SQLALCHEMY_DATABASE_POOL_RECYCLE,
+        pool_pre_ping=True,
+    )
+
+    # https://docs.sqlalchemy.org/en/14/core/pooling.html#using-connection-pools-with-multiprocessing-or-os-fork
+    @event.listens_for(new_engine.sync_engine, "connect")
+    def connect(dbapi_connection, connection_record):
+        connection_record.info["pid"] = os.getpid()
+
+    @event.listens_for(new_engine.sync_engine, "checkout")
+    def checkout(dbapi_connection, connection_record, connection_proxy):
+        pid = os.getpid()
+        if connection_record.info["pid"] != pid:
+            connection_record.dbapi_connection = connection_proxy.dbapi_connection = None
+            raise exc.DisconnectionError(
+                f"Connection record belongs to pid {connection_record.info['pid']}, attempting to check out in pid {pid}"
+            )
+
+    return new_engine
+
+
+def pool_status(pool_engine: AsyncEngine) -> Dict:
+    pool = pool_engine.sync_engine.pool
+    return {
+        "size": pool.size(),
+        "checked_in": pool.checkedin(),
+        "checked_out": pool.checkedout(),
+        "overflow": pool.overflow(),
+        "waiting": getattr(pool, "waiting", 0),
+    }
+
+
+engine = create_engine(settings.SQLALCHEMY_DATABASE_URI)
 Base = declarative_base()
 async_session = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
 
+metrics.register("db_pool", lambda: pool_status(engine))
+
+# optional read replica for GET handlers, see get_read_session
+replica_engine = None
+replica_session = None
+if settings.SQLALCHEMY_DATABASE_REPLICA_URI != None:
+    replica_engine = create_engine(settings.SQLALCHEMY_DATABASE_REPLICA_URI)
+    replica_session = sessionmaker(
+        replica_engine, class_=AsyncSession, expire_on_commit=False
+    )
+    metrics.register("db_replica_pool", lambda: pool_status(replica_engine))
+    metrics.register("db_replica", lambda: dict(replica_state))
+
+# an idle replica has nothing to replay, so only count time since the last
+# replayed transaction while there is received wal still waiting
+REPLICA_LAG_SQL = """
+SELECT CASE
+    WHEN NOT pg_is_in_recovery() THEN 0
+    WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+    ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+END
+"""
+
+replica_state: Dict = {"checked_at": 0.0, "fresh": False, "lag": None}
+
+
+def _reinit_after_fork():
+    # connections inherited from the parent must not be used or closed by the
+    # child, so swap in an empty pool and let the child open its own
+    for fork_engine in [engine, replica_engine]:
+        if fork_engine != None:
+            fork_engine.sync_engine.pool = fork_engine.sync_engine.pool.recreate()
+
+
+os.register_at_fork(after_in_child=_reinit_after_fork)
+
 
 async def init_models():
     async with engine.begin() as conn:
@@ -32,8 +127,50 @@ async def init_models():
 
 async def dispose():
     await engine.dispose()
+    if replica_engine != None:
+        await replica_engine.dispose()
 
 
 async def get_session() -> AsyncSession:
     async with async_session() as session:
         yield session
+
+
+async def replica_is_fresh() -> bool:
+    now = time.monotonic()
+    since_check = now - replica_state["checked_at"]
+    if since_check < settings.SQLALCHEMY_REPLICA_LAG_CHECK_SECONDS:
+        return replica_state["fresh"]
+
+    # claim the check before awaiting so concurrent requests reuse the last result
+    replica_state["checked_at"] = now
+    try:
+        async with replica_engine.connect() as conn:
+            lag = (await conn.execute(sa.text(REPLICA_LAG_SQL))).scalar()
+        replica_state["lag"] = float(lag) if lag != None else None
+        replica_state["fresh"] = (
+            lag != None and lag <= settings.SQLALCHEMY_REPLICA_MAX_LAG_SECONDS
+        )
+    except Exception:
+        get_log(name=__name__).error("replica lag check failed", exc_info=True)
+        replica_state["lag"] = None
+        replica_state["fresh"] = False
+
+    if not replica_state["fresh"]:
+        metrics.incr("db_replica_unavailable")
+    return replica_state["fresh"]
+
+
+async def get_read_session() -> AsyncSession:
+    # read only handlers use the replica when it is configured and caught up,
+    # otherwise they fall back to the primary
+    use_replica = replica_session != None and await replica_is_fresh()
+    target = "replica" if use_replica else "primary"
+    metrics.incr(f"db_read_sessions_{target}")
+
+    before = time.time()
+    try:
+        async with (replica_session if use_replica else async_session)() as session:
+            yield session
+    finally:
+        metrics.observe(f"db_read_session_{target}_ms", (time.time() - before) * 1000)
@@ -0,0 +1,238 @@
+import hashlib
+import json
+from datetime import datetime
+from typing import Callable, Dict, List, Tuple
+from uuid import UUID
+
+import sqlalchemy as sa
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession
+
+from app.db import crud
+from app.db import schema
+from app.db.database import engine
+
+# synthetic rows are inserted and EXPLAINed inside one transaction that is
+# always rolled back, so the advisor can point at any database
+SEED_SQL = [
+    """
+    INSERT INTO user_account (id, email, github_id, github_username, type, created_at)
+    SELECT md5('seed-user-' || i)::uuid, 'seed-user-' || i || '@example.com',
+        'seed-user-' || i, 'seed-user-' || i, 'GithubVerified',
+        now() - i * interval '1 minute'
+    FROM generate_series(0, :users - 1) i
+    """,
+    """
+    INSERT INTO build (id, model_id, github_username, repository, branch, notebook,
+        commit, user_id, status, input_json, output_json, created_at)
+    SELECT md5('seed-build-' || i)::uuid, md5('seed-model-' || i)::uuid::text,
+        'seed-user-' || (i % :users), 'repo-' || i, 'main', 'notebook-' || i || '.ipynb',
+        md5('commit-' || i), md5('seed-user-' || (i % :users))::uuid,
+        CASE WHEN i % 20 = 0 THEN 'Started' ELSE 'Finished' END,
+        '{"text input": "Text"}'::jsonb, '{"text output": "Text"}'::jsonb,
+        now() - i * interval '1 second'
+    FROM generate_series(0, :models - 1) i
+    """,
+    """
+    INSERT INTO model (id, github_username, repository, notebook, user_id,
+        active_build_id, status, created_at)
+    SELECT md5('seed-model-' || i)::uuid, 'seed-user-' || (i % :users), 'repo-' || i,
+        'notebook-' || i || '.ipynb', md5('seed-user-' || (i % :users))::uuid,
+        md5('seed-build-' || i)::uuid,
+        CASE WHEN i % 10 = 0 THEN 'Draft' ELSE 'Public' END,
+        now() - i * interval '1 second'
+    FROM generate_series(0, :models - 1) i
+    """,
+    """
+    INSERT INTO run (id, user_id, github_username, input_json, output_json,
+        model_id, build_id, duration_ms, created_at)
+    SELECT md5('seed-run-' || i)::uuid, md5('seed-user-' || (i % :users))::uuid,
+        'seed-user-' || (i % :users),
+        CASE WHEN i % 1000 = 0 THEN '{"image input": "s3://bucket/key.jpg"}'::jsonb
+            ELSE '{"text input": "abc"}'::jsonb END,
+        '{"text output": "abc"}'::jsonb,
+        md5('seed-model-' || (i % :models))::uuid, md5('seed-build-' || (i % :models))::uuid,
+        i % 1000, now() - i * interval '1 second'
+    FROM generate_series(0, :runs - 1) i
+    """,
+]
+
+
+def seed_id(prefix: str, i: int) -> str:
+    return str(UUID(hashlib.md5(f"seed-{prefix}-{i}".encode()).hexdigest()))
+
+
+def crud_queries(cursor_created_at: datetime) -> List[Tuple[str, Callable]]:
+    user_id = seed_id("user", 1)
+    model_id = seed_id("model", 1)
+    build_id = seed_id("build", 1)
+    run_id = seed_id("run", 1)
+    build = schema.Build(
+        github_username="seed-user-1",
+        repository="repo-1",
+        branch="main",
+        notebook="notebook-1.ipynb",
+        user_id=user_id,
+    )
+
+    return [
+        ("get_user", lambda s: crud.get_user(session=s, user_id=user_id)),
+        (
+            "get_build_by_id",
+            lambda s: crud.get_build_by_id(session=s, build_id=build_id),
+        ),
+        (
+            "get_build",
+            lambda s: crud.get_build(
+                session=s,
+                model_id=model_id,
+                user_id=user_id,
+                github_username="seed-user-1",
+                repository="repo-1",
+                notebook="notebook-1.ipynb",
+                commit=hashlib.md5(b"commit-1").hexdigest(),
+                status=schema.BuildStatus.Started,
+            ),
+        ),
+        (
+            "get_model_from_build",
+            lambda s: crud.get_model_from_build(session=s, build=build),
+        ),
+        (
+            "get_model_by_id",
+            lambda s: crud.get_model_by_id(session=s, model_id=model_id),
+        ),
+        ("get_models", lambda s: crud.get_models(session=s)),
+        (
+            "get_models_cursor",
+            lambda s: crud.get_models(
+                session=s,
+                cursor=crud.encode_cursor(
+                    created_at=cursor_created_at, id=seed_id("model", 50)
+                ),
+            ),
+        ),
+        (
+            "get_models_by_user_id",
+            lambda s: crud.get_models_by_user_id(session=s, user_id=user_id),
+        ),
+        (
+            "get_runs",
+            lambda s: crud.get_runs(
+                session=s, model_id=None, build_id=None, user_id=None
+            ),
+        ),
+        (
+            "get_runs_by_model",
+            lambda s: crud.get_runs(
+                session=s, model_id=model_id, build_id=None, user_id=None
+            ),
+        ),
+        (
+            "get_runs_by_user",
+            lambda s: crud.get_runs(
+                session=s, model_id=None, build_id=None, user_id=user_id
+            ),
+        ),
+        # one run in 1000 has an image input, so this one should use the gin
+        # index, while the common key walks created_at until the page is full
+        (
+            "get_runs_by_input_key",
+            lambda s: crud.get_runs(
+                session=s,
+                model_id=None,
+                build_id=None,
+                user_id=None,
+                input_key="image input",
+            ),
+        ),
+        (
+            "get_runs_by_common_key",
+            lambda s: crud.get_runs(
+                session=s,
+                model_id=None,
+                build_id=None,
+                user_id=None,
+                input_key="text input",
+            ),
+        ),
+        ("get_run_by_id", lambda s: crud.get_run_by_id(session=s, run_id=run_id)),
+    ]
+
+
+def find_nodes(plan: Dict, node_type: str) -> List[Dict]:
+    ret = []
+    if plan["Node Type"] == node_type:
+        ret.append(plan)
+    for child in plan.get("Plans", []):
+        ret.extend(find_nodes(child, node_type))
+    return ret
+
+
+async def seed(conn: AsyncConnection, runs: int) -> datetime:
+    models = max(runs // 10, 10)
+    users = max(runs // 100, 10)
+    for sql in SEED_SQL:
+        await conn.execute(
+            sa.text(sql), {"users": users, "models": models, "runs": runs}
+        )
+
+    for table in ["user_account", "build", "model", "run"]:
+        await conn.execute(sa.text(f"ANALYZE {table}"))
+
+    # a model part way down the public listing, to explain a second page
+    result = await conn.execute(
+        sa.text("SELECT created_at FROM model WHERE id = :id"),
+        {"id": seed_id("model", 50)},
+    )
+    return result.scalar()
+
+
+async def explain(runs: int = 100000) -> List[Dict]:
+    reports: List[Dict] = []
+    async with engine.connect() as conn:
+        transaction = await conn.begin()
+        try:
+            cursor_created_at = await seed(conn, runs=runs)
+
+            statements: List[Tuple[str, tuple]] = []
+
+            def capture(connection, cursor, statement, parameters, context, many):
+                statements.append((statement, parameters))
+
+            for name, query in crud_queries(cursor_created_at=cursor_created_at):
+                statements.clear()
+                event.listen(conn.sync_connection, "before_cursor_execute", capture)
+                try:
+                    async with AsyncSession(bind=conn) as session:
+                        await query(session)
+                finally:
+                    event.remove(
+                        conn.sync_connection, "before_cursor_execute", capture
+                    )
+
+                for statement, parameters in list(statements):
+                    result = await conn.exec_driver_sql(
+                        "EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + statement,
+                        parameters,
+                    )
+                    plan = result.scalar()
+                    if isinstance(plan, str):
+                        plan = json.loads(plan)
+                    plan = plan[0]
+                    reports.append(
+                        {
+                            "query": name,
+                            "seq_scans": [
+                                node["Relation Name"]
+                                for node in find_nodes(plan["Plan"], "Seq Scan")
+                            ],
+                            "execution_ms": plan["Execution Time"],
+                            "shared_hit_blocks": plan["Plan"]["Shared Hit Blocks"],
+                            "shared_read_blocks": plan["Plan"]["Shared Read Blocks"],
+                        }
+                    )
+        finally:
+            await transaction.rollback()
+
+    return reports
@@ -0,0 +1,281 @@
+import json
+from typing import Callable, List, Tuple
+
+import sqlalchemy as sa
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from app.db.database import Base, engine
+from app.db import model  # registers the tables on Base.metadata
+from app.helpers.logger import get_log
+from app.helpers.settings import settings
+
+# every migration runs once, in order, and is recorded in schema_version.
+# Workers only compare the stored version on boot, and migrate takes an
+# advisory lock so concurrent boots never race on DDL. Deploys run
+# `python -m app.main db-migrate` before starting the api.
+MIGRATION_LOCK_ID = 7240391
+
+SCHEMA_VERSION_SQL = """
+CREATE TABLE IF NOT EXISTS schema_version (
+    version INTEGER PRIMARY KEY,
+    name VARCHAR NOT NULL,
+    applied_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
+)
+"""
+
+async def create_models(conn: AsyncConnection):
+    await conn.execute(sa.text("CREATE EXTENSION IF NOT EXISTS pgcrypto"))
+    await conn.run_sync(Base.metadata.create_all)
+
+
+JSON_COLUMNS = [
+    ("build", "input_json"),
+    ("build", "output_json"),
+    ("run", "input_json"),
+    ("run", "output_json"),
+]
+
+
+async def sanitize_json_column(conn: AsyncConnection, table: str, column: str):
+    # json accepts NaN, Infinity and \u0000 that the cast to jsonb rejects,
+    # and one such row would abort the migration on every worker boot
+    after = None
+    while True:
+        result = await conn.execute(
+            sa.text(
+                f"SELECT id, {column}::text FROM {table} "
+                f"WHERE ({column}::text LIKE :nan "
+                f"OR {column}::text LIKE :infinity "
+                f"OR {column}::text LIKE :nul) "
+                "AND (CAST(:after AS uuid) IS NULL OR id > CAST(:after AS uuid)) "
+                "ORDER BY id LIMIT 500"
+            ),
+            {
+                "nan": "%NaN%",
+                "infinity": "%Infinity%",
+                "nul": "%\\\\u0000%",
+                "after": after,
+            },
+        )
+        rows = result.fetchall()
+        if len(rows) == 0:
+            return
+
+        for row_id, raw in rows:
+            value = model.sanitize_json(json.loads(raw))
+            await conn.execute(
+                sa.text(
+                    f"UPDATE {table} SET {column} = CAST(:value AS json) "
+                    "WHERE id = :id"
+                ),
+                {"value": json.dumps(value, allow_nan=False), "id": row_id},
+            )
+        after = str(rows[-1][0])
+
+
+async def json_columns_to_jsonb(conn: AsyncConnection):
+    for table, column in JSON_COLUMNS:
+        result = await conn.execute(
+            sa.text(
+                "SELECT data_type FROM information_schema.columns "
+                "WHERE table_name = :table AND column_name = :column"
+            ),
+            {"table": table, "column": column},
+        )
+        data_type = result.scalar()
+        if data_type != None and data_type != "jsonb":
+            await sanitize_json_column(conn, table=table, column=column)
+            # rows were written with json.dumps, so the cast converts in place
+            await conn.execute(
+                sa.text(
+                    f"ALTER TABLE {table} ALTER COLUMN {column} "
+                    f"TYPE JSONB USING {column}::jsonb"
+                )
+            )
+
+        await create_index(
+            conn, f"ix_{table}_{column}_gin", table, f"USING gin ({column})"
+        )
+
+
+PAGINATION_INDEXES = [
+    ("ix_model_status_created_at_id", "model", "status, created_at, id"),
+    (
+        "ix_model_user_id_status_created_at_id",
+        "model",
+        "user_id, status, created_at, id",
+    ),
+    ("ix_run_model_id_created_at_id", "run", "model_id, created_at, id"),
+    ("ix_run_build_id_created_at_id", "run", "build_id, created_at, id"),
+    ("ix_run_user_id_created_at_id", "run", "user_id, created_at, id"),
+]
+
+
+async def create_index(conn: AsyncConnection, name: str, table: str, definition: str):
+    # concurrently, so reads and writes go on while the index builds. a build
+    # that failed leaves an invalid index, which IF NOT EXISTS would keep.
+    result = await conn.execute(
+        sa.text(
+            "SELECT NOT i.indisvalid FROM pg_index i "
+            "JOIN pg_class c ON c.oid = i.indexrelid WHERE c.relname = :name"
+        ),
+        {"name": name},
+    )
+    if result.scalar():
+        await conn.execute(sa.text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+    await conn.execute(
+        sa.text(
+            f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} {definition}"
+        )
+    )
+
+
+async def create_indexes(conn: AsyncConnection, indexes: List[Tuple[str, str, str]]):
+    for name, table, columns in indexes:
+        await create_index(conn, name, table, f"({columns})")
+
+
+async def pagination_indexes(conn: AsyncConnection):
+    await create_indexes(conn, PAGINATION_INDEXES)
+
+
+QUERY_INDEXES = [
+    # crud.get_build, always filtered on model_id and usually on status
+    ("ix_build_model_id_status", "build", "model_id, status"),
+    # crud.get_model_from_build on every POST /build/
+    (
+        "ix_model_github_username_repository_notebook_user_id",
+        "model",
+        "github_username, repository, notebook, user_id",
+    ),
+]
+
+
+async def query_indexes(conn: AsyncConnection):
+    await create_indexes(conn, QUERY_INDEXES)
+
+
+async def model_config_json(conn: AsyncConnection):
+    await conn.execute(
+        sa.text("ALTER TABLE model ADD COLUMN IF NOT EXISTS config_json JSONB")
+    )
+
+
+async def run_status(conn: AsyncConnection):
+    await conn.execute(
+        sa.text("ALTER TABLE run ADD COLUMN IF NOT EXISTS status VARCHAR")
+    )
+    # only async runs still waiting on their lambda, see crud.expire_pending_runs
+    await create_index(
+        conn,
+        "ix_run_pending_created_at",
+        "run",
+        "(created_at) WHERE status IN ('Queued', 'Running')",
+    )
+
+
+async def run_created_at_index(conn: AsyncConnection):
+    # crud.paginate on runs without a model, build or user filter, and the
+    # input_key / output_key filters that order by it too
+    await create_indexes(conn, [("ix_run_created_at_id", "run", "created_at, id")])
+
+
+async def build_template_version(conn: AsyncConnection):
+    # existing builds stay NULL, they predate spilled inputs
+    await conn.execute(
+        sa.text("ALTER TABLE build ADD COLUMN IF NOT EXISTS template_version INTEGER")
+    )
+
+
+# append only, never renumber or edit a migration that has shipped. the last
+# field is whether it runs in one transaction, migrations that build indexes
+# run in autocommit, one statement at a time, and must be safe to run again.
+MIGRATIONS: List[Tuple[int, str, Callable, bool]] = [
+    (1, "create_models", create_models, True),
+    (2, "json_columns_to_jsonb", json_columns_to_jsonb, False),
+    (3, "pagination_indexes", pagination_indexes, False),
+    (4, "query_indexes", query_indexes, False),
+    (5, "model_config_json", model_config_json, True),
+    (6, "run_status", run_status, False),
+    (7, "run_created_at_index", run_created_at_index, False),
+    (8, "build_template_version", build_template_version, True),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+async def current_version(conn: AsyncConnection) -> int:
+    result = await conn.execute(sa.text("SELECT to_regclass('schema_version')"))
+    if result.scalar() == None:
+        return 0
+
+    result = await conn.execute(sa.text("SELECT max(version) FROM schema_version"))
+    version = result.scalar()
+    return version if version != None else 0
+
+
+async def record_version(conn: AsyncConnection, version: int, name: str):
+    await conn.execute(
+        sa.text("INSERT INTO schema_version (version, name) VALUES (:v, :n)"),
+        {"v": version, "n": name},
+    )
+
+
+async def migrate() -> int:
+    # a session lock on its own connection, held across the migrations that
+    # run in autocommit. that connection never sits in a transaction, which
+    # CREATE INDEX CONCURRENTLY would wait on.
+    async with engine.connect() as lock_conn:
+        lock_conn = await lock_conn.execution_options(isolation_level="AUTOCOMMIT")
+        await lock_conn.execute(
+            sa.text("SELECT pg_advisory_lock(:id)"), {"id": MIGRATION_LOCK_ID}
+        )
+        try:
+            async with engine.begin() as conn:
+                await conn.execute(sa.text(SCHEMA_VERSION_SQL))
+                version = await current_version(conn)
+
+            for migration_version, name, migration, transactional in MIGRATIONS:
+                if migration_version <= version:
+                    continue
+
+                get_log(name=__name__).info(
+                    f"Running migration {migration_version} {name}"
+                )
+                if transactional:
+                    async with engine.begin() as conn:
+                        await migration(conn)
+                        await record_version(conn, migration_version, name)
+                else:
+                    async with engine.connect() as conn:
+                        conn = await conn.execution_options(
+                            isolation_level="AUTOCOMMIT"
+                        )
+                        await migration(conn)
+                        await record_version(conn, migration_version, name)
+                version = migration_version
+
+            return version
+        finally:
+            await lock_conn.execute(
+                sa.text("SELECT pg_advisory_unlock(:id)"), {"id": MIGRATION_LOCK_ID}
+            )
+
+
+async def check_schema_version():
+    async with engine.connect() as conn:
+        version = await current_version(conn)
+
+    if version >= LATEST_VERSION:
+        return
+
+    if not settings.DATABASE_AUTO_MIGRATE:
+        raise RuntimeError(
+            f"Database schema is at version {version}, expected {LATEST_VERSION}. "
+            "Run python -m app.main db-migrate"
+        )
+
+    get_log(name=__name__).info(
+        f"Database schema is at version {version}, migrating to {LATEST_VERSION}"
+    )
+    await migrate()
@@ -1,11 +1,12 @@
-import json
+import math
+from typing import Any
 
-from sqlalchemy import Column, String, Integer, DefaultClause, ForeignKey, text
+from sqlalchemy import Column, String, Integer, DefaultClause, ForeignKey, Index, text
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql.schema import ForeignKey
 from sqlalchemy.sql.sqltypes import Boolean, TIMESTAMP
-from sqlalchemy.dialects.postgresql import UUID
-from sqlalchemy.types import TypeDecorator, VARCHAR
+from sqlalchemy.types import TypeDecorator
+from sqlalchemy.dialects.postgresql import UUID, JSONB
 from sqlalchemy.ext.mutable import MutableDict
 
 from sqlalchemy.sql import func
@@ -13,24 +14,32 @@ from sqlalchemy.sql import func
 from app.db.database import Base
 from app.db import schema
 
-# https://docs.sqlalchemy.org/en/14/core/custom_types.html#marshal-json-strings
-class JSONEncodedDict(TypeDecorator):
-    impl = VARCHAR
-    cache_ok = True
 
-    def process_bind_param(self, value, dialect):
-        if value is not None:
-            value = json.dumps(value)
+def sanitize_json(value: Any) -> Any:
+    # jsonb rejects NaN and Infinity, which json.dumps writes, and \u0000 in
+    # strings. model outputs have both, they become null and are dropped.
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    if isinstance(value, str):
+        return value.replace("\x00", "")
+    if isinstance(value, dict):
+        return {sanitize_json(k): sanitize_json(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [sanitize_json(v) for v in value]
+    return value
+
 
-        return value
+class SanitizedJSONB(TypeDecorator):
+    impl = JSONB
+    cache_ok = True
 
-    def process_result_value(self, value, dialect):
-        if value is not None:
-            value = json.loads(value)
-        return value
+    def process_bind_param(self, value, dialect):
+        return sanitize_json(value)
 
 
-json_type = MutableDict.as_mutable(JSONEncodedDict)
+# stored as jsonb so postgres parses the documents once on write and they can
+# be indexed and filtered on, see migrations.json_columns_to_jsonb
+json_type = MutableDict.as_mutable(SanitizedJSONB)
 
 
 class User(Base):
@@ -88,9 +97,16 @@ class Build(Base):
     release_notes = Column(String, nullable=True)
     build_log = Column(String, nullable=True)
     last_run = Column(TIMESTAMP(timezone=True), nullable=True)
+    template_version = Column(Integer, nullable=True)
     created_at = Column("created_at", TIMESTAMP(timezone=True), default=func.now())
     updated_at = Column("updated_at", TIMESTAMP(timezone=True), onupdate=func.now())
 
+    __table_args__ = (
+        Index("ix_build_model_id_status", model_id, status),
+        Index("ix_build_input_json_gin", input_json, postgresql_using="gin"),
+        Index("ix_build_output_json_gin", output_json, postgresql_using="gin"),
+    )
+
 
 class Model(Base):
     __tablename__ = "model"
@@ -111,9 +127,24 @@ class Model(Base):
     credits = Column(String, nullable=True)
     tags = Column(String, nullable=True)
     status = Column(String, nullable=True)
+    config_json = Column(json_type, nullable=True)
     created_at = Column("created_at", TIMESTAMP(timezone=True), default=func.now())
     updated_at = Column("updated_at", TIMESTAMP(timezone=True), onupdate=func.now())
 
+    __table_args__ = (
+        Index(
+            "ix_model_github_username_repository_notebook_user_id",
+            github_username,
+            repository,
+            notebook,
+            user_id,
+        ),
+        Index("ix_model_status_created_at_id", status, created_at, id),
+        Index(
+            "ix_model_user_id_status_created_at_id", user_id, status, created_at, id
+        ),
+    )
+
 
 class Run(Base):
     __tablename__ = "run"
@@ -127,4 +158,19 @@ class Run(Base):
     model_id = Column(UUID, ForeignKey("model.id"), nullable=False, index=True)
     build_id = Column(UUID, ForeignKey("build.id"), nullable=True, index=False)
     duration_ms = Column(Integer, nullable=True)
+    status = Column(String, nullable=True)
     created_at = Column("created_at", TIMESTAMP(timezone=True), default=func.now())
+
+    __table_args__ = (
+        Index("ix_run_input_json_gin", input_json, postgresql_using="gin"),
+        Index("ix_run_output_json_gin", output_json, postgresql_using="gin"),
+        Index("ix_run_created_at_id", created_at, id),
+        Index("ix_run_model_id_created_at_id", model_id, created_at, id),
+        Index("ix_run_build_id_created_at_id", build_id, created_at, id),
+        Index("ix_run_user_id_created_at_id", user_id, created_at, id),
+        Index(
+            "ix_run_pending_created_at",
+            created_at,
+            postgresql_where=text("status IN ('Queued', 'Running')"),
+        ),
+    )
@@ -0,0 +1,197 @@
+import asyncio
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from sqlalchemy import update
+from sqlalchemy.exc import DataError, DBAPIError, IntegrityError, StatementError
+from sqlalchemy.dialects.postgresql import insert
+
+from app.db import model
+from app.db.database import async_session
+from app.helpers import metrics
+from app.helpers.logger import get_log
+from app.helpers.settings import settings
+
+
+class RunWriterFull(Exception):
+    def __init__(self, retry_after: int = 1):
+        super().__init__("Too many runs waiting to be saved, try again later")
+        self.retry_after = retry_after
+
+
+class RunWriter:
+    # runs are buffered in memory and written every flush_interval_ms or
+    # max_rows, whichever comes first, as one multi-row insert plus a single
+    # last_run update per build
+    def __init__(self, flush_interval_ms: int, max_rows: int, max_pending: int):
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_rows = max_rows
+        self.max_pending = max_pending
+        self._rows: List[Dict] = []
+        self._last_runs: Dict[str, datetime] = {}
+        # rows by run id until they are committed, including during a flush
+        self._pending: Dict[str, Dict] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+        metrics.register("run_writer", self.stats)
+
+    async def add(self, row: Dict):
+        # a full buffer is flushed by the caller, and if the database still
+        # takes nothing the request fails instead of the run being dropped
+        if len(self._rows) >= self.max_pending:
+            metrics.incr("run_writer_backpressure")
+            await self.flush()
+            if len(self._rows) >= self.max_pending:
+                metrics.incr("run_writer_full")
+                raise RunWriterFull()
+
+        self._rows.append(row)
+        self._pending[str(row["id"])] = row
+        self.touch_build(build_id=row["build_id"], last_run=row["created_at"])
+
+        if len(self._rows) >= self.max_rows and self._wakeup != None:
+            self._wakeup.set()
+
+    def touch_build(self, build_id: Optional[str], last_run: datetime):
+        if build_id == None:
+            return
+        previous = self._last_runs.get(build_id)
+        if previous == None or previous < last_run:
+            self._last_runs[build_id] = last_run
+
+    def is_pending(self, run_id: str) -> bool:
+        return str(run_id) in self._pending
+
+    def get_pending(self, run_id: str) -> Optional[Dict]:
+        return self._pending.get(str(run_id))
+
+    def stats(self) -> Dict:
+        return {"pending_rows": len(self._rows), "pending_builds": len(self._last_runs)}
+
+    async def start(self):
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task = asyncio.ensure_future(self._job())
+
+    async def stop(self):
+        if self._task != None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        # drain, a failed flush puts its rows back so give up after a few tries
+        for _ in range(3):
+            if len(self._rows) == 0 and len(self._last_runs) == 0:
+                break
+            await self.flush()
+
+    async def _job(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def _insert(self, rows: List[Dict]):
+        async with async_session() as session:
+            # chunked so rows put back by a failed flush stay under the bind
+            # parameter limit
+            for i in range(0, len(rows), self.max_rows):
+                # a duplicate run id must not fail the rest of the batch
+                await session.execute(
+                    insert(model.Run)
+                    .values(rows[i : i + self.max_rows])
+                    .on_conflict_do_nothing(index_elements=["id"])
+                )
+            await session.commit()
+
+    async def _update_builds(self, last_runs: Dict[str, datetime]):
+        async with async_session() as session:
+            for build_id, last_run in last_runs.items():
+                await session.execute(
+                    update(model.Build)
+                    .where(model.Build.id == str(build_id))
+                    .values(last_run=last_run)
+                )
+            await session.commit()
+
+    async def _insert_one_by_one(self, rows: List[Dict]) -> List[Dict]:
+        # after a failed batch, so a row postgres rejects costs only that row.
+        # returns the rows to try again, which is the rest once the database
+        # itself fails.
+        for i, row in enumerate(rows):
+            try:
+                await self._insert([row])
+                metrics.incr("run_writer_rows")
+            except Exception as e:
+                if not is_bad_row(e):
+                    return rows[i:]
+                metrics.incr("run_writer_dead_letters")
+                get_log(name=__name__).error(
+                    f"run writer dropped run {row['id']} of model "
+                    f"{row.get('model_id')} build {row.get('build_id')}: {e}"
+                )
+            self._pending.pop(str(row["id"]), None)
+        return []
+
+    async def flush(self):
+        if self._flush_lock == None:
+            self._flush_lock = asyncio.Lock()
+
+        async with self._flush_lock:
+            rows, self._rows = self._rows, []
+            last_runs, self._last_runs = self._last_runs, {}
+            if len(rows) == 0 and len(last_runs) == 0:
+                return
+
+            before = time.time()
+            if len(rows) > 0:
+                try:
+                    await self._insert(rows)
+                    for row in rows:
+                        self._pending.pop(str(row["id"]), None)
+                    metrics.incr("run_writer_rows", len(rows))
+                except Exception:
+                    get_log(name=__name__).error(
+                        f"run writer flush of {len(rows)} rows failed", exc_info=True
+                    )
+                    metrics.incr("run_writer_flush_errors")
+                    # whatever could not be written goes back in front
+                    self._rows = await self._insert_one_by_one(rows) + self._rows
+
+            try:
+                if len(last_runs) > 0:
+                    await self._update_builds(last_runs)
+            except Exception:
+                get_log(name=__name__).error(
+                    "run writer build update failed", exc_info=True
+                )
+                metrics.incr("run_writer_flush_errors")
+                for build_id, last_run in last_runs.items():
+                    self.touch_build(build_id=build_id, last_run=last_run)
+                return
+
+            metrics.incr("run_writer_flushes")
+            metrics.observe("run_writer_flush_ms", (time.time() - before) * 1000)
+
+
+def is_bad_row(e: Exception) -> bool:
+    # errors caused by the row's own values, such as NaN or \u0000 in jsonb
+    # or a missing model, build or user. connection errors are not.
+    if isinstance(e, (DataError, IntegrityError)):
+        return True
+    return isinstance(e, StatementError) and not isinstance(e, DBAPIError)
+
+
+run_writer = RunWriter(
+    flush_interval_ms=settings.RUN_WRITER_FLUSH_INTERVAL_MS,
+    max_rows=settings.RUN_WRITER_MAX_ROWS,
+    max_pending=settings.RUN_WRITER_MAX_PENDING,
+)
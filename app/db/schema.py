@@ -6,8 +6,7 @@ from sqlalchemy.sql.sqltypes import Boolean
 from app.helpers.autocomplete import autocomplete
 from typing import Any, Dict, AnyStr, List, Union
 from datetime import datetime
-from app.helpers.boto_helper import create_presigned_url
-from pathlib import Path
+from app.helpers.url_signer import media_ref, thumb_uri, url_signer
 
 
 class UserType(str, Enum):
@@ -105,6 +104,12 @@ class Notebook(BaseModel):
         orm_mode = False
 
 
+# bumped when lambda_template/app.py changes what it accepts, builds record
+# the version they were made from. 2 reads inputs spilled to s3.
+TEMPLATE_VERSION = 2
+SPILLED_INPUT_TEMPLATE_VERSION = 2
+
+
 class BuildStatus(str, Enum):
     NotStarted = "NotStarted"
     Queued = "Queued"
@@ -134,10 +139,15 @@ class Build(BaseModel):
     release_notes: Optional[str]
     build_log: Optional[str]
     last_run: Optional[datetime]
+    template_version: Optional[int]
 
     class Config:
         orm_mode = True
 
+    def reads_spilled_input(self) -> bool:
+        # builds from before template versions ignore input_s3_uri
+        return (self.template_version or 0) >= SPILLED_INPUT_TEMPLATE_VERSION
+
     def get_github_url(self):
         branch = self.commit if self.commit != None else self.branch
         return f"http://github.com/{self.github_username}/{self.repository}/blob/{branch}/{self.notebook}"
@@ -166,6 +176,7 @@ class Model(BaseModel):
     active_build: Optional[Build]
     tags: Optional[str]
     status: Optional[ModelStatus]
+    config_json: Optional[Dict]
     updated_at: Optional[datetime]
     created_at: Optional[datetime]
 
@@ -174,6 +185,19 @@ class Model(BaseModel):
         use_enum_values = True
         arbitrary_types_allowed = True
 
+    def get_config(self, key: str, default: Any = None) -> Any:
+        # per model options set by the owner through PUT /model/{model_id}
+        if self.config_json == None:
+            return default
+        return self.config_json.get(key, default)
+
+
+class RunStatus(str, Enum):
+    Queued = "Queued"
+    Running = "Running"
+    Finished = "Finished"
+    Error = "Error"
+
 
 @autocomplete
 class Run(BaseModel):
@@ -186,39 +210,54 @@ class Run(BaseModel):
     user_id: Optional[str]
     github_username: Optional[str]
     duration_ms: Optional[int]
+    status: Optional[RunStatus]
     created_at: Optional[datetime]
 
     class Config:
         orm_mode = True
+        use_enum_values = True
 
-    def add_signed_urls(self):
-        self.thumb_json = {}
+    def is_pending(self) -> bool:
+        # runs from before status was recorded are all finished
+        return self.status in [RunStatus.Queued, RunStatus.Running]
+
+    def s3_uris(self) -> List[str]:
+        uris = []
+        for fields in [self.input_json, self.output_json]:
+            for value in (fields or {}).values():
+                if isinstance(value, str) and value.startswith("s3://"):
+                    uris += [value, thumb_uri(value)]
+        return uris
 
-        for key, value in self.input_json.items():
-            if value.startswith("s3://"):
-                self.input_json[key] = create_presigned_url(
-                    bucket_name=Path(value).parts[1],
-                    object_name="/".join(Path(value).parts[2:]),
-                )
-                self.thumb_json[self.input_json[key]] = create_presigned_url(
-                    bucket_name=Path(value).parts[1],
-                    object_name="/".join(Path(value).parts[2:]).replace(
-                        ".jpg", "-thumb.jpg"
-                    ),
-                )
-
-        for key, value in self.output_json.items():
-            if value.startswith("s3://"):
-                self.output_json[key] = create_presigned_url(
-                    bucket_name=Path(value).parts[1],
-                    object_name="/".join(Path(value).parts[2:]),
-                )
-                self.thumb_json[self.output_json[key]] = create_presigned_url(
-                    bucket_name=Path(value).parts[1],
-                    object_name="/".join(Path(value).parts[2:]).replace(
-                        ".jpg", "-thumb.jpg"
-                    ),
-                )
+    def add_signed_urls(self, signed_urls: Optional[Dict[str, str]] = None):
+        # signed_urls comes from sign_runs when a whole page is signed at once
+        if signed_urls == None:
+            signed_urls = url_signer.sign_all(self.s3_uris())
+
+        self.thumb_json = {}
+        for fields in [self.input_json, self.output_json]:
+            for key, value in (fields or {}).items():
+                if isinstance(value, str) and value.startswith("s3://"):
+                    fields[key] = signed_urls[value]
+                    self.thumb_json[fields[key]] = signed_urls[thumb_uri(value)]
+
+    def add_media_refs(self):
+        # like add_signed_urls, but nothing is signed until a url is followed
+        self.thumb_json = {}
+        for fields in [self.input_json, self.output_json]:
+            for key, value in (fields or {}).items():
+                if isinstance(value, str) and value.startswith("s3://"):
+                    fields[key] = media_ref(run_id=self.id, field=key)
+                    self.thumb_json[fields[key]] = media_ref(
+                        run_id=self.id, field=key, thumb=True
+                    )
+
+
+def sign_runs(runs: List[Run]):
+    # one signing pass for a page of runs, objects they share are signed once
+    signed_urls = url_signer.sign_all(uri for run in runs for uri in run.s3_uris())
+    for run in runs:
+        run.add_signed_urls(signed_urls=signed_urls)
 
 
 JSONObject = Dict[AnyStr, Any]
@@ -0,0 +1,158 @@
+import asyncio
+import math
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Dict, Optional
+
+from app.helpers import metrics
+from app.helpers.settings import settings
+
+
+class RateLimited(Exception):
+    def __init__(self, message: str, retry_after: float = 1):
+        super().__init__(message)
+        self.retry_after = max(math.ceil(retry_after), 1)
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self) -> float:
+        # returns 0 when a token was taken, otherwise the seconds until one is
+        # available
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+def model_limits(config_json: Optional[Dict]) -> Dict:
+    # per model overrides in config_json, e.g.
+    # {"rate_per_second": 5, "user_rate_per_second": 1, "max_concurrency": 10}
+    config = config_json or {}
+    rate = config.get("rate_per_second", settings.PREDICTION_RATE_PER_SECOND)
+    user_rate = config.get(
+        "user_rate_per_second", settings.PREDICTION_USER_RATE_PER_SECOND
+    )
+    return {
+        "rate_per_second": rate,
+        "rate_burst": config.get("rate_burst", settings.PREDICTION_RATE_BURST),
+        "user_rate_per_second": user_rate,
+        "user_rate_burst": config.get(
+            "user_rate_burst", settings.PREDICTION_USER_RATE_BURST
+        ),
+        "max_concurrency": config.get(
+            "max_concurrency", settings.PREDICTION_MAX_CONCURRENCY
+        ),
+    }
+
+
+def new_bucket(rate: Optional[float], burst: Optional[float]) -> Optional[TokenBucket]:
+    if not rate:
+        return None
+    return TokenBucket(rate=rate, burst=burst or max(rate, 1))
+
+
+class ModelAdmission:
+    # a model's request rate, the rate of each user of it, and how many of its
+    # invocations run at once in this worker. requests over the rate are
+    # rejected, requests over the concurrency wait up to queue_seconds.
+    def __init__(self, model_id: str, limits: Dict):
+        self.model_id = model_id
+        self.limits = limits
+        self.bucket = new_bucket(limits["rate_per_second"], limits["rate_burst"])
+        self.user_buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self.max_concurrency = limits["max_concurrency"]
+        self.in_flight = 0
+        self.waiting = 0
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    def user_bucket(self, user_key: str) -> Optional[TokenBucket]:
+        bucket = self.user_buckets.get(user_key)
+        if bucket != None:
+            self.user_buckets.move_to_end(user_key)
+            return bucket
+
+        bucket = new_bucket(
+            self.limits["user_rate_per_second"], self.limits["user_rate_burst"]
+        )
+        if bucket != None:
+            self.user_buckets[user_key] = bucket
+            while len(self.user_buckets) > settings.PREDICTION_ADMISSION_MAX_USERS:
+                self.user_buckets.popitem(last=False)
+        return bucket
+
+    def check_rate(self, user_key: str):
+        user_bucket = self.user_bucket(user_key)
+        if user_bucket != None:
+            wait = user_bucket.take()
+            if wait > 0:
+                metrics.incr("admission_rejected_user_rate")
+                raise RateLimited("Too many predictions, slow down", wait)
+
+        if self.bucket != None:
+            wait = self.bucket.take()
+            if wait > 0:
+                metrics.incr("admission_rejected_rate")
+                raise RateLimited("Model is busy, try again later", wait)
+
+    @asynccontextmanager
+    async def slot(self, timeout: Optional[float]):
+        if not self.max_concurrency:
+            yield
+            return
+
+        if self._semaphore == None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        before = time.time()
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout)
+        except asyncio.TimeoutError:
+            metrics.incr("admission_rejected_concurrency")
+            raise RateLimited("Model is busy, try again later")
+        finally:
+            self.waiting -= 1
+            metrics.observe("admission_queue_ms", (time.time() - before) * 1000)
+
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+
+    def stats(self) -> Dict:
+        return {"in_flight": self.in_flight, "waiting": self.waiting}
+
+
+# per model, for this worker process
+admissions: Dict[str, ModelAdmission] = {}
+
+metrics.register(
+    "admission",
+    lambda: {
+        model_id: a.stats()
+        for model_id, a in admissions.items()
+        if a.in_flight > 0 or a.waiting > 0
+    },
+)
+
+
+def get_admission(model_id: str, config_json: Optional[Dict]) -> ModelAdmission:
+    limits = model_limits(config_json)
+    admission = admissions.get(model_id)
+    # a changed config starts over with the new limits
+    if admission == None or admission.limits != limits:
+        admission = ModelAdmission(model_id=model_id, limits=limits)
+        admissions[model_id] = admission
+    return admission
@@ -1,10 +1,23 @@
 import time
-from typing import Callable
+from typing import AsyncIterator, Callable, List
 import sys
 
 from fastapi import APIRouter, FastAPI, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.routing import APIRoute
+from app.helpers.load_shedder import load_shedder
 from app.helpers.logger import get_log
+from app.helpers.settings import settings
+from app.db import crud
+
+
+async def release_after(body_iterator: AsyncIterator) -> AsyncIterator:
+    # counted as in flight until the last chunk is sent or the client leaves
+    try:
+        async for chunk in body_iterator:
+            yield chunk
+    finally:
+        load_shedder.in_flight -= 1
 
 
 class ExceptionRoute(APIRoute):
@@ -12,16 +25,43 @@ class ExceptionRoute(APIRoute):
         original_route_handler = super().get_route_handler()
 
         async def custom_route_handler(request: Request) -> Response:
+            if not load_shedder.admit(request=request, path=self.path):
+                return JSONResponse(
+                    status_code=503,
+                    content={"detail": "Server is busy, try again later"},
+                    headers={"Retry-After": str(settings.SHED_RETRY_AFTER_SECONDS)},
+                )
+
+            load_shedder.in_flight += 1
+            streaming = False
             try:
                 before = time.time()
                 response: Response = await original_route_handler(request)
                 duration = time.time() - before
                 response.headers["X-Response-Time"] = str(duration)
+                if isinstance(response, StreamingResponse):
+                    # the work goes on while the body streams
+                    response.body_iterator = release_after(response.body_iterator)
+                    streaming = True
                 return response
             except:
                 get_log(name=__name__).info(f"in custom_route_handler exception")
                 message = str(sys.exc_info()[1])
                 get_log(name=__name__).error(message, exc_info=True)
                 raise
+            finally:
+                if not streaming:
+                    load_shedder.in_flight -= 1
 
         return custom_route_handler
+
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def set_next_cursor(response: Response, items: List, limit: int):
+    # listings stay plain json arrays, the cursor for the following page is
+    # returned as a header so existing clients keep working
+    cursor = crud.next_cursor(items=items, limit=limit)
+    if cursor != None:
+        response.headers[NEXT_CURSOR_HEADER] = cursor
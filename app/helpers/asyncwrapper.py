@@ -1,12 +1,128 @@
 import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from functools import wraps, partial
+from typing import AsyncIterator, Callable, Dict, Iterator, Optional
 
+from app.helpers import metrics
 
-def async_wrap(func):
+
+class BulkheadFull(Exception):
+    def __init__(self, name: str, retry_after: int = 1):
+        super().__init__(f"{name} is busy, try again later")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class Bulkhead:
+    # a sized executor per dependency, so one slow dependency only uses up its
+    # own threads. work waiting for a thread past max_queue is rejected.
+    def __init__(self, name: str, max_workers: int, max_queue: int):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.queued = 0
+        self.active = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._pid = None
+
+    def executor(self) -> ThreadPoolExecutor:
+        # threads do not survive a fork, so the child starts its own
+        if self._executor == None or self._pid != os.getpid():
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_workers, thread_name_prefix=f"bulkhead-{self.name}"
+            )
+            self._lock = threading.Lock()
+            self.queued = 0
+            self.active = 0
+            self._pid = os.getpid()
+        return self._executor
+
+    def run(self, loop: asyncio.AbstractEventLoop, func: Callable) -> asyncio.Future:
+        executor = self.executor()
+        with self._lock:
+            if self.queued >= self.max_queue:
+                self.rejected += 1
+                metrics.incr(f"bulkhead_{self.name}_rejected")
+                raise BulkheadFull(self.name)
+            self.queued += 1
+
+        submitted = time.time()
+        # the queue slot is given back once, when the work starts or when it
+        # is cancelled before it ever runs
+        slot = {"queued": True}
+
+        def release_slot():
+            with self._lock:
+                if slot["queued"]:
+                    slot["queued"] = False
+                    self.queued -= 1
+
+        def call():
+            release_slot()
+            with self._lock:
+                self.active += 1
+            metrics.observe(
+                f"bulkhead_{self.name}_wait_ms", (time.time() - submitted) * 1000
+            )
+            try:
+                return func()
+            finally:
+                with self._lock:
+                    self.active -= 1
+
+        future = loop.run_in_executor(executor, call)
+        future.add_done_callback(lambda _: release_slot())
+        return future
+
+    def stats(self) -> Dict:
+        return {
+            "max_workers": self.max_workers,
+            "max_queue": self.max_queue,
+            "active": self.active,
+            "queued": self.queued,
+            "rejected": self.rejected,
+        }
+
+
+# settings load through the ssm bulkhead, so sizes cannot come from settings
+bulkheads: Dict[str, Bulkhead] = {
+    "github": Bulkhead("github", max_workers=8, max_queue=64),
+    "s3": Bulkhead("s3", max_workers=16, max_queue=128),
+    "ses": Bulkhead("ses", max_workers=2, max_queue=32),
+    "ssm": Bulkhead("ssm", max_workers=2, max_queue=8),
+    "docker": Bulkhead("docker", max_workers=4, max_queue=16),
+}
+
+metrics.register(
+    "bulkheads", lambda: {name: b.stats() for name, b in bulkheads.items()}
+)
+
+
+_done = object()
+
+
+async def async_iterate(gen: Iterator, bulkhead: Optional[str] = None) -> AsyncIterator:
+    # a blocking generator, advanced one item at a time off the event loop
+    next_item = async_wrap(lambda: next(gen, _done), bulkhead=bulkhead)
+    while True:
+        item = await next_item()
+        if item is _done:
+            return
+        yield item
+
+
+def async_wrap(func, bulkhead: Optional[str] = None):
     @wraps(func)
     async def run(*args, loop=None, executor=None, **kwargs):
         if loop is None:
             loop = asyncio.get_event_loop()
         pfunc = partial(func, *args, **kwargs)
+        if bulkhead != None and executor is None:
+            return await bulkheads[bulkhead].run(loop, pfunc)
         return await loop.run_in_executor(executor, pfunc)
     return run
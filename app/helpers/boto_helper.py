@@ -1,105 +1,150 @@
 import asyncio
-import functools
+from datetime import datetime, timezone
 from pathlib import Path
+import threading
+from typing import Any, Dict, Optional, Tuple
 import boto3
 import sys
 import os
-
-from botocore.exceptions import ClientError, ReadTimeoutError
-from fastapi import param_functions
-from app.helpers.asyncwrapper import async_wrap
-import json
+import random
+import time
+
+from botocore.config import Config
+from botocore.exceptions import ClientError
+import httpx
+from app.helpers import metrics
+from app.helpers.asyncwrapper import BulkheadFull, async_wrap
+from app.helpers.circuit_breaker import get_breaker
+from app.helpers.lambda_invoker import (
+    LambdaInvokeError,
+    LambdaInvoker,
+    is_runtime_error,
+    parse_result,
+)
 
 from app.helpers.settings import settings
 from app.helpers.logger import get_log
 
-import boto3
+# clients are thread safe and hold their own connection pool, so one per
+# service and region is shared by the whole process. resources are not
+# thread safe, so the s3 resource is kept per thread on top of the shared
+# clients.
+_clients: Dict[Tuple[str, str], Any] = {}
+_clients_lock = threading.Lock()
+_session: Optional[boto3.session.Session] = None
+_local = threading.local()
+
+
+def get_boto_session() -> boto3.session.Session:
+    global _session
+    if _session == None:
+        if settings.AWS_ACCESS_KEY == None:
+            _session = boto3.session.Session(region_name=settings.AWS_REGION_NAME)
+        else:
+            _session = boto3.session.Session(
+                aws_access_key_id=settings.AWS_ACCESS_KEY,
+                aws_secret_access_key=settings.AWS_SECRET_KEY,
+                region_name=settings.AWS_REGION_NAME,
+            )
+    return _session
+
+
+def credentials_expire_in() -> Optional[float]:
+    # seconds until the session's temporary credentials (role or instance
+    # profile) expire, None for long term keys. presigned urls stop working
+    # when the credentials that signed them expire.
+    credentials = get_boto_session().get_credentials()
+    if credentials == None or credentials.get_frozen_credentials().token == None:
+        return None
+    expiry = getattr(credentials, "_expiry_time", None)
+    if expiry == None:
+        return 0.0
+    return (expiry - datetime.now(timezone.utc)).total_seconds()
+
+
+def client_config() -> Config:
+    return Config(max_pool_connections=settings.AWS_MAX_POOL_CONNECTIONS)
+
+
+def get_client(service_name: str, region_name: Optional[str] = None):
+    region_name = region_name or settings.AWS_REGION_NAME
+    key = (service_name, region_name)
+    client = _clients.get(key)
+    if client == None:
+        with _clients_lock:
+            client = _clients.get(key)
+            if client == None:
+                client = get_boto_session().client(
+                    service_name, region_name=region_name, config=client_config()
+                )
+                _clients[key] = client
+    return client
+
+
+def _reset_clients():
+    # sockets inherited from the parent must not be shared with the child
+    global _session, _clients_lock, _local
+    _session = None
+    _clients.clear()
+    _clients_lock = threading.Lock()
+    _local = threading.local()
+
+
+os.register_at_fork(after_in_child=_reset_clients)
 
 
 def get_ecr_private_client():
-    if settings.AWS_ACCESS_KEY == None:
-        return boto3.client(
-            "ecr",
-            region_name=settings.AWS_REGION_NAME,
-        )
-    else:
-        return boto3.client(
-            "ecr",
-            aws_access_key_id=settings.AWS_ACCESS_KEY,
-            aws_secret_access_key=settings.AWS_SECRET_KEY,
-            region_name=settings.AWS_REGION_NAME,
-        )
+    return get_client("ecr")
 
 
 def get_ecr_public_client():
-    if settings.AWS_ACCESS_KEY == None:
-        return boto3.client(
-            "ecr-public",
-            region_name="us-east-1",
-        )
-    else:
-        return boto3.client(
-            "ecr-public",
-            aws_access_key_id=settings.AWS_ACCESS_KEY,
-            aws_secret_access_key=settings.AWS_SECRET_KEY,
-            region_name="us-east-1",
-        )
+    return get_client("ecr-public", region_name="us-east-1")
 
 
 def get_s3_client():
-    if settings.AWS_ACCESS_KEY == None:
-        return boto3.resource("s3", region_name=settings.AWS_REGION_NAME)
-    else:
-        return boto3.resource(
-            "s3",
-            aws_access_key_id=settings.AWS_ACCESS_KEY,
-            aws_secret_access_key=settings.AWS_SECRET_KEY,
-            region_name=settings.AWS_REGION_NAME,
-        )
+    s3 = getattr(_local, "s3", None)
+    if s3 == None:
+        with _clients_lock:
+            s3 = get_boto_session().resource(
+                "s3", region_name=settings.AWS_REGION_NAME, config=client_config()
+            )
+        _local.s3 = s3
+    return s3
 
 
 def get_lambda_client():
-    if settings.AWS_ACCESS_KEY == None:
-        return boto3.client(
-            "lambda",
-            region_name=settings.AWS_REGION_NAME,
-        )
-    else:
-        return boto3.client(
-            "lambda",
-            aws_access_key_id=settings.AWS_ACCESS_KEY,
-            aws_secret_access_key=settings.AWS_SECRET_KEY,
-            region_name=settings.AWS_REGION_NAME,
-        )
+    return get_client("lambda")
+
+
+lambda_invoker = LambdaInvoker(
+    region_name=settings.AWS_REGION_NAME,
+    get_credentials=lambda: get_boto_session().get_credentials(),
+    endpoint_url=settings.LAMBDA_ENDPOINT_URL,
+    max_concurrency=settings.LAMBDA_MAX_CONCURRENCY,
+    connect_timeout=settings.LAMBDA_CONNECT_TIMEOUT_SECONDS,
+    read_timeout=settings.LAMBDA_READ_TIMEOUT_SECONDS,
+)
+metrics.register("lambda_invoker", lambda_invoker.stats)
 
 
 def get_ses_client():
-    if settings.AWS_ACCESS_KEY == None:
-        return boto3.client(
-            "ses",
-            region_name=settings.AWS_REGION_NAME,
-        )
-    else:
-        return boto3.client(
-            "ses",
-            aws_access_key_id=settings.AWS_ACCESS_KEY,
-            aws_secret_access_key=settings.AWS_SECRET_KEY,
-            region_name=settings.AWS_REGION_NAME,
-        )
+    return get_client("ses")
 
 
 async def write_file_to_s3(src: str, dest: str, bucket: str, alreadyTried=False):
     try:
         s3_client = get_s3_client()
-        response = await async_wrap(s3_client.meta.client.upload_file)(
-            str(src), bucket, str(dest)
-        )
+        response = await async_wrap(
+            s3_client.meta.client.upload_file, bulkhead="s3"
+        )(str(src), bucket, str(dest))
         return response
+    except BulkheadFull:
+        raise
     except Exception as e:
         if alreadyTried:
             raise
         if str(type(e)) == "<class 'botocore.errorfactory.NoSuchBucket'>":
-            await async_wrap(s3_client.create_bucket)(
+            await async_wrap(s3_client.create_bucket, bulkhead="s3")(
                 Bucket=bucket,
                 CreateBucketConfiguration={
                     "LocationConstraint": settings.AWS_REGION_NAME
@@ -113,14 +158,16 @@ async def write_string_to_s3(contents: str, s3_uri: str, alreadyTried=False):
         s3_client = get_s3_client()
         bucket = Path(s3_uri).parts[1]
         key = "/".join(list(Path(s3_uri).parts[2:]))
-        s3_obj = await async_wrap(s3_client.Object)(bucket, key)
-        await async_wrap(s3_obj.put)(Body=contents)
+        s3_obj = await async_wrap(s3_client.Object, bulkhead="s3")(bucket, key)
+        await async_wrap(s3_obj.put, bulkhead="s3")(Body=contents)
+    except BulkheadFull:
+        raise
     except Exception as e:
         if alreadyTried:
             raise
         if str(type(e)) == "<class 'botocore.errorfactory.NoSuchBucket'>":
             # async_create: Coroutine = async_wrap(s3_client.create_bucket)
-            await async_wrap(s3_client.create_bucket)(
+            await async_wrap(s3_client.create_bucket, bulkhead="s3")(
                 Bucket=bucket,
                 CreateBucketConfiguration={
                     "LocationConstraint": settings.AWS_REGION_NAME
@@ -137,16 +184,19 @@ async def read_string_from_s3(s3_uri: str, alreadyTried=False):
         bucket = Path(s3_uri).parts[1]
         key = "/".join(list(Path(s3_uri).parts[2:]))
         # async_s3: Coroutine = async_wrap(s3_client.Object)
-        s3_obj = await async_wrap(s3_client.Object)(bucket, key)
+        s3_obj = await async_wrap(s3_client.Object, bulkhead="s3")(bucket, key)
         # async_get: Coroutine = async_wrap(s3_obj.get)
-        s3_stream = await async_wrap(s3_obj.get)()
-        return s3_stream["Body"].read().decode()
+        s3_stream = await async_wrap(s3_obj.get, bulkhead="s3")()
+        contents = await async_wrap(s3_stream["Body"].read, bulkhead="s3")()
+        return contents.decode()
+    except BulkheadFull:
+        raise
     except Exception as e:
         if alreadyTried:
             raise
         if str(type(e)) == "<class 'botocore.errorfactory.NoSuchBucket'>":
             # async_create: Coroutine = async_wrap(s3_client.create_bucket)
-            await async_wrap(s3_client.create_bucket)(
+            await async_wrap(s3_client.create_bucket, bulkhead="s3")(
                 Bucket=bucket,
                 CreateBucketConfiguration={
                     "LocationConstraint": settings.AWS_REGION_NAME
@@ -155,69 +205,138 @@ async def read_string_from_s3(s3_uri: str, alreadyTried=False):
             await read_string_from_s3(s3_uri=s3_uri, alreadyTried=True)
 
 
-async def invoke_lambda_function(
-    function_name, function_params, alreadyTried=False
-) -> tuple:
+async def get_s3_etag(s3_uri: str) -> str:
+    bucket = Path(s3_uri).parts[1]
+    key = "/".join(list(Path(s3_uri).parts[2:]))
+    response = await async_wrap(get_client("s3").head_object, bulkhead="s3")(
+        Bucket=bucket, Key=key
+    )
+    return response["ETag"]
+
+
+def is_retryable(e: Exception) -> bool:
+    # connection trouble, throttling and lambda service errors, not bad requests
+    if isinstance(e, httpx.TransportError):
+        return True
+    return e.status_code != None and (e.status_code == 429 or e.status_code >= 500)
+
+
+def backoff_seconds(attempt: int, retry_after: Optional[float] = None) -> float:
+    # full jitter, but never sooner than a throttled response asked for
+    delay = random.uniform(
+        0,
+        min(
+            settings.LAMBDA_RETRY_MAX_SECONDS,
+            settings.LAMBDA_RETRY_BASE_SECONDS * 2 ** attempt,
+        ),
+    )
+    if retry_after != None:
+        delay = max(delay, retry_after)
+    return delay
+
+
+async def invoke_hedged(function_name: str, payload: dict, delay_ms: float) -> dict:
+    # a second invocation starts once the first is slower than delay_ms, the
+    # first one to succeed wins and the other is cancelled
+    first = asyncio.ensure_future(
+        lambda_invoker.invoke(function_name=function_name, payload=payload)
+    )
+    tasks = [first]
     try:
-        get_log(name=__name__).debug(
-            f"{function_name} params {param_functions} started"
-        )
-
-        lambda_client = get_lambda_client()
-
-        get_log(name=__name__).debug(f"{function_name} got client")
-
-        invoke_partial = functools.partial(
-            lambda_client.invoke,
-            FunctionName=function_name,
-            Payload=json.dumps(function_params).encode(),
-        )
-
-        get_log(name=__name__).debug(f"{function_name} partial")
-
-        loop = asyncio.get_event_loop()
-
-        get_log(name=__name__).debug(f"{function_name} loop")
-
-        response = await loop.run_in_executor(None, invoke_partial)
-
-        get_log(name=__name__).debug(f"{function_name} response")
-
-        res_json = json.loads(response["Payload"].read().decode("utf-8"))
-
-        get_log(name=__name__).debug(f"{function_name} res_json {res_json}")
-
-        if "errorMessage" in res_json:
-            raise Exception(
-                res_json["errorMessage"] + "\r\n" + "\r\n".join(res_json["stackTrace"])
+        done, _ = await asyncio.wait(tasks, timeout=delay_ms / 1000)
+        if not done:
+            metrics.incr("lambda_hedges")
+            tasks.append(
+                asyncio.ensure_future(
+                    lambda_invoker.invoke(function_name=function_name, payload=payload)
+                )
             )
 
-        body_json = json.loads(res_json["body"])
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                if task.exception() == None:
+                    if task is not first:
+                        metrics.incr("lambda_hedges_won")
+                    return task.result()
+        return first.result()
+    finally:
+        for task in tasks:
+            task.cancel()
 
-        get_log(name=__name__).debug(f"{function_name} body {body_json}")
 
-        duration_ms = int(body_json["duration ms"] * 1000)
-        result_json = json.loads(body_json["result"])
-        return result_json, duration_ms
-    except (ClientError, ReadTimeoutError) as e:
-        if alreadyTried:
+async def invoke_lambda_function(
+    function_name, function_params, hedge: bool = False
+) -> tuple:
+    # calls fail at once while the function's circuit is open, instead of
+    # waiting on a lambda that is already failing
+    breaker = get_breaker(function_name)
+    attempt = 0
+    while True:
+        breaker.before_call()
+        before = time.time()
+        try:
+            get_log(name=__name__).debug(f"{function_name} attempt {attempt} started")
+
+            delay_ms = (
+                breaker.p95_ms(min_samples=settings.LAMBDA_HEDGE_MIN_SAMPLES)
+                if hedge
+                else None
+            )
+            if delay_ms == None:
+                res_json = await lambda_invoker.invoke(
+                    function_name=function_name, payload=function_params
+                )
+            else:
+                res_json = await invoke_hedged(
+                    function_name=function_name,
+                    payload=function_params,
+                    delay_ms=delay_ms,
+                )
+
+            get_log(name=__name__).debug(f"{function_name} res_json {res_json}")
+        except (LambdaInvokeError, httpx.TransportError) as e:
+            if not is_retryable(e):
+                # the function answered, it is the request that is wrong
+                breaker.success()
+                get_log(name=__name__).error(str(e), exc_info=True)
+                raise
+
+            breaker.failure()
+            attempt += 1
+            retry_after = getattr(e, "retry_after", None)
+            if attempt >= settings.LAMBDA_RETRY_ATTEMPTS or (
+                retry_after != None and retry_after > settings.LAMBDA_RETRY_MAX_SECONDS
+            ):
+                get_log(name=__name__).error(str(e), exc_info=True)
+                raise
+
+            delay = backoff_seconds(attempt=attempt, retry_after=retry_after)
+            metrics.incr("lambda_invoke_retries")
+            get_log(name=__name__).warning(
+                f"Couldn't invoke function {function_name}, "
+                f"trying again in {delay:.2f}s: {e}"
+            )
+            await asyncio.sleep(delay)
+            continue
+        except:
             message = str(sys.exc_info()[1])
             get_log(name=__name__).error(str(message), exc_info=True)
             raise
-        else:
-            get_log(name=__name__).exception(
-                "Couldn't invoke function %s, trying again.", function_name
-            )
 
-            return await invoke_lambda_function(
-                function_name=function_name,
-                function_params=function_params,
-                alreadyTried=True,
-            )
-    except:
-        message = str(sys.exc_info()[1])
-        get_log(name=__name__).error(str(message), exc_info=True)
-        raise
+        # function errors come back as a 200 with the error in the body and
+        # are not retried. only the runtime's own errors count as failures,
+        # or a few bad inputs would block the model for everyone.
+        if "errorMessage" not in res_json:
+            breaker.success(duration_ms=(time.time() - before) * 1000)
+        elif is_runtime_error(res_json):
+            breaker.failure()
+        else:
+            breaker.success()
+        return parse_result(res_json)
 
 
 def create_presigned_url(bucket_name, object_name, expiration=604800):
@@ -230,7 +349,7 @@ def create_presigned_url(bucket_name, object_name, expiration=604800):
     """
 
     # Generate a presigned URL for the S3 object
-    s3_client = get_s3_client().meta.client
+    s3_client = get_client("s3")
     try:
         response = s3_client.generate_presigned_url(
             "get_object",
@@ -262,7 +381,7 @@ def create_presigned_post(
     :return: None if error.
     """
 
-    s3_client = get_s3_client().meta.client
+    s3_client = get_client("s3")
     try:
         response = s3_client.generate_presigned_post(
             bucket_name,
@@ -281,7 +400,7 @@ def create_presigned_post(
 async def send_email(to_address: str, sender: str, subject: str, text: str, html: str):
     s3_client = get_ses_client()
     try:
-        response = await async_wrap(s3_client.send_email)(
+        response = await async_wrap(s3_client.send_email, bulkhead="ses")(
             Destination={
                 "ToAddresses": [to_address],
             },
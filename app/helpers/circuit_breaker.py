@@ -0,0 +1,104 @@
+import math
+import time
+from collections import deque
+from typing import Deque, Dict, Optional
+
+from app.helpers import metrics
+from app.helpers.logger import get_log
+from app.helpers.settings import settings
+
+
+class CircuitOpen(Exception):
+    def __init__(self, name: str, retry_after: int = 1):
+        super().__init__(f"{name} is unavailable, try again in {retry_after}s")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    # after failure_threshold failures in a row the circuit opens and calls
+    # fail at once for reset_seconds. then a single trial call goes through,
+    # its success closes the circuit and a failure opens it again.
+    def __init__(self, name: str, failure_threshold: int, reset_seconds: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self.failures = 0
+        self.rejected = 0
+        self.opened_at = 0.0
+        self.trial_at = 0.0
+        # latencies of recent successful calls, for the hedging delay
+        self.latencies_ms: Deque[float] = deque(maxlen=200)
+
+    def before_call(self):
+        now = time.time()
+        if self.state == "closed":
+            return
+
+        if self.state == "open":
+            remaining = self.opened_at + self.reset_seconds - now
+            if remaining <= 0:
+                self.state = "half_open"
+                self.trial_at = now
+                return
+        # a trial call that never reported back does not block forever
+        elif now - self.trial_at >= self.reset_seconds:
+            self.trial_at = now
+            return
+        else:
+            remaining = self.trial_at + self.reset_seconds - now
+
+        self.rejected += 1
+        metrics.incr("circuit_breaker_rejected")
+        raise CircuitOpen(self.name, retry_after=max(math.ceil(remaining), 1))
+
+    def success(self, duration_ms: Optional[float] = None):
+        if self.state != "closed":
+            get_log(name=__name__).info(f"circuit for {self.name} closed")
+        self.state = "closed"
+        self.failures = 0
+        if duration_ms != None:
+            self.latencies_ms.append(duration_ms)
+
+    def failure(self):
+        self.failures += 1
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            if self.state != "open":
+                metrics.incr("circuit_breaker_opened")
+                get_log(name=__name__).warning(f"circuit for {self.name} opened")
+            self.state = "open"
+            self.opened_at = time.time()
+
+    def p95_ms(self, min_samples: int) -> Optional[float]:
+        if len(self.latencies_ms) < min_samples:
+            return None
+        ordered = sorted(self.latencies_ms)
+        return ordered[int(len(ordered) * 0.95) - 1]
+
+    def stats(self) -> Dict:
+        return {
+            "state": self.state,
+            "failures": self.failures,
+            "rejected": self.rejected,
+        }
+
+
+# one breaker per lambda function, for this worker process
+breakers: Dict[str, CircuitBreaker] = {}
+
+metrics.register(
+    "circuit_breakers", lambda: {name: b.stats() for name, b in breakers.items()}
+)
+
+
+def get_breaker(name: str) -> CircuitBreaker:
+    breaker = breakers.get(name)
+    if breaker == None:
+        breaker = CircuitBreaker(
+            name,
+            failure_threshold=settings.LAMBDA_BREAKER_FAILURES,
+            reset_seconds=settings.LAMBDA_BREAKER_RESET_SECONDS,
+        )
+        breakers[name] = breaker
+    return breaker
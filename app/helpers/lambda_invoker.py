@@ -0,0 +1,210 @@
+import asyncio
+import json
+import os
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Callable, Dict, Optional, Tuple
+from urllib.parse import quote
+
+import httpx
+from botocore.auth import SigV4Auth
+from botocore.awsrequest import AWSRequest
+from botocore.credentials import Credentials
+
+from app.helpers import metrics
+from app.helpers.logger import get_log
+
+INVOKE_PATH = "/2015-03-31/functions/{function_name}/invocations"
+
+# function errors raised by the lambda runtime rather than the model's code:
+# timeouts, out of memory and crashes of the process. an exception in predict
+# is about its input and says nothing about the function's health.
+RUNTIME_ERROR_PREFIXES = ("Sandbox.", "Runtime.")
+
+
+class LambdaInvokeError(Exception):
+    def __init__(
+        self,
+        message: str,
+        status_code: Optional[int] = None,
+        error_type: Optional[str] = None,
+        retry_after: Optional[float] = None,
+    ):
+        super().__init__(message)
+        self.status_code = status_code
+        self.error_type = error_type
+        self.retry_after = retry_after
+
+
+class LambdaInvoker:
+    # calls the lambda Invoke api directly over an async http connection pool,
+    # so in-flight invocations are bounded by max_concurrency instead of the
+    # executor's thread count. cancelling the awaiting task closes the request.
+    def __init__(
+        self,
+        region_name: str,
+        get_credentials: Callable[[], Optional[Credentials]],
+        endpoint_url: Optional[str] = None,
+        max_concurrency: int = 100,
+        connect_timeout: float = 5.0,
+        read_timeout: float = 900.0,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        self.region_name = region_name
+        self.get_credentials = get_credentials
+        self.endpoint_url = (
+            endpoint_url or f"https://lambda.{region_name}.amazonaws.com"
+        ).rstrip("/")
+        self.max_concurrency = max_concurrency
+        self.timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        self.transport = transport
+        self.in_flight = 0
+        self._client: Optional[httpx.AsyncClient] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._loop = None
+        self._pid = None
+
+    async def _pool(self) -> Tuple[httpx.AsyncClient, asyncio.Semaphore]:
+        # connections and the semaphore belong to one event loop in one
+        # process, so they are rebuilt after a fork or for a new loop
+        loop = asyncio.get_event_loop()
+        if self._client == None or self._loop is not loop or self._pid != os.getpid():
+            previous = self._client
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout,
+                limits=httpx.Limits(
+                    max_connections=self.max_concurrency,
+                    max_keepalive_connections=self.max_concurrency,
+                ),
+                transport=self.transport,
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._loop = loop
+            self._pid = os.getpid()
+            # replaced before closing, so calls meanwhile share the new pool
+            if previous != None:
+                await close_client(previous)
+        return self._client, self._semaphore
+
+    def _signed_headers(self, url: str, body: bytes) -> Dict[str, str]:
+        credentials = self.get_credentials()
+        if credentials == None:
+            raise LambdaInvokeError("No AWS credentials for lambda invoke")
+
+        request = AWSRequest(
+            method="POST",
+            url=url,
+            data=body,
+            headers={"Content-Type": "application/json"},
+        )
+        SigV4Auth(
+            credentials.get_frozen_credentials(), "lambda", self.region_name
+        ).add_auth(request)
+        return dict(request.headers.items())
+
+    async def invoke(self, function_name: str, payload: dict) -> dict:
+        url = self.endpoint_url + INVOKE_PATH.format(
+            function_name=quote(function_name, safe="")
+        )
+        body = json.dumps(payload).encode()
+        client, semaphore = await self._pool()
+
+        async with semaphore:
+            self.in_flight += 1
+            before = time.time()
+            try:
+                response = await client.post(
+                    url, content=body, headers=self._signed_headers(url, body)
+                )
+            finally:
+                self.in_flight -= 1
+                metrics.observe("lambda_invoke_ms", (time.time() - before) * 1000)
+
+        if response.status_code >= 300:
+            metrics.incr("lambda_invoke_errors")
+            raise error_from_response(response)
+
+        res_json = response.json()
+        # errors raised in the function still answer 200, flagged by a header
+        function_error = response.headers.get("X-Amz-Function-Error")
+        if function_error != None:
+            metrics.incr("lambda_function_errors")
+            if not isinstance(res_json, dict):
+                res_json = {"errorMessage": str(res_json)}
+            res_json.setdefault("errorMessage", function_error)
+        return res_json
+
+    def stats(self) -> Dict:
+        return {"in_flight": self.in_flight, "max_concurrency": self.max_concurrency}
+
+    async def close(self):
+        if self._client != None:
+            await close_client(self._client)
+            self._client = None
+
+
+async def close_client(client: httpx.AsyncClient):
+    try:
+        await client.aclose()
+    except Exception:
+        # connections of a loop that is already closed cannot be closed
+        # gracefully, their sockets are released all the same
+        get_log(name=__name__).debug("lambda client not closed", exc_info=True)
+
+
+def error_from_response(response: httpx.Response) -> LambdaInvokeError:
+    try:
+        body = response.json()
+    except ValueError:
+        body = {}
+
+    error_type = response.headers.get("x-amzn-ErrorType", "").split(":")[0]
+    error_type = error_type or body.get("Type") or body.get("__type")
+    message = body.get("message") or body.get("Message") or response.text
+    retry_after = body.get("retryAfterSeconds") or response.headers.get("Retry-After")
+    return LambdaInvokeError(
+        f"{error_type or 'LambdaError'} ({response.status_code}): {message}",
+        status_code=response.status_code,
+        error_type=error_type,
+        retry_after=parse_retry_after(retry_after),
+    )
+
+
+def parse_retry_after(value) -> Optional[float]:
+    # seconds or an http date, anything else falls back to the backoff
+    if value == None:
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo == None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max((when - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+
+def is_runtime_error(res_json: dict) -> bool:
+    error_type = res_json.get("errorType")
+    if isinstance(error_type, str) and error_type.startswith(RUNTIME_ERROR_PREFIXES):
+        return True
+    # older runtimes report a timeout without an errorType
+    return "Task timed out" in str(res_json.get("errorMessage", ""))
+
+
+def parse_result(res_json: dict) -> Tuple[dict, int]:
+    if "errorMessage" in res_json:
+        raise Exception(
+            res_json["errorMessage"]
+            + "\r\n"
+            + "\r\n".join(res_json.get("stackTrace", []))
+        )
+
+    body_json = json.loads(res_json["body"])
+    duration_ms = int(body_json["duration ms"] * 1000)
+    result_json = json.loads(body_json["result"])
+    return result_json, duration_ms
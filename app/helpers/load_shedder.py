@@ -0,0 +1,103 @@
+import asyncio
+import time
+from typing import Dict, Optional
+
+from fastapi import Request
+from fastapi.security.utils import get_authorization_scheme_param
+
+from app.auth.auth_handler import decodeJWT
+from app.helpers import metrics
+from app.helpers.settings import settings
+
+LANES = ["low", "normal", "high"]
+
+# public listings that clients can simply load again later
+LOW_PRIORITY_ROUTES = {("GET", "/model/"), ("GET", "/run/")}
+
+
+class LoadShedder:
+    # counts requests inside route handlers and samples how late the event
+    # loop wakes up, which is how long ready work waits for the loop. past
+    # max_in_flight or max_lag_ms the low lane is shed, past twice that the
+    # normal lane too. the high lane is never shed.
+    def __init__(self):
+        self.in_flight = 0
+        self.lag_ms = 0.0
+        self.shed: Dict[str, int] = {lane: 0 for lane in LANES}
+        self._task: Optional[asyncio.Task] = None
+        metrics.register("load_shedder", self.stats)
+
+    async def start(self):
+        self._task = asyncio.ensure_future(self._monitor_lag())
+
+    async def stop(self):
+        if self._task != None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _monitor_lag(self):
+        interval = settings.SHED_LAG_INTERVAL_MS / 1000
+        while True:
+            before = time.monotonic()
+            await asyncio.sleep(interval)
+            lag_ms = max(time.monotonic() - before - interval, 0) * 1000
+            # smoothed, so a single slow callback does not shed anything
+            self.lag_ms = self.lag_ms * 0.7 + lag_ms * 0.3
+            metrics.observe("event_loop_lag_ms", lag_ms)
+
+    def overload(self) -> int:
+        # 0 is fine, 1 sheds the low lane, 2 the normal lane too
+        load = max(
+            self.in_flight / settings.SHED_MAX_IN_FLIGHT,
+            self.lag_ms / settings.SHED_MAX_LAG_MS,
+        )
+        if load >= 2:
+            return 2
+        if load >= 1:
+            return 1
+        return 0
+
+    def lane(self, request: Request, path: str) -> str:
+        if path.startswith("/build"):
+            return "high"
+
+        # the token is checked, a made up header must not buy priority
+        scheme, token = get_authorization_scheme_param(
+            request.headers.get("Authorization")
+        )
+        if scheme.lower() == "bearer" and decodeJWT(token) != None:
+            return "high"
+
+        # anonymous predictions and public listings
+        if path.startswith("/prediction"):
+            return "low"
+        if (request.method, path) in LOW_PRIORITY_ROUTES:
+            return "low"
+        return "normal"
+
+    def admit(self, request: Request, path: str) -> bool:
+        overload = self.overload()
+        if overload == 0:
+            return True
+
+        lane = self.lane(request=request, path=path)
+        if LANES.index(lane) >= overload:
+            return True
+
+        self.shed[lane] += 1
+        metrics.incr(f"shed_{lane}")
+        return False
+
+    def stats(self) -> Dict:
+        return {
+            "in_flight": self.in_flight,
+            "lag_ms": round(self.lag_ms, 3),
+            "shed": dict(self.shed),
+        }
+
+
+load_shedder = LoadShedder()
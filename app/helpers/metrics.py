@@ -0,0 +1,44 @@
+import threading
+from typing import Callable, Dict
+
+_lock = threading.Lock()
+_counters: Dict[str, float] = {}
+_timings: Dict[str, Dict[str, float]] = {}
+_collectors: Dict[str, Callable[[], Dict]] = {}
+
+
+def incr(name: str, value: float = 1):
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def observe(name: str, value: float):
+    with _lock:
+        timing = _timings.get(name)
+        if timing == None:
+            timing = {"count": 0, "sum": 0.0, "max": 0.0}
+            _timings[name] = timing
+        timing["count"] += 1
+        timing["sum"] += value
+        if value > timing["max"]:
+            timing["max"] = value
+
+
+def register(name: str, collector: Callable[[], Dict]):
+    # collectors are polled when a snapshot is taken, for gauges that are
+    # cheaper to read on demand than to keep up to date
+    _collectors[name] = collector
+
+
+def snapshot() -> Dict:
+    with _lock:
+        ret: Dict = {"counters": dict(_counters)}
+        ret["timings"] = {
+            name: dict(timing, avg=timing["sum"] / timing["count"])
+            for name, timing in _timings.items()
+        }
+
+    for name, collector in list(_collectors.items()):
+        ret[name] = collector()
+
+    return ret
@@ -0,0 +1,54 @@
+import asyncio
+import json
+from typing import Optional
+
+import aio_pika
+from aio_pika.message import DeliveryMode
+
+from app.helpers import metrics
+from app.helpers.rabbit_helper import get_connection
+from app.helpers.settings import settings
+
+
+class RunQueue:
+    # submitted runs are published to a durable queue and acked by a run
+    # worker only once their result is written, so a deploy or a crashed
+    # worker hands the run to another worker instead of losing it
+    def __init__(self):
+        self._connection = None
+        self._channel = None
+        self._lock: Optional[asyncio.Lock] = None
+
+    async def _connect(self):
+        self._connection = await get_connection(
+            host=settings.RABBIT_HOST_API, loop=asyncio.get_event_loop()
+        )
+        self._channel = await self._connection.channel()
+        await self._channel.declare_queue(settings.RABBIT_RUN_QUEUE, durable=True)
+
+    async def publish(self, model_id: str, run_id: str, payload: dict):
+        if self._lock == None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if self._channel == None:
+                await self._connect()
+
+        body = json.dumps({"model_id": model_id, "run_id": run_id, "payload": payload})
+        message = aio_pika.Message(
+            body=body.encode(),
+            delivery_mode=DeliveryMode.PERSISTENT,
+            message_id=run_id,
+        )
+        await self._channel.default_exchange.publish(
+            message=message, routing_key=settings.RABBIT_RUN_QUEUE
+        )
+        metrics.incr("prediction_jobs_submitted")
+
+    async def stop(self):
+        if self._connection != None:
+            await self._connection.close()
+        self._connection = None
+        self._channel = None
+
+
+run_queue = RunQueue()
@@ -32,7 +32,7 @@ settings = None
 
 
 async def load_settings_async():
-    parameters = await async_wrap(load)()
+    parameters = await async_wrap(load, bulkhead="ssm")()
     global settings
     settings = Settings(**parameters)
 
@@ -42,6 +42,14 @@ class Settings(BaseSettings):
     SQLALCHEMY_DATABASE_URI: str
     SQLALCHEMY_DATABASE_SSL = False
     SQLALCHEMY_DATABASE_MAX_POOL = 20
+    SQLALCHEMY_DATABASE_MAX_OVERFLOW = 10
+    SQLALCHEMY_DATABASE_POOL_TIMEOUT = 30
+    SQLALCHEMY_DATABASE_POOL_RECYCLE = 60 * 30
+    SQLALCHEMY_DATABASE_REPLICA_URI: Optional[str]
+    SQLALCHEMY_REPLICA_MAX_LAG_SECONDS = 2.0
+    SQLALCHEMY_REPLICA_LAG_CHECK_SECONDS = 1.0
+    # start_server.sh migrates before the api starts, workers only check
+    DATABASE_AUTO_MIGRATE = False
 
     JWT_SECRET: str
     JWT_ALGORITHM: str
@@ -56,6 +64,9 @@ class Settings(BaseSettings):
     RABBIT_START_QUEUE_BUILDER: str
     RABBIT_CANCEL_QUEUE_API: str
     RABBIT_CANCEL_QUEUE_BUILDER: str
+    # submitted runs, consumed by app.service.run_worker
+    RABBIT_RUN_QUEUE = "runs"
+    RUN_WORKER_CONCURRENCY = 20
 
     AWS_ACCESS_KEY: Optional[str]
     AWS_SECRET_KEY: Optional[str]
@@ -72,6 +83,67 @@ class Settings(BaseSettings):
     WEBSITE_URL: str
     TEST_ALL_MODELS: Optional[bool]
     LOAD_BALANCE_ARN: Optional[str]
+    AWS_MAX_POOL_CONNECTIONS = 50
+    LAMBDA_ENDPOINT_URL: Optional[str]
+    LAMBDA_MAX_CONCURRENCY = 100
+    LAMBDA_CONNECT_TIMEOUT_SECONDS = 5.0
+    LAMBDA_READ_TIMEOUT_SECONDS = 900.0
+    LAMBDA_RETRY_ATTEMPTS = 3
+    LAMBDA_RETRY_BASE_SECONDS = 0.2
+    LAMBDA_RETRY_MAX_SECONDS = 10.0
+    LAMBDA_BREAKER_FAILURES = 5
+    LAMBDA_BREAKER_RESET_SECONDS = 30
+    LAMBDA_HEDGE_MIN_SAMPLES = 20
+
+    JWT_CACHE_SIZE = 10000
+    JWT_CACHE_TTL_SECONDS = 60 * 60
+
+    MODEL_CACHE_SIZE = 1000
+    MODEL_CACHE_TTL_SECONDS = 60
+
+    PREDICTION_CACHE_SIZE = 10000
+    PREDICTION_CACHE_TTL_SECONDS = 60 * 60
+    PREDICTION_CACHE_MAX_BYTES = 64 * 1024 * 1024
+    PREDICTION_INLINE_MAX_BYTES = 1024 * 1024
+    SIGNED_URL_CACHE_SIZE = 50000
+    SIGNED_URL_EXPIRATION_SECONDS = 60 * 60 * 24 * 7
+    SIGNED_URL_REFRESH_SECONDS = 60 * 60
+    MEDIA_CACHE_SIZE = 10000
+    MEDIA_CACHE_SECONDS = 60 * 60
+    MEDIA_MAX_AGE_SECONDS = 60 * 5
+    PREDICTION_BATCH_MAX_SIZE = 1000
+    PREDICTION_BATCH_CONCURRENCY = 10
+    RUN_POLL_SECONDS = 1.0
+
+    # defaults for models without limits in config_json, None is unlimited
+    PREDICTION_RATE_PER_SECOND: Optional[float]
+    PREDICTION_RATE_BURST: Optional[float]
+    PREDICTION_USER_RATE_PER_SECOND: Optional[float]
+    PREDICTION_USER_RATE_BURST: Optional[float]
+    PREDICTION_MAX_CONCURRENCY: Optional[int]
+    PREDICTION_QUEUE_SECONDS = 10.0
+    # submitted runs wait longer, pending runs older than that and their
+    # retries are expired on startup
+    PREDICTION_JOB_QUEUE_SECONDS = 3600.0
+    PREDICTION_ADMISSION_MAX_USERS = 10000
+
+    WARMER_ENABLED = True
+    WARMER_INTERVAL_SECONDS = 60
+    WARMER_LOOKBACK_SECONDS = 60 * 60 * 6
+    WARMER_MIN_RUNS = 3
+    WARMER_KEEP_WARM_SECONDS = 60 * 5
+    WARMER_COLD_AFTER_SECONDS = 60 * 10
+    WARMER_MAX_CONCURRENCY = 3
+    WARMER_MAX_PINGS_PER_HOUR = 600
+
+    SHED_MAX_IN_FLIGHT = 200
+    SHED_MAX_LAG_MS = 250
+    SHED_LAG_INTERVAL_MS = 100
+    SHED_RETRY_AFTER_SECONDS = 2
+
+    RUN_WRITER_FLUSH_INTERVAL_MS = 250
+    RUN_WRITER_MAX_ROWS = 500
+    RUN_WRITER_MAX_PENDING = 10000
 
 
 parameters = load()
@@ -0,0 +1,38 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+
+from app.helpers import metrics
+
+
+class SingleFlight:
+    # concurrent calls with the same key share one in-flight call. The call
+    # runs as its own task, so a caller that goes away does not cancel it for
+    # the others waiting on it.
+    def __init__(self, name: str):
+        self.name = name
+        self.saved = 0
+        self._calls: Dict[Hashable, asyncio.Future] = {}
+        metrics.register(f"singleflight_{name}", self.stats)
+
+    async def do(
+        self, key: Hashable, func: Callable[[], Awaitable]
+    ) -> Tuple[Any, bool]:
+        # returns the result and whether it came from another caller's call,
+        # callers share the result object so must copy before changing it
+        task = self._calls.get(key)
+        shared = task != None
+        if shared:
+            self.saved += 1
+        else:
+            task = asyncio.ensure_future(func())
+            self._calls[key] = task
+            task.add_done_callback(lambda _: self._forget(key, task))
+
+        return await asyncio.shield(task), shared
+
+    def _forget(self, key: Hashable, task: asyncio.Future):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+
+    def stats(self) -> Dict:
+        return {"in_flight": len(self._calls), "saved": self.saved}
@@ -0,0 +1,89 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+from app.helpers import metrics
+
+
+class TTLCache:
+    # least recently used entries are evicted once maxsize entries or maxbytes
+    # (the sizes passed to set) are reached, and entries older than ttl
+    # seconds are dropped when they are next read
+    def __init__(
+        self, name: str, maxsize: int, ttl: float, maxbytes: Optional[int] = None
+    ):
+        self.name = name
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.bytes = 0
+        self._data: "OrderedDict[Hashable, Tuple[float, Any, int]]" = OrderedDict()
+        self._lock = threading.Lock()
+        metrics.register(f"cache_{name}", self.stats)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry != None and entry[0] > time.monotonic():
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+
+            if entry != None:
+                self._remove(key)
+            self.misses += 1
+            return default
+
+    def set(
+        self, key: Hashable, value: Any, ttl: Optional[float] = None, size: int = 0
+    ):
+        if self.maxbytes != None and size > self.maxbytes:
+            return
+
+        expires = time.monotonic() + (self.ttl if ttl == None else ttl)
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = (expires, value, size)
+            self.bytes += size
+            while len(self._data) > self.maxsize or (
+                self.maxbytes != None and self.bytes > self.maxbytes
+            ):
+                self._remove(next(iter(self._data)))
+
+    def _remove(self, key: Hashable) -> Tuple[float, Any, int]:
+        entry = self._data.pop(key)
+        self.bytes -= entry[2]
+        return entry
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            if key not in self._data:
+                return default
+            return self._remove(key)[1]
+
+    def pop_where(self, predicate: Callable[[Any], bool]):
+        with self._lock:
+            for key in [k for k, (_, v, _) in self._data.items() if predicate(v)]:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "bytes": self.bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups > 0 else 0.0,
+        }
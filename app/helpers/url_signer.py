@@ -0,0 +1,72 @@
+from pathlib import Path
+from typing import Dict, Iterable
+from urllib.parse import quote
+
+from app.helpers.boto_helper import create_presigned_url, credentials_expire_in
+from app.helpers.settings import settings
+from app.helpers.ttl_cache import TTLCache
+
+
+def split_s3_uri(s3_uri: str):
+    parts = Path(s3_uri).parts
+    return parts[1], "/".join(parts[2:])
+
+
+def thumb_uri(s3_uri: str) -> str:
+    bucket_name, object_name = split_s3_uri(s3_uri)
+    return f"s3://{bucket_name}/{object_name.replace('.jpg', '-thumb.jpg')}"
+
+
+def media_ref(run_id: str, field: str, thumb: bool = False) -> str:
+    # a stable url for a run's s3 field, signed by the media router on request
+    ref = f"/media/{run_id}/{quote(field, safe='')}"
+    return ref + "?thumb=true" if thumb else ref
+
+
+class UrlSigner:
+    # presigned get urls for s3 uris, reused until refresh_seconds before they
+    # expire. signing is local, but a listing page signs hundreds of them.
+    def __init__(self, maxsize: int, expiration: int, refresh_seconds: int):
+        self.expiration = expiration
+        self.refresh_seconds = refresh_seconds
+        self.cache = TTLCache(
+            name="signed_url", maxsize=maxsize, ttl=expiration - refresh_seconds
+        )
+
+    def cache_ttl(self) -> float:
+        # urls signed with temporary credentials die with them, well before
+        # the 7 days asked for
+        ttl = self.cache.ttl
+        expire_in = credentials_expire_in()
+        if expire_in != None:
+            ttl = min(ttl, expire_in - self.refresh_seconds)
+        return ttl
+
+    def sign(self, s3_uri: str) -> str:
+        url = self.cache.get(s3_uri)
+        if url == None:
+            bucket_name, object_name = split_s3_uri(s3_uri)
+            url = create_presigned_url(
+                bucket_name=bucket_name,
+                object_name=object_name,
+                expiration=self.expiration,
+            )
+            ttl = self.cache_ttl()
+            if ttl > 0:
+                self.cache.set(s3_uri, url, ttl=ttl)
+        return url
+
+    def sign_all(self, s3_uris: Iterable[str]) -> Dict[str, str]:
+        # each distinct uri is signed once, however often it appears
+        signed: Dict[str, str] = {}
+        for s3_uri in s3_uris:
+            if s3_uri not in signed:
+                signed[s3_uri] = self.sign(s3_uri)
+        return signed
+
+
+url_signer = UrlSigner(
+    maxsize=settings.SIGNED_URL_CACHE_SIZE,
+    expiration=settings.SIGNED_URL_EXPIRATION_SECONDS,
+    refresh_seconds=settings.SIGNED_URL_REFRESH_SECONDS,
+)
@@ -1,6 +1,12 @@
 import asyncio
 import typer
-from app.db.database import init_models
+from app.db.database import init_models, engine
+from app.db import migrations
+from app.db import index_advisor
+from app.benchmarks import crud_statements
+from app.benchmarks import boto_clients
+from app.benchmarks import url_signing
+from app.benchmarks import jwt_decode
 
 cli = typer.Typer()
 
@@ -11,5 +17,77 @@ def db_init_models():
     print("Done")
 
 
+@cli.command()
+def db_migrate():
+    version = asyncio.run(migrations.migrate())
+    print(f"Done, schema version {version}")
+
+
+@cli.command()
+def db_version():
+    async def get_version():
+        async with engine.connect() as conn:
+            return await migrations.current_version(conn)
+
+    print(f"{asyncio.run(get_version())} of {migrations.LATEST_VERSION}")
+
+
+@cli.command()
+def db_explain(runs: int = 100000):
+    reports = asyncio.run(index_advisor.explain(runs=runs))
+    seq_scans = 0
+    for report in reports:
+        status = "ok"
+        if len(report["seq_scans"]) > 0:
+            status = "SEQ SCAN " + ",".join(report["seq_scans"])
+        print(
+            f"{report['query']:<24} {report['execution_ms']:>9.3f} ms "
+            f"hit={report['shared_hit_blocks']} read={report['shared_read_blocks']} {status}"
+        )
+        seq_scans += len(report["seq_scans"])
+
+    if seq_scans > 0:
+        raise typer.Exit(code=1)
+    print("Done")
+
+
+@cli.command()
+def bench_crud(iterations: int = 2000):
+    for report in crud_statements.run(iterations=iterations):
+        print(
+            f"{report['query']:<16} compile {report['compile_us']:>8.1f} us "
+            f"before {report['before_us']:>8.1f} us after {report['after_us']:>6.1f} us"
+        )
+
+
+@cli.command()
+def bench_boto(iterations: int = 50, urls_per_prediction: int = 2):
+    for report in boto_clients.run(
+        iterations=iterations, urls_per_prediction=urls_per_prediction
+    ):
+        print(
+            f"{report['operation']:<16} before {report['before_ms']:>8.3f} ms "
+            f"after {report['after_ms']:>8.3f} ms"
+        )
+
+
+@cli.command()
+def bench_signing(page_size: int = 100):
+    for report in url_signing.run(page_size=page_size):
+        print(
+            f"{report['operation']:<16} page {report['page_ms']:>8.3f} ms "
+            f"hit ratio {report['hit_ratio']:.2f}"
+        )
+
+
+@cli.command()
+def bench_jwt(iterations: int = 10000):
+    for report in jwt_decode.run(iterations=iterations):
+        print(
+            f"{report['operation']:<16} before {report['before_us']:>8.1f} us "
+            f"after {report['after_us']:>8.1f} us"
+        )
+
+
 if __name__ == "__main__":
     cli()
@@ -4,7 +4,7 @@ from app.helpers.api_helper import ExceptionRoute
 from typing import Dict, List
 from fastapi.exceptions import HTTPException
 from sqlalchemy.sql.functions import mode
-from app.db.database import get_session
+from app.db.database import get_session, get_read_session
 from app.auth.auth_bearer import JWTBearer
 from fastapi import APIRouter, Depends, Body
 from fastapi.responses import StreamingResponse
@@ -63,7 +63,7 @@ async def create_build(
 async def get_build_log(
     build_id: str,
     token: schema.Token = Depends(JWTBearer()),
-    session: AsyncSession = Depends(get_session),
+    session: AsyncSession = Depends(get_read_session),
 ):
     build: schema.Build = await crud.get_build_by_id(session=session, build_id=build_id)
     if build.build_log != None:
@@ -73,7 +73,9 @@ async def get_build_log(
 
 
 @router.get("/{build_id}", response_model=schema.Build)
-async def get_build(build_id: str, session: AsyncSession = Depends(get_session)):
+async def get_build(
+    build_id: str, session: AsyncSession = Depends(get_read_session)
+):
     build: schema.Build = await crud.get_build_by_id(session=session, build_id=build_id)
     if not build:
         raise HTTPException(status_code=404, detail="Build not found")
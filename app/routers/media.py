@@ -0,0 +1,72 @@
+import uuid
+from typing import Optional
+
+from fastapi import APIRouter, Depends
+from fastapi.exceptions import HTTPException
+from fastapi.responses import RedirectResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db import crud
+from app.db import schema
+from app.db.database import get_session
+from app.db.run_writer import run_writer
+from app.helpers.api_helper import ExceptionRoute
+from app.helpers.settings import settings
+from app.helpers.ttl_cache import TTLCache
+from app.helpers.url_signer import thumb_uri, url_signer
+
+router = APIRouter(route_class=ExceptionRoute, prefix="/media", tags=["media"])
+
+# the s3 uri behind each (run_id, field), which never changes once the run
+# has it, so following a reference does not read the run again
+media_uris = TTLCache(
+    name="media", maxsize=settings.MEDIA_CACHE_SIZE, ttl=settings.MEDIA_CACHE_SECONDS
+)
+
+
+async def get_media_uri(
+    session: AsyncSession, run_id: str, field: str
+) -> Optional[str]:
+    try:
+        uuid.UUID(run_id)
+    except ValueError:
+        return None
+
+    s3_uri = media_uris.get((run_id, field))
+    if s3_uri != None:
+        return s3_uri
+
+    # runs from the last moments may not have been written yet
+    row = run_writer.get_pending(run_id)
+    if row == None:
+        run: schema.Run = await crud.get_run_by_id(session=session, run_id=run_id)
+        if run == None:
+            return None
+        row = {"input_json": run.input_json, "output_json": run.output_json}
+
+    for fields in [row["input_json"], row["output_json"]]:
+        value = (fields or {}).get(field)
+        if isinstance(value, str) and value.startswith("s3://"):
+            media_uris.set((run_id, field), value)
+            return value
+    return None
+
+
+@router.get("/{run_id}/{field}")
+async def get_media(
+    run_id: str,
+    field: str,
+    thumb: bool = False,
+    session: AsyncSession = Depends(get_session),
+):
+    # signs when followed, for responses that asked for media references
+    s3_uri = await get_media_uri(session=session, run_id=run_id, field=field)
+    if s3_uri == None:
+        raise HTTPException(status_code=404, detail="Media not found")
+
+    url = url_signer.sign(thumb_uri(s3_uri) if thumb else s3_uri)
+    return RedirectResponse(
+        url,
+        status_code=307,
+        headers={"Cache-Control": f"private, max-age={settings.MEDIA_MAX_AGE_SECONDS}"},
+    )
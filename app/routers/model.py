@@ -5,9 +5,9 @@ from fastapi.exceptions import HTTPException
 from starlette import status
 from fastapi import WebSocket
 from typer.params import Option
-from app.db.database import get_session
+from app.db.database import get_session, get_read_session
 from app.auth.auth_bearer import JWTBearer
-from fastapi import APIRouter, Depends, Body
+from fastapi import APIRouter, Depends, Body, Response
 from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 
@@ -17,44 +17,71 @@ from app.db import schema
 from app.db import crud
 
 from app.helpers.logger import get_log
+from app.helpers.api_helper import set_next_cursor
 
 router = APIRouter(route_class=ExceptionRoute, prefix="/model", tags=["model"])
 
 
 @router.get("/", response_model=List[schema.Model])
 async def get_models(
+    response: Response,
     offset: Optional[int] = 0,
     limit: Optional[int] = 10,
+    cursor: Optional[str] = None,
     user_id: Optional[str] = None,
-    session: AsyncSession = Depends(get_session),
+    session: AsyncSession = Depends(get_read_session),
 ):
-    if user_id == None:
-        return await crud.get_models(
-            session=session,
-            offset=offset,
-            limit=limit,
-            status=schema.ModelStatus.Public,
-        )
-    else:
-        return await crud.get_models_by_user_id(
-            session=session, offset=offset, limit=limit, user_id=user_id
-        )
+    try:
+        if user_id == None:
+            models = await crud.get_models(
+                session=session,
+                offset=offset,
+                limit=limit,
+                cursor=cursor,
+                status=schema.ModelStatus.Public,
+            )
+        else:
+            models = await crud.get_models_by_user_id(
+                session=session,
+                offset=offset,
+                limit=limit,
+                cursor=cursor,
+                user_id=user_id,
+            )
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    set_next_cursor(response=response, items=models, limit=limit)
+    return models
 
 
 @router.get("/me", response_model=List[schema.Model])
 async def get_me(
+    response: Response,
     status: Optional[schema.ModelStatus] = schema.ModelStatus.Public,
     offset: Optional[int] = 0,
     limit: Optional[int] = 10,
+    cursor: Optional[str] = None,
     user_id: Optional[str] = None,
     token: schema.Token = Depends(JWTBearer()),
-    session: AsyncSession = Depends(get_session),
+    session: AsyncSession = Depends(get_read_session),
 ):
     user_id = str(token.user_id)
 
-    return await crud.get_models_by_user_id(
-        session=session, offset=offset, limit=limit, user_id=user_id, status=status
-    )
+    try:
+        models = await crud.get_models_by_user_id(
+            session=session,
+            offset=offset,
+            limit=limit,
+            cursor=cursor,
+            user_id=user_id,
+            status=status,
+        )
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    set_next_cursor(response=response, items=models, limit=limit)
+    return models
 
 
 @router.put("/{model_id}", response_model=schema.Model)
@@ -77,6 +104,11 @@ async def update_model(
         model_dict["credits"] = params["credits"]
     if "description" in params:
         model_dict["description"] = params["description"]
+    if "config_json" in params:
+        config_json = params["config_json"]
+        if config_json != None and not isinstance(config_json, dict):
+            raise HTTPException(status_code=400, detail="config_json must be an object")
+        model_dict["config_json"] = config_json
 
     if len(model_dict) > 0:
         await crud.update_model(
@@ -118,7 +150,9 @@ async def delete_model(
 
 
 @router.get("/{model_id}", response_model=schema.Model)
-async def get_model(model_id: str, session: AsyncSession = Depends(get_session)):
+async def get_model(
+    model_id: str, session: AsyncSession = Depends(get_read_session)
+):
     model: schema.Model = await crud.get_model_by_id(session=session, model_id=model_id)
     if not model:
         raise HTTPException(status_code=404, detail="Model not found")
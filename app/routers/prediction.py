@@ -1,16 +1,23 @@
+import asyncio
+import hashlib
+import json
 import sys
-from typing import Optional
+from typing import Dict, List, Optional
 
-from fastapi import BackgroundTasks
 from fastapi.param_functions import Body
 from sqlalchemy.sql.functions import user
-from app.helpers.boto_helper import invoke_lambda_function
+from app.helpers.boto_helper import (
+    get_s3_etag,
+    invoke_lambda_function,
+    write_string_to_s3,
+)
 from app.auth.auth_bearer import OptionalJWTBearer
 from app.helpers.api_helper import ExceptionRoute
 
 from fastapi.exceptions import HTTPException
-from app.db.database import get_session
-from fastapi import APIRouter, Depends
+from app.db.database import async_session, get_session
+from fastapi import APIRouter, Depends, Request
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import datetime, timezone
 import copy
@@ -19,6 +26,13 @@ from pathlib import Path
 from app.helpers.settings import settings
 from app.db import schema
 from app.db import crud
+from app.db.run_writer import run_writer
+from app.helpers import metrics
+from app.helpers.admission import get_admission
+from app.helpers.circuit_breaker import CircuitOpen
+from app.helpers.run_queue import run_queue
+from app.helpers.singleflight import SingleFlight
+from app.helpers.ttl_cache import TTLCache
 
 from app.helpers.logger import get_log
 
@@ -27,102 +41,177 @@ router = APIRouter(
 )
 
 
-async def update_build_lastrun(
-    user_id: Optional[str],
-    github_username: Optional[str],
-    run_id: str,
-    model_id: str,
-    build_id: str,
-    input_json: dict,
-    output_json: dict,
-    duration_ms: int,
-    session: AsyncSession,
-):
-    # last_run = datetime.now()
-    last_run = datetime.now(timezone.utc)
-    await crud.update_build(
-        session=session,
-        build_id=build_id,
-        update_values={"last_run": last_run},
-    )
-
+def normalize_input_json(input_json: dict) -> dict:
+    # uploaded images arrive as presigned urls, store the s3 uri instead
+    bucket_url = f"https://{settings.AWS_REQUESTS_LOG_BUCKET}"
     for key, value in input_json.items():
-        if f"https://{settings.AWS_REQUESTS_LOG_BUCKET}" in value:
+        if isinstance(value, str) and bucket_url in value:
             s3_uri = (
-                input_json["image input"]
-                .split("?")[0]
+                value.split("?")[0]
                 .replace(".s3.amazonaws.com", "")
                 .replace("https://", "s3://")
             )
             input_json[key] = s3_uri
+    return input_json
 
-    await crud.create_run(
-        session=session,
-        user_id=user_id,
-        github_username=github_username,
-        run_id=run_id,
-        input_json=input_json,
-        output_json=output_json,
-        build_id=build_id,
-        duration_ms=duration_ms,
-        model_id=model_id,
+
+# lambda results keyed by (active_build_id, payload_hash), so a new build
+# never serves results from the previous one. Models whose output is not a
+# function of their input opt out with {"prediction_cache": false} in
+# config_json.
+prediction_cache = TTLCache(
+    name="prediction",
+    maxsize=settings.PREDICTION_CACHE_SIZE,
+    ttl=settings.PREDICTION_CACHE_TTL_SECONDS,
+    maxbytes=settings.PREDICTION_CACHE_MAX_BYTES,
+)
+
+
+# identical predictions already running share one invocation, keyed like the
+# cache. Each request still writes its own run row.
+prediction_flight = SingleFlight(name="prediction")
+
+
+def use_prediction_cache(model: schema.Model) -> bool:
+    return settings.PREDICTION_CACHE_SIZE > 0 and model.get_config(
+        "prediction_cache", True
     )
 
 
-@router.post("/{model_id}", response_model=schema.Run)
-async def create(
-    model_id: str,
-    background_tasks: BackgroundTasks,
-    run_id: str,
-    payload: dict = Body(...),
-    token: Optional[schema.Token] = Depends(OptionalJWTBearer()),
-    session: AsyncSession = Depends(get_session),
-):
-    user = None
-    if token != None:
-        user: schema.User = await crud.get_user(session=session, user_id=token.user_id)
+async def payload_hash(payload: dict) -> Optional[str]:
+    # every upload gets its own key and presigned url, so s3 inputs are hashed
+    # by etag, which is the md5 of the content for a single part upload
+    canonical = {}
+    for key, value in normalize_input_json(copy.deepcopy(payload)).items():
+        if isinstance(value, str) and value.startswith("s3://"):
+            try:
+                value = {"s3_etag": await get_s3_etag(value)}
+            except Exception:
+                get_log(name=__name__).warning(
+                    f"no etag for {value}, not caching", exc_info=True
+                )
+                return None
+        canonical[key] = value
 
-    model: schema.Model = await crud.get_model_by_id(session=session, model_id=model_id)
-    if not model:
-        raise HTTPException(status_code=404, detail="Model not found")
+    raw = json.dumps(canonical, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(raw.encode()).hexdigest()
 
-    if not run_id:
-        raise HTTPException(status_code=404, detail="Run not found")
-    try:
-        val = uuid.UUID(run_id, version=1)
-    except ValueError:
-        raise HTTPException(status_code=404, detail="Run not valid")
 
-    existing_run: schema.Run = await crud.get_run_by_id(session=session, run_id=run_id)
-    if existing_run != None:
-        raise HTTPException(status_code=404, detail="Run invalid")
+async def spill_input(build: schema.Build, input_json: dict) -> dict:
+    # the invoke payload is capped at 6 MB and is serialized on both ends, so
+    # large inputs go to the requests bucket and the lambda reads them back.
+    # builds get the same limit as INLINE_MAX_BYTES for their whole response
+    # and return their largest outputs past it as s3 uris, which are signed
+    # like any other s3 output.
+    if not build.reads_spilled_input():
+        return input_json
+
+    raw = json.dumps(input_json)
+    if len(raw.encode()) <= settings.PREDICTION_INLINE_MAX_BYTES:
+        return input_json
+
+    input_s3_uri = (
+        f"s3://{settings.AWS_REQUESTS_LOG_BUCKET}/{input_json['request_id']}"
+        "/input.json"
+    )
+    await write_string_to_s3(contents=raw, s3_uri=input_s3_uri)
+    metrics.incr("prediction_inputs_spilled")
+    return {
+        "request_id": input_json["request_id"],
+        "output_bucket_name": input_json["output_bucket_name"],
+        "input_s3_uri": input_s3_uri,
+    }
+
+
+async def invoke_model(model: schema.Model, run_id: str, payload: dict) -> tuple:
+    cache_key = None
+    if use_prediction_cache(model):
+        digest = await payload_hash(payload)
+        if digest != None:
+            cache_key = (model.active_build_id, digest)
+    else:
+        metrics.incr("prediction_cache_bypass")
+
+    cached = prediction_cache.get(cache_key) if cache_key != None else None
+    if cached != None:
+        return copy.deepcopy(cached["output_json"]), cached["duration_ms"]
 
     input_json = copy.deepcopy(payload)
 
     input_json["request_id"] = f"{model.active_build_id}/{run_id}"
     input_json["output_bucket_name"] = settings.AWS_REQUESTS_LOG_BUCKET
-    function_params = {"body": input_json}
 
     function_name: str = model.active_build.lambda_function_arn
-    try:
-        result, duration_ms = await invoke_lambda_function(
-            function_name=function_name, function_params=function_params
+
+    async def invoke():
+        function_params = {
+            "body": await spill_input(build=model.active_build, input_json=input_json)
+        }
+        return await invoke_lambda_function(
+            function_name=function_name,
+            function_params=function_params,
+            # latency sensitive models opt in with {"hedge": true}
+            hedge=model.get_config("hedge", False),
         )
-    except:
+
+    shared = False
+    try:
+        if cache_key == None:
+            result, duration_ms = await invoke()
+        else:
+            (result, duration_ms), shared = await prediction_flight.do(
+                cache_key, invoke
+            )
+            result = copy.deepcopy(result)
+        # errors are never cached, the next request tries again
+        if cache_key != None and not shared:
+            prediction_cache.set(
+                cache_key,
+                {"output_json": copy.deepcopy(result), "duration_ms": duration_ms},
+                size=len(json.dumps(result)),
+            )
+    except asyncio.CancelledError:
+        raise
+    except CircuitOpen:
+        # nothing was invoked, the caller gets a 503 and tries again later
+        raise
+    except Exception:
         duration_ms = 0
         result = {"error": str(sys.exc_info()[1]).split("\r\n")[0]}
 
-    background_tasks.add_task(
-        update_build_lastrun,
-        user_id=str(user.id) if user else None,
-        github_username=user.github_username if user else None,
-        run_id=run_id,
-        model_id=str(model.id),
-        build_id=model.active_build_id,
-        input_json=payload,
-        output_json=result,
-        duration_ms=duration_ms,
-        session=session,
+    return result, duration_ms
+
+
+def prediction_status(result: dict) -> schema.RunStatus:
+    # invoke_model reports a failed invocation as a lone error key
+    if list(result.keys()) == ["error"]:
+        return schema.RunStatus.Error
+    return schema.RunStatus.Finished
+
+
+async def record_run(
+    model: schema.Model,
+    run_id: str,
+    payload: dict,
+    result: dict,
+    duration_ms: int,
+    user: Optional[schema.User],
+    media_refs: bool = False,
+) -> schema.Run:
+    created_at = datetime.now(timezone.utc)
+    await run_writer.add(
+        {
+            "id": run_id,
+            "user_id": str(user.id) if user else None,
+            "github_username": user.github_username if user else None,
+            "input_json": normalize_input_json(copy.deepcopy(payload)),
+            "output_json": result,
+            "model_id": str(model.id),
+            "build_id": model.active_build_id,
+            "duration_ms": duration_ms,
+            "status": prediction_status(result),
+            "created_at": created_at,
+        }
     )
 
     output_json = copy.deepcopy(result)
@@ -135,20 +224,275 @@ async def create(
         input_json=input_json,
         output_json=output_json,
         build_id=model.active_build_id,
-        model_id=model_id,
+        model_id=str(model.id),
         duration_ms=duration_ms,
-        created_at=datetime.now(timezone.utc),
+        status=prediction_status(result),
+        created_at=created_at,
     )
 
+    if media_refs:
+        run.add_media_refs()
+        return run
+
     try:
-        get_log(name=__name__).debug(f"{function_name} adding_signed_urls")
+        get_log(name=__name__).debug(f"{run_id} adding_signed_urls")
         run.add_signed_urls()
-        get_log(name=__name__).debug(f"{function_name} {run}")
-        get_log(name=__name__).debug(f"{function_name} finished adding_signed_urls")
+        get_log(name=__name__).debug(f"{run_id} {run}")
+        get_log(name=__name__).debug(f"{run_id} finished adding_signed_urls")
     except:
         message = str(sys.exc_info()[1])
         get_log(name=__name__).error(str(message), exc_info=True)
         raise
 
-    # run.add_signed_urls()
+    return run
+
+
+def client_key(request: Request, token: Optional[schema.Token]) -> str:
+    # who a per user rate applies to, anonymous callers by address. the load
+    # balancer appends the address it saw to X-Forwarded-For.
+    if token != None:
+        return f"user:{token.user_id}"
+    forwarded = request.headers.get("X-Forwarded-For")
+    if forwarded:
+        return f"ip:{forwarded.split(',')[-1].strip()}"
+    return f"ip:{request.client.host if request.client else 'unknown'}"
+
+
+async def check_new_run(session: AsyncSession, model_id: str, run_id: str):
+    model: schema.Model = await crud.get_model_by_id(
+        session=session, model_id=model_id, use_cache=True
+    )
+    if not model:
+        raise HTTPException(status_code=404, detail="Model not found")
+
+    if not run_id:
+        raise HTTPException(status_code=404, detail="Run not found")
+    try:
+        val = uuid.UUID(run_id, version=1)
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Run not valid")
+
+    existing_run: schema.Run = await crud.get_run_by_id(session=session, run_id=run_id)
+    if existing_run != None or run_writer.is_pending(run_id):
+        raise HTTPException(status_code=404, detail="Run invalid")
+
+    return model
+
+
+@router.post("/{model_id}", response_model=schema.Run)
+async def create(
+    model_id: str,
+    run_id: str,
+    request: Request,
+    payload: dict = Body(...),
+    media_refs: bool = False,
+    token: Optional[schema.Token] = Depends(OptionalJWTBearer()),
+    session: AsyncSession = Depends(get_session),
+):
+    model = await check_new_run(session=session, model_id=model_id, run_id=run_id)
+
+    admission = get_admission(model_id=str(model.id), config_json=model.config_json)
+    admission.check_rate(user_key=client_key(request=request, token=token))
+    async with admission.slot(timeout=settings.PREDICTION_QUEUE_SECONDS):
+        result, duration_ms = await invoke_model(
+            model=model, run_id=run_id, payload=payload
+        )
+
+    # only needed for the run row, so looked up after the invocation
+    user = None
+    if token != None:
+        user: schema.User = await crud.get_user(session=session, user_id=token.user_id)
+
+    return await record_run(
+        model=model,
+        run_id=run_id,
+        payload=payload,
+        result=result,
+        duration_ms=duration_ms,
+        user=user,
+        media_refs=media_refs,
+    )
+
+
+@router.post("/{model_id}/batch")
+async def create_batch(
+    model_id: str,
+    request: Request,
+    payloads: List[dict] = Body(...),
+    media_refs: bool = False,
+    token: Optional[schema.Token] = Depends(OptionalJWTBearer()),
+    session: AsyncSession = Depends(get_session),
+):
+    # each input gets its own run, streamed back as one json line per run in
+    # the order they finish: {"index": <position in payloads>, "run": {...}}
+    if len(payloads) == 0:
+        raise HTTPException(status_code=400, detail="No inputs")
+    if len(payloads) > settings.PREDICTION_BATCH_MAX_SIZE:
+        raise HTTPException(
+            status_code=413,
+            detail=f"At most {settings.PREDICTION_BATCH_MAX_SIZE} inputs per batch",
+        )
+
+    model: schema.Model = await crud.get_model_by_id(
+        session=session, model_id=model_id, use_cache=True
+    )
+    if not model:
+        raise HTTPException(status_code=404, detail="Model not found")
+
+    user = None
+    if token != None:
+        user: schema.User = await crud.get_user(session=session, user_id=token.user_id)
+
+    semaphore = asyncio.Semaphore(settings.PREDICTION_BATCH_CONCURRENCY)
+    admission = get_admission(model_id=str(model.id), config_json=model.config_json)
+    user_key = client_key(request=request, token=token)
+
+    async def predict(index: int, payload: dict) -> str:
+        try:
+            # every input counts against the model's limits
+            admission.check_rate(user_key=user_key)
+            async with semaphore, admission.slot(
+                timeout=settings.PREDICTION_QUEUE_SECONDS
+            ):
+                run_id = str(uuid.uuid1())
+                result, duration_ms = await invoke_model(
+                    model=model, run_id=run_id, payload=payload
+                )
+            # rows go through the run writer, which inserts them in bulk
+            run = await record_run(
+                model=model,
+                run_id=run_id,
+                payload=payload,
+                result=result,
+                duration_ms=duration_ms,
+                user=user,
+                media_refs=media_refs,
+            )
+            return f'{{"index": {index}, "run": {run.json()}}}\n'
+        except Exception as e:
+            get_log(name=__name__).error(f"batch input {index} failed", exc_info=True)
+            return json.dumps({"index": index, "error": str(e)}) + "\n"
+
+    async def stream():
+        tasks = [
+            asyncio.ensure_future(predict(index=i, payload=payload))
+            for i, payload in enumerate(payloads)
+        ]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            # the client went away, stop invoking for the rest
+            for task in tasks:
+                task.cancel()
+
+    metrics.incr("prediction_batches")
+    metrics.incr("prediction_batch_inputs", len(payloads))
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+
+async def run_job(
+    model: schema.Model, run_id: str, payload: dict, created_at: datetime
+):
+    # called by the run worker for each message on the run queue. a
+    # cancelled job writes nothing, the broker hands the message to another
+    # worker and the run stays pending until then.
+    duration_ms = 0
+    try:
+        async with async_session() as session:
+            await crud.update_run(
+                session=session,
+                run_id=run_id,
+                update_values={"status": schema.RunStatus.Running},
+            )
+        # submitted runs wait for a slot much longer than synchronous ones,
+        # counted from the submit so time spent on the queue is included
+        waited = (datetime.now(timezone.utc) - created_at).total_seconds()
+        admission = get_admission(
+            model_id=str(model.id), config_json=model.config_json
+        )
+        async with admission.slot(
+            timeout=max(settings.PREDICTION_JOB_QUEUE_SECONDS - waited, 0)
+        ):
+            result, duration_ms = await invoke_model(
+                model=model, run_id=run_id, payload=payload
+            )
+        status = prediction_status(result)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        get_log(name=__name__).error(f"run {run_id} failed", exc_info=True)
+        status = schema.RunStatus.Error
+        result = {"error": str(e)}
+
+    # a failed write raises, so the message is requeued and tried again
+    async with async_session() as session:
+        await crud.update_run(
+            session=session,
+            run_id=run_id,
+            update_values={
+                "output_json": result,
+                "duration_ms": duration_ms,
+                "status": status,
+            },
+        )
+    run_writer.touch_build(
+        build_id=model.active_build_id, last_run=datetime.now(timezone.utc)
+    )
+    metrics.incr(f"prediction_jobs_{status.lower()}")
+
+
+@router.post("/{model_id}/submit", response_model=schema.Run, status_code=202)
+async def submit(
+    model_id: str,
+    run_id: str,
+    request: Request,
+    payload: dict = Body(...),
+    media_refs: bool = False,
+    token: Optional[schema.Token] = Depends(OptionalJWTBearer()),
+    session: AsyncSession = Depends(get_session),
+):
+    # returns the queued run at once, poll GET /run/{run_id} or send
+    # {"command": "subscribe_run", "run_id": ...} on /ws for the result
+    model = await check_new_run(session=session, model_id=model_id, run_id=run_id)
+
+    admission = get_admission(model_id=str(model.id), config_json=model.config_json)
+    admission.check_rate(user_key=client_key(request=request, token=token))
+
+    user = None
+    if token != None:
+        user: schema.User = await crud.get_user(session=session, user_id=token.user_id)
+
+    run = await crud.create_run(
+        session=session,
+        user_id=str(user.id) if user else None,
+        github_username=user.github_username if user else None,
+        run_id=run_id,
+        input_json=normalize_input_json(copy.deepcopy(payload)),
+        output_json=None,
+        model_id=str(model.id),
+        duration_ms=None,
+        build_id=model.active_build_id,
+        status=schema.RunStatus.Queued,
+    )
+
+    try:
+        await run_queue.publish(model_id=str(model.id), run_id=run_id, payload=payload)
+    except Exception:
+        get_log(name=__name__).error(f"run {run_id} not queued", exc_info=True)
+        await crud.update_run(
+            session=session,
+            run_id=run_id,
+            update_values={
+                "output_json": {"error": "Run not queued"},
+                "status": schema.RunStatus.Error,
+            },
+        )
+        raise HTTPException(status_code=503, detail="Run not queued, try again")
+
+    run.input_json = copy.deepcopy(payload)
+    if media_refs:
+        run.add_media_refs()
+    else:
+        run.add_signed_urls()
     return run
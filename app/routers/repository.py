@@ -29,8 +29,11 @@ async def get_repos(
 
     try:
         g = github.Github(user.github_token)
-        user = await async_wrap(g.get_user)(github_username)
-        repos = await async_wrap(user.get_repos)()
+        user = await async_wrap(g.get_user, bulkhead="github")(github_username)
+        # the listing pages in lazily, so fetch it inside the bulkhead too
+        repos = await async_wrap(
+            lambda: list(user.get_repos()), bulkhead="github"
+        )()
         repos_list = []
         for repo in repos:
             if repo.private == True:
@@ -68,8 +71,12 @@ async def get_branches(
 
     try:
         g = github.Github(user.github_token)
-        repo = await async_wrap(g.get_repo)(f"{github_username}/{repo_name}")
-        branches = await async_wrap(repo.get_branches)()
+        repo = await async_wrap(g.get_repo, bulkhead="github")(
+            f"{github_username}/{repo_name}"
+        )
+        branches = await async_wrap(
+            lambda: list(repo.get_branches()), bulkhead="github"
+        )()
         branch_names = [
             schema.Branch(name=branch.name, commit=branch.commit.sha)
             for branch in branches
@@ -96,15 +103,22 @@ async def get_notebooks(
 ):
     user: schema.User = await crud.get_user(session=session, user_id=token.user_id)
     g = github.Github(user.github_token)
-    repo = await async_wrap(g.get_repo)(f"{github_username}/{repo_name}")
-    contents = repo.get_contents("", ref=branch_name)
-    nbs = []
-    while contents:
-        file_content = contents.pop(0)
-        if file_content.type == "dir":
-            contents.extend(repo.get_contents(file_content.path, ref=branch_name))
-        elif Path(file_content.path).suffix == ".ipynb":
-            nbs.append(file_content)
+    repo = await async_wrap(g.get_repo, bulkhead="github")(
+        f"{github_username}/{repo_name}"
+    )
+
+    def find_notebooks() -> list:
+        contents = repo.get_contents("", ref=branch_name)
+        nbs = []
+        while contents:
+            file_content = contents.pop(0)
+            if file_content.type == "dir":
+                contents.extend(repo.get_contents(file_content.path, ref=branch_name))
+            elif Path(file_content.path).suffix == ".ipynb":
+                nbs.append(file_content)
+        return nbs
+
+    nbs = await async_wrap(find_notebooks, bulkhead="github")()
 
     return [
         schema.Notebook(name=nbs[i].path, size=nbs[i].size)
@@ -127,9 +141,13 @@ async def get_notebook(
     try:
         user: schema.User = await crud.get_user(session=session, user_id=token.user_id)
         g = github.Github(user.github_token)
-        repo = await async_wrap(g.get_repo)(f"{github_username}/{repo_name}")
+        repo = await async_wrap(g.get_repo, bulkhead="github")(
+            f"{github_username}/{repo_name}"
+        )
         notebook_path = notebook_path.replace("|", "/")
-        contents = repo.get_contents(notebook_path, ref=branch_name)
+        contents = await async_wrap(repo.get_contents, bulkhead="github")(
+            notebook_path, ref=branch_name
+        )
         file_data = base64.b64decode(contents.content)
 
         notebook: schema.Notebook = schema.Notebook(
@@ -152,10 +170,11 @@ async def get_notebook(
 async def get_latest_commit(user: schema.User, build: schema.Build) -> str:
     try:
         g = github.Github(user.github_token)
-        repo = await async_wrap(g.get_repo)(
+        repo = await async_wrap(g.get_repo, bulkhead="github")(
             f"{user.github_username}/{build.repository}"
         )
-        commit = repo.get_branch(build.branch).commit
+        branch = await async_wrap(repo.get_branch, bulkhead="github")(build.branch)
+        commit = branch.commit
         return commit.sha
     except github.GithubException as e:
         if e.status == status.HTTP_404_NOT_FOUND:
@@ -3,12 +3,12 @@ from fastapi import BackgroundTasks
 from fastapi.param_functions import Body
 
 from app.auth.auth_bearer import JWTBearer
-from app.helpers.api_helper import ExceptionRoute
+from app.helpers.api_helper import ExceptionRoute, set_next_cursor
 
 from fastapi.exceptions import HTTPException
 from typer.params import Option
-from app.db.database import get_session
-from fastapi import APIRouter, Depends
+from app.db.database import get_read_session, get_session
+from fastapi import APIRouter, Depends, Response
 from sqlalchemy.ext.asyncio import AsyncSession
 import datetime
 import copy
@@ -18,6 +18,7 @@ from app.helpers.settings import settings
 
 from app.db import schema
 from app.db import crud
+from app.db.run_writer import run_writer
 
 from app.helpers.logger import get_log
 
@@ -26,23 +27,66 @@ router = APIRouter(route_class=ExceptionRoute, prefix="/run", tags=["run"])
 
 @router.get("/", response_model=List[schema.Run])
 async def get_runs(
+    response: Response,
     offset: Optional[int] = 0,
     limit: Optional[int] = 10,
+    cursor: Optional[str] = None,
     model_id: Optional[str] = None,
     build_id: Optional[str] = None,
     user_id: Optional[str] = None,
-    session: AsyncSession = Depends(get_session),
+    input_key: Optional[str] = None,
+    output_key: Optional[str] = None,
+    media_refs: bool = False,
+    session: AsyncSession = Depends(get_read_session),
 ):
-    runs: List[schema.Run] = await crud.get_runs(
-        session=session,
-        offset=offset,
-        limit=limit,
-        model_id=model_id,
-        build_id=build_id,
-        user_id=user_id,
-    )
-
-    for run in runs:
-        run.add_signed_urls()
+    # media_refs returns /media references instead of signing every url
+    try:
+        runs: List[schema.Run] = await crud.get_runs(
+            session=session,
+            offset=offset,
+            limit=limit,
+            cursor=cursor,
+            model_id=model_id,
+            build_id=build_id,
+            user_id=user_id,
+            input_key=input_key,
+            output_key=output_key,
+        )
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    set_next_cursor(response=response, items=runs, limit=limit)
+
+    if media_refs:
+        for run in runs:
+            run.add_media_refs()
+    else:
+        schema.sign_runs(runs)
 
     return runs
+
+
+@router.get("/{run_id}", response_model=schema.Run)
+async def get_run(
+    run_id: str, media_refs: bool = False, session: AsyncSession = Depends(get_session)
+):
+    try:
+        uuid.UUID(run_id)
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Run not found")
+
+    # runs from the last moments may not have been written yet
+    row = run_writer.get_pending(run_id)
+    if row != None:
+        run = schema.Run(**copy.deepcopy(row))
+    else:
+        # read from the primary, clients poll this right after submitting a run
+        run: schema.Run = await crud.get_run_by_id(session=session, run_id=run_id)
+    if run == None:
+        raise HTTPException(status_code=404, detail="Run not found")
+
+    if media_refs:
+        run.add_media_refs()
+    else:
+        run.add_signed_urls()
+    return run
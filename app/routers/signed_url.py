@@ -35,7 +35,9 @@ async def create(
     run_id: str,
     session: AsyncSession = Depends(get_session),
 ):
-    model: schema.Model = await crud.get_model_by_id(session=session, model_id=model_id)
+    model: schema.Model = await crud.get_model_by_id(
+        session=session, model_id=model_id, use_cache=True
+    )
     if not model:
         raise HTTPException(status_code=404, detail="Model not found")
 
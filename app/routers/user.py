@@ -8,29 +8,40 @@ import github
 
 from app.helpers.settings import settings
 from app.db import schema
-from app.db.database import get_session
+from app.db.database import get_session, get_read_session
 from app.db import crud
 from app.auth.auth_bearer import JWTBearer
 from app.auth.auth_handler import signJWT, signCSRF
 from app.helpers.logger import get_log
+from app.helpers.asyncwrapper import async_wrap
 
 router = APIRouter(route_class=ExceptionRoute, prefix="/user", tags=["user"])
 
 
-async def _fetch_github_user(token: str) -> schema.User:
+def _read_github_user(token: str) -> tuple:
     user_github = github.Github(token).get_user()
     emails = user_github.get_emails()
+    # the user is fetched lazily on first attribute access, so its fields are
+    # read here rather than on the event loop
+    profile = {
+        "avatar_url": user_github.avatar_url,
+        "html_url": user_github.html_url,
+        "fullname": user_github.name,
+        "github_id": user_github.id,
+        "github_username": user_github.login,
+    }
+    return profile, emails
+
+
+async def _fetch_github_user(token: str) -> schema.User:
+    profile, emails = await async_wrap(_read_github_user, bulkhead="github")(token)
     if emails == None or len(emails) == 0:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Invalid GitHub email"
         )
     email = emails[0].email
     user = schema.GithubUser(
-        avatar_url=user_github.avatar_url,
-        html_url=user_github.html_url,
-        fullname=user_github.name,
-        github_id=user_github.id,
-        github_username=user_github.login,
+        **profile,
         email=email,
         github_token=token,
         type=schema.UserType.GithubVerified,
@@ -102,7 +113,7 @@ async def user_login_github(
 @router.get("/me", response_model=schema.User)
 async def get_me(
     token: schema.Token = Depends(JWTBearer()),
-    session: AsyncSession = Depends(get_session),
+    session: AsyncSession = Depends(get_read_session),
 ):
     user_id = token.user_id
     user: schema.User = await crud.get_user(session=session, user_id=user_id)
@@ -113,7 +124,9 @@ async def get_me(
 
 
 @router.get("/{user_id}", response_model=schema.ProfileUser)
-async def get_profile(user_id: str, session: AsyncSession = Depends(get_session)):
+async def get_profile(
+    user_id: str, session: AsyncSession = Depends(get_read_session)
+):
     user: schema.User = await crud.get_user(session=session, user_id=user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
@@ -15,6 +15,7 @@ from app.helpers.settings import load_settings_async, settings
 from app.helpers.logger import get_log
 from app.db import schema
 from app.db import crud
+from app.db.database import async_session
 from app.helpers.rabbit_helper import get_connection, MessageState
 from app.routers.repository import get_notebook
 from app.helpers.boto_helper import write_string_to_s3
@@ -115,6 +116,27 @@ async def start_build(build_id: str, command: str = "start"):
                 pass
 
 
+async def subscribe_run(websocket: WebSocket, run_id: str):
+    # sends the run once it has finished, the run worker writes it to the row
+    while True:
+        # a new session each time, so the row is not served from the identity map
+        async with async_session() as session:
+            run: Optional[schema.Run] = await crud.get_run_by_id(
+                session=session, run_id=run_id
+            )
+
+        if run == None:
+            await websocket.send_text(json.dumps({"error": "Run not found"}))
+            return
+
+        if not run.is_pending():
+            run.add_signed_urls()
+            await websocket.send_text(run.json())
+            return
+
+        await asyncio.sleep(settings.RUN_POLL_SECONDS)
+
+
 async def start(websocket: WebSocket, session: AsyncSession):
     try:
         await websocket.accept()
@@ -131,6 +153,10 @@ async def start(websocket: WebSocket, session: AsyncSession):
             if "build_id" in input_data:
                 build_id = input_data["build_id"]
 
+            if input_data.get("command") == "subscribe_run" and "run_id" in input_data:
+                await subscribe_run(websocket=websocket, run_id=input_data["run_id"])
+                return
+
             if jwt == None or build_id == None:
                 raise HTTPException(
                     status_code=status.HTTP_401_UNAUTHORIZED,
@@ -26,7 +26,6 @@ import asyncio
 from aio_pika.connection import ConnectionType
 import json
 
-from sqlalchemy.pool import NullPool
 from app.helpers.logger import get_log
 from pathlib import Path
 import os
@@ -40,14 +39,13 @@ import shutil
 import boto3
 
 import sys
-from app.helpers.asyncwrapper import async_wrap
+from app.helpers.asyncwrapper import async_iterate, async_wrap
 import time
 import aiofiles
 
-from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.ext.asyncio import create_async_engine
-from sqlalchemy.orm import sessionmaker
+from app.db import database
+from app.db.database import async_session
 
 from app.helpers.file_helper import sample_params_from_input_json
 
@@ -57,6 +55,7 @@ from app.helpers.boto_helper import (
     get_ecr_public_client,
     write_file_to_s3,
     get_ecr_private_client,
+    get_client,
 )
 from app.helpers.rabbit_helper import MessageState, get_connection
 from app.helpers.file_helper import (
@@ -78,12 +77,6 @@ build_count = 0
 ecr_repository_name = settings.ECR_REPOSITORY_NAME
 aws_account_id = settings.AWS_ACCOUNT_ID
 
-engine = create_async_engine(
-    settings.SQLALCHEMY_DATABASE_URI, echo=False, poolclass=NullPool
-)
-Base = declarative_base()
-async_session = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
-
 
 async def download_notebook_from_s3(s3_uri: str, tmp_dir):
     notebook_contents = await read_string_from_s3(s3_uri=s3_uri)
@@ -124,7 +117,7 @@ async def push_to_aws(
             cancel_if_needed=cancel_if_needed_partial,
         )
 
-        for message in gen:
+        async for message in async_iterate(gen, bulkhead="docker"):
             await log_output(
                 message=message, state=MessageState.Running, include_newline=False
             )
@@ -191,13 +184,18 @@ def start_build_sync(queue_name, build_id, build_index):
 
 
 async def start_build(queue_name: str, build_id: str, build_index: int):
-    async with async_session() as session:
-        await start_build_with_session(
-            queue_name=queue_name,
-            build_id=build_id,
-            session=session,
-            build_index=build_index,
-        )
+    try:
+        async with async_session() as session:
+            await start_build_with_session(
+                queue_name=queue_name,
+                build_id=build_id,
+                session=session,
+                build_index=build_index,
+            )
+    finally:
+        # each build runs in its own forked process and event loop, so close
+        # the pooled connections before the loop goes away
+        await database.dispose()
 
 
 class LBTimer:
@@ -218,9 +216,7 @@ class LBTimer:
                 from ec2_metadata import ec2_metadata
 
                 instance_id: str = ec2_metadata.instance_id
-                import boto3
-
-                client = boto3.client("elbv2", region_name=settings.AWS_REGION_NAME)
+                client = get_client("elbv2")
 
                 response = client.describe_target_groups(
                     LoadBalancerArn=settings.LOAD_BALANCE_ARN
@@ -383,7 +379,9 @@ async def start_build_with_session(
                 "Docker error, check to make sure daemon is running", build_id=build_id
             )
 
-        username, password, registry = docker_builder.login_aws(
+        username, password, registry = await async_wrap(
+            docker_builder.login_aws, bulkhead="docker"
+        )(
             docker_client=docker_client,
             ecr_private_client=ecr_private_client,
             ecr_public_client=ecr_public_client,
@@ -403,7 +401,7 @@ async def start_build_with_session(
             cancel_if_needed=cancel_if_needed_partial,
         )
 
-        for line_payload in gen:
+        async for line_payload in async_iterate(gen, bulkhead="docker"):
             # for line_payload in line_payloads:
             message = line_payload["message"]
             if line_payload["type"] == "error":
@@ -419,7 +417,9 @@ async def start_build_with_session(
                 message="docker_image_id not found in docker build", build_id=build_id
             )
 
-        docker_image_size = docker_builder.inspect_image(
+        docker_image_size = await async_wrap(
+            docker_builder.inspect_image, bulkhead="docker"
+        )(
             docker_client=docker_client, tag=tag, build_id=build_id
         )
 
@@ -443,7 +443,7 @@ async def start_build_with_session(
             build_index=build_index,
         )
 
-        for line_payload in gen:
+        async for line_payload in async_iterate(gen, bulkhead="docker"):
             message = line_payload["message"]
             if line_payload["type"] == "error":
                 with open(log_file, "a") as my_log:
@@ -468,7 +468,7 @@ async def start_build_with_session(
             else:
                 await log_output(message=f"\r\n{message}", state=MessageState.Running)
 
-        docker_builder.tag_image(
+        await async_wrap(docker_builder.tag_image, bulkhead="docker")(
             docker_client=docker_client,
             tag=tag,
             image_uri=image_uri,
@@ -530,6 +530,7 @@ async def start_build_with_session(
             update_values={
                 "lambda_function_arn": function_arn,
                 "docker_image_uri": image_uri,
+                "template_version": schema.TEMPLATE_VERSION,
             },
         )
 
@@ -625,7 +626,7 @@ async def start_build_with_session(
             pass
 
         if docker_client:
-            await loop.run_in_executor(None, docker_client.close)
+            await async_wrap(docker_client.close, bulkhead="docker")()
 
         if rabbit_connection:
             await rabbit_connection.close()
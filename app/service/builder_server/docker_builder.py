@@ -267,6 +267,7 @@ def test_build_docker(
                     "AWS_SECRET_KEY": settings.DOCKER_AWS_SECRET_KEY,
                     "AWS_REGION_NAME": settings.AWS_REGION_NAME,
                     "AWS_REQUEST_BUCKET": settings.AWS_REQUESTS_LOG_BUCKET,
+                    "INLINE_MAX_BYTES": str(settings.PREDICTION_INLINE_MAX_BYTES),
                 },
                 detach=True,
                 auto_remove=True,
@@ -55,7 +55,10 @@ def deploy_lambda(
             PackageType="Image",
             Tags=tags,
             Environment={
-                "Variables": {"AWS_REQUEST_BUCKET": settings.AWS_REQUESTS_LOG_BUCKET}
+                "Variables": {
+                    "AWS_REQUEST_BUCKET": settings.AWS_REQUESTS_LOG_BUCKET,
+                    "INLINE_MAX_BYTES": str(settings.PREDICTION_INLINE_MAX_BYTES),
+                }
             },
             Publish=True,
         )
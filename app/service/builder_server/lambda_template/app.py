@@ -30,19 +30,122 @@ if os.path.isfile(".env"):
 
 API_KEY = os.getenv("API_KEY")
 
+# responses larger than this have their largest outputs written to the
+# request bucket instead, well under the 6 MB invoke response limit
+INLINE_MAX_BYTES = os.getenv("INLINE_MAX_BYTES")
 
-def handler(event, context):
+# the only bucket spilled inputs are read from
+REQUEST_BUCKET = os.getenv("AWS_REQUEST_BUCKET")
 
-    if type(event["body"]) is dict:
-        body = copy.deepcopy(event["body"])
+s3_client = None
+
+
+def get_s3_client():
+    global s3_client
+    if s3_client == None:
+        import boto3
+
+        # the local test container gets keys, the lambda uses its role
+        if os.getenv("AWS_ACCESS_KEY") != None:
+            s3_client = boto3.client(
+                "s3",
+                aws_access_key_id=os.getenv("AWS_ACCESS_KEY"),
+                aws_secret_access_key=os.getenv("AWS_SECRET_KEY"),
+                region_name=os.getenv("AWS_REGION_NAME"),
+            )
+        else:
+            s3_client = boto3.client("s3")
+    return s3_client
+
+
+def split_s3_uri(s3_uri):
+    bucket, _, key = s3_uri[len("s3://") :].partition("/")
+    return bucket, key
+
+
+def read_spilled_input(s3_uri):
+    bucket, key = split_s3_uri(s3_uri)
+    if REQUEST_BUCKET != None and bucket != REQUEST_BUCKET:
+        raise Exception("input_s3_uri is not in the request bucket")
+    response = get_s3_client().get_object(Bucket=bucket, Key=key)
+    return json.loads(response["Body"].read())
+
+
+def inference_response(request_id, result, duration):
+    return {
+        "headers": {"Content-Type": "application/json"},
+        "statusCode": 200,
+        "body": json.dumps(
+            {
+                "request_id": request_id,
+                "result": json.dumps(result),
+                "duration ms": round(duration, 3),
+            }
+        ),
+    }
+
+
+def response_size(request_id, result, duration):
+    # measured as sent, the result is json encoded twice on its way back
+    return len(json.dumps(inference_response(request_id, result, duration)).encode())
+
+
+def spill_value(key, value, request_id, bucket_name):
+    if isinstance(value, str):
+        contents, ext, content_type = value, "txt", "text/plain"
     else:
-        body = copy.deepcopy(json.loads(event["body"]))
+        contents, ext, content_type = json.dumps(value), "json", "application/json"
+
+    object_name = f"{request_id}/{key.replace('/', '-')}.{ext}"
+    get_s3_client().put_object(
+        Bucket=bucket_name,
+        Key=object_name,
+        Body=contents.encode(),
+        ContentType=content_type,
+    )
+    logger.info(f"spilled {key} to s3")
+    return f"s3://{bucket_name}/{object_name}"
+
+
+def spill_large_outputs(result, request_id, bucket_name, inline_max_bytes, duration):
+    # the largest values are written next to the request's other objects,
+    # until the whole response fits, and returned as s3 uris, which the api
+    # signs like any other s3 output
+    if bucket_name == None or inline_max_bytes == None:
+        return result
+
+    spilled = dict(result)
+    keys = [
+        key
+        for key, value in spilled.items()
+        if not (isinstance(value, str) and value.startswith("s3://"))
+    ]
+    keys.sort(key=lambda key: len(json.dumps(spilled[key])), reverse=True)
+    for key in keys:
+        if response_size(request_id, spilled, duration) <= inline_max_bytes:
+            break
+        spilled[key] = spill_value(key, spilled[key], request_id, bucket_name)
+    return spilled
+
+
+def handler(event, context):
 
     if API_KEY != None and "API_KEY" not in event:
         raise Exception("Missing API_KEY")
     elif API_KEY != None and event["API_KEY"] != os.getenv("API_KEY"):
         raise Exception("Incorrect API_KEY")
 
+    if type(event["body"]) is dict:
+        body = copy.deepcopy(event["body"])
+    else:
+        body = copy.deepcopy(json.loads(event["body"]))
+
+    # inputs too large for the invoke payload are sent as an s3 object
+    if "input_s3_uri" in body:
+        before_read_input = time.time()
+        body.update(read_spilled_input(body.pop("input_s3_uri")))
+        logger.info(f"read_spilled_input {time.time() - before_read_input}")
+
     if "request_id" in body:
         request_id = body["request_id"]
         del body["request_id"]
@@ -65,7 +168,7 @@ def handler(event, context):
                 "body": json.dumps(
                     {
                         "message": "input format here",
-                        "event": event,
+                        "request_id": request_id,
                         "result": json.dumps(input_format),
                     }
                 ),
@@ -79,7 +182,7 @@ def handler(event, context):
                 "headers": {"Content-Type": "application/json"},
                 "statusCode": 200,
                 "body": json.dumps(
-                    {"event": event, "result": json.dumps(output_format)}
+                    {"request_id": request_id, "result": json.dumps(output_format)}
                 ),
             }
 
@@ -110,14 +213,12 @@ def handler(event, context):
         f"before_convert_output_params {time.time() - before_convert_output_params}"
     )
 
-    return {
-        "headers": {"Content-Type": "application/json"},
-        "statusCode": 200,
-        "body": json.dumps(
-            {
-                "event": event,
-                "result": json.dumps(new_result),
-                "duration ms": round(duration, 3),
-            }
-        ),
-    }
+    new_result = spill_large_outputs(
+        result=new_result,
+        request_id=request_id,
+        bucket_name=output_bucket_name,
+        inline_max_bytes=int(INLINE_MAX_BYTES) if INLINE_MAX_BYTES else None,
+        duration=duration,
+    )
+
+    return inference_response(request_id, new_result, duration)
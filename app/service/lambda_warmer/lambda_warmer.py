@@ -0,0 +1,209 @@
+import asyncio
+import math
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+import sqlalchemy as sa
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from app.db import crud
+from app.db.database import async_session, engine
+from app.helpers import metrics
+from app.helpers.boto_helper import lambda_invoker
+from app.helpers.logger import get_log
+from app.helpers.settings import settings
+
+WARMER_LOCK_ID = 7240392
+
+# lambda_template/app.py answers this from a local file without predicting
+PING_PAYLOAD = {"body": {"get_inference_input_json": True}}
+
+
+class LambdaWarmer:
+    # one api worker holds a session advisory lock and pings the active build
+    # of models with recent traffic once they have been idle for
+    # keep_warm_seconds, busiest models first, within an hourly ping budget
+    def __init__(self):
+        self.pings_sent = 0
+        self.cold_starts_avoided = 0
+        self._leader_conn: Optional[AsyncConnection] = None
+        self._task: Optional[asyncio.Task] = None
+        self._last_ping: Dict[str, float] = {}
+        self._last_run: Dict[str, float] = {}
+        self._budget_window = 0.0
+        self._budget_used = 0
+        metrics.register("lambda_warmer", self.stats)
+
+    def stats(self) -> Dict:
+        return {
+            "leader": self._leader_conn != None,
+            "warm_builds": len(self._last_ping),
+            "pings_sent": self.pings_sent,
+            "budget_used": self._budget_used,
+            "cold_starts_avoided": self.cold_starts_avoided,
+        }
+
+    async def start(self):
+        if settings.WARMER_ENABLED:
+            self._task = asyncio.ensure_future(self._job())
+
+    async def stop(self):
+        if self._task != None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self._release()
+
+    async def _job(self):
+        while True:
+            await asyncio.sleep(settings.WARMER_INTERVAL_SECONDS)
+            try:
+                if await self._is_leader():
+                    await self.warm()
+            except Exception:
+                get_log(name=__name__).error("lambda warmer failed", exc_info=True)
+
+    async def _is_leader(self) -> bool:
+        if self._leader_conn != None:
+            try:
+                await self._leader_conn.execute(sa.text("SELECT 1"))
+                return True
+            except Exception:
+                # the lock went with the connection, try to take it again
+                await self._release()
+
+        conn = await engine.connect()
+        # autocommit, so holding the lock never leaves a transaction open
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        result = await conn.execute(
+            sa.text("SELECT pg_try_advisory_lock(:id)"), {"id": WARMER_LOCK_ID}
+        )
+        if result.scalar():
+            self._leader_conn = conn
+            return True
+
+        await conn.close()
+        return False
+
+    async def _release(self):
+        if self._leader_conn != None:
+            try:
+                await self._leader_conn.close()
+            except Exception:
+                pass
+            self._leader_conn = None
+
+    def _take_budget(self) -> bool:
+        now = time.time()
+        if now - self._budget_window >= 3600:
+            self._budget_window = now
+            self._budget_used = 0
+        if self._budget_used >= settings.WARMER_MAX_PINGS_PER_HOUR:
+            return False
+        self._budget_used += 1
+        return True
+
+    def _count_avoided(self, build_id: str, last_run: float):
+        # a run that came after a longer idle gap than a function stays warm,
+        # but shortly after one of our pings, would have been a cold start
+        previous_run = self._last_run.get(build_id)
+        self._last_run[build_id] = last_run
+        if previous_run == None or last_run <= previous_run:
+            return
+
+        last_ping = self._last_ping.get(build_id, 0)
+        idle_gap = last_run - previous_run
+        if (
+            idle_gap > settings.WARMER_COLD_AFTER_SECONDS
+            and previous_run < last_ping < last_run
+            and last_run - last_ping < settings.WARMER_COLD_AFTER_SECONDS
+        ):
+            self.cold_starts_avoided += 1
+            metrics.incr("lambda_warmer_cold_starts_avoided")
+
+    def plan(self, candidates: List[Dict], now: float) -> List[Dict]:
+        lookback = settings.WARMER_LOOKBACK_SECONDS
+        due = []
+        for candidate in candidates:
+            build_id = str(candidate["id"])
+            last_run = candidate["last_run"].timestamp()
+            self._count_avoided(build_id=build_id, last_run=last_run)
+
+            if candidate["runs"] < settings.WARMER_MIN_RUNS:
+                continue
+
+            # real traffic keeps it warm on its own
+            last_activity = max(last_run, self._last_ping.get(build_id, 0))
+            if now - last_activity < settings.WARMER_KEEP_WARM_SECONDS:
+                continue
+
+            # as many instances as the recent arrival rate keeps busy
+            rate = candidate["runs"] / lookback
+            duration = (candidate["avg_duration_ms"] or 0) / 1000
+            instances = min(
+                max(math.ceil(rate * duration), 1), settings.WARMER_MAX_CONCURRENCY
+            )
+            due.append({**candidate, "rate": rate, "instances": instances})
+
+        due.sort(key=lambda c: c["rate"], reverse=True)
+        return due
+
+    async def ping(self, build_id: str, function_name: str):
+        before = time.time()
+        try:
+            await lambda_invoker.invoke(
+                function_name=function_name, payload=PING_PAYLOAD
+            )
+            self._last_ping[build_id] = time.time()
+            self.pings_sent += 1
+            metrics.incr("lambda_warmer_pings")
+        except Exception:
+            metrics.incr("lambda_warmer_ping_errors")
+            get_log(name=__name__).warning(
+                f"ping {function_name} failed", exc_info=True
+            )
+        finally:
+            metrics.observe("lambda_warmer_ping_ms", (time.time() - before) * 1000)
+
+    async def warm(self):
+        since = datetime.now(timezone.utc) - timedelta(
+            seconds=settings.WARMER_LOOKBACK_SECONDS
+        )
+        async with async_session() as session:
+            candidates = await crud.get_warm_candidates(session=session, since=since)
+
+        pings = []
+        due = [
+            candidate
+            for candidate in self.plan(candidates, now=time.time())
+            # concurrent pings land on separate instances
+            for _ in range(candidate["instances"])
+        ]
+        for candidate in due:
+            if not self._take_budget():
+                metrics.incr("lambda_warmer_budget_exhausted")
+                break
+            pings.append(
+                self.ping(
+                    build_id=str(candidate["id"]),
+                    function_name=candidate["lambda_function_arn"],
+                )
+            )
+
+        await asyncio.gather(*pings)
+
+        # forget builds that dropped out of the lookback window
+        active = set(str(c["id"]) for c in candidates)
+        for build_id in list(self._last_ping.keys()):
+            if build_id not in active:
+                del self._last_ping[build_id]
+        for build_id in list(self._last_run.keys()):
+            if build_id not in active:
+                del self._last_run[build_id]
+
+
+lambda_warmer = LambdaWarmer()
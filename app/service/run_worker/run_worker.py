@@ -0,0 +1,107 @@
+import asyncio
+import json
+import logging
+from typing import Dict, Optional
+
+from aio_pika.message import IncomingMessage
+
+from app.db import crud
+from app.db import schema
+from app.db.database import async_session
+from app.db.run_writer import run_writer
+from app.helpers import metrics
+from app.helpers.boto_helper import lambda_invoker
+from app.helpers.logger import get_log
+from app.helpers.rabbit_helper import get_connection
+from app.helpers.settings import settings
+from app.routers.prediction import run_job
+
+logging.getLogger("aio_pika").setLevel(logging.ERROR)
+
+
+class RunWorker:
+    # consumes the run queue, up to RUN_WORKER_CONCURRENCY runs at once
+    def __init__(self):
+        self._connection = None
+        self._queue = None
+        self._consumer_tag: Optional[str] = None
+        self.jobs: Dict[str, asyncio.Task] = {}
+
+    async def start(self):
+        self._connection = await get_connection(
+            host=settings.RABBIT_HOST_API, loop=asyncio.get_event_loop()
+        )
+        channel = await self._connection.channel()
+        await channel.set_qos(prefetch_count=settings.RUN_WORKER_CONCURRENCY)
+        self._queue = await channel.declare_queue(
+            settings.RABBIT_RUN_QUEUE, durable=True
+        )
+        self._consumer_tag = await self._queue.consume(self.on_message, no_ack=False)
+        get_log(name=__name__).info(
+            f"run worker listening on {settings.RABBIT_RUN_QUEUE}"
+        )
+
+    async def stop(self):
+        if self._consumer_tag != None:
+            await self._queue.cancel(self._consumer_tag)
+            self._consumer_tag = None
+
+        # the runs in flight are not acked, so the broker redelivers them
+        for task in list(self.jobs.values()):
+            task.cancel()
+        await asyncio.gather(*self.jobs.values(), return_exceptions=True)
+
+        if self._connection != None:
+            await self._connection.close()
+            self._connection = None
+
+    async def on_message(self, message: IncomingMessage):
+        # an exception, including cancellation, requeues the message
+        async with message.process(requeue=True):
+            body = json.loads(message.body)
+            run_id = body["run_id"]
+            self.jobs[run_id] = asyncio.current_task()
+            try:
+                await self.process(
+                    model_id=body["model_id"], run_id=run_id, payload=body["payload"]
+                )
+            finally:
+                self.jobs.pop(run_id, None)
+
+    async def process(self, model_id: str, run_id: str, payload: dict):
+        async with async_session() as session:
+            run = await crud.get_run_by_id(session=session, run_id=run_id)
+            model = await crud.get_model_by_id(
+                session=session, model_id=model_id, use_cache=True
+            )
+
+        # a redelivered run may have been written before its worker went away
+        if run == None or model == None or not run.is_pending():
+            metrics.incr("prediction_jobs_skipped")
+            return
+
+        if run.status == schema.RunStatus.Running:
+            metrics.incr("prediction_jobs_redelivered")
+            get_log(name=__name__).info(f"run {run_id} started again")
+
+        await run_job(
+            model=model, run_id=run_id, payload=payload, created_at=run.created_at
+        )
+
+
+run_worker = RunWorker()
+
+
+async def main():
+    await run_writer.start()
+    await run_worker.start()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await run_worker.stop()
+        await run_writer.stop()
+        await lambda_invoker.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
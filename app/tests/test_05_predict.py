@@ -4,7 +4,9 @@ from app.api import app
 import pytest
 
 from yhat_params.yhat_tools import FieldType
+import asyncio
 import copy
+import json
 import requests
 from app.auth import auth_bearer
 from pathlib import Path
@@ -15,6 +17,7 @@ import uuid
 
 from app.db import schema
 from app.routers import user
+from app.service.run_worker.run_worker import run_worker
 
 
 @pytest.fixture
@@ -117,3 +120,87 @@ async def test_predict_models(client, storage):
         assert result.id != None
         assert result.input_json != None
         assert result.output_json != None
+
+
+@pytest.mark.asyncio
+async def test_predict_batch(client, storage):
+    headers = {
+        "Accept": "application/json",
+        "Authorization": f"Bearer {storage['token']}",
+    }
+
+    # models without image inputs, so the build's sample input can be sent as is
+    text_models = []
+    for model in storage["models"]:
+        response = await client.get(f"/model/{model.id}", headers=headers)
+        full_model = schema.Model(**response.json())
+        if FieldType.PIL not in full_model.active_build.input_json.values():
+            text_models.append(full_model)
+
+    for full_model in text_models[:1]:
+        payloads = [copy.deepcopy(full_model.active_build.input_json)] * 3
+        response = await client.post(
+            f"/prediction/{full_model.id}/batch", json=payloads, headers=headers
+        )
+        assert response.status_code == 200
+        lines = [json.loads(line) for line in response.text.splitlines()]
+        assert sorted([line["index"] for line in lines]) == [0, 1, 2]
+        runs = [schema.Run(**line["run"]) for line in lines]
+        assert len(set([run.id for run in runs])) == 3
+        assert all([run.output_json != None for run in runs])
+
+    response = await client.post(
+        f"/prediction/{storage['models'][0].id}/batch", json=[], headers=headers
+    )
+    assert response.status_code == 400
+
+
+@pytest.fixture
+async def worker():
+    # submitted runs are only invoked by a run worker consuming the queue
+    await run_worker.start()
+    yield
+    await run_worker.stop()
+
+
+@pytest.mark.asyncio
+async def test_submit_and_poll(client, storage, worker):
+    headers = {
+        "Accept": "application/json",
+        "Authorization": f"Bearer {storage['token']}",
+    }
+
+    # a model without image inputs, so the build's sample input can be sent as is
+    text_models = []
+    for model in storage["models"]:
+        response = await client.get(f"/model/{model.id}", headers=headers)
+        full_model = schema.Model(**response.json())
+        if FieldType.PIL not in full_model.active_build.input_json.values():
+            text_models.append(full_model)
+
+    for full_model in text_models[:1]:
+        run_id = str(uuid.uuid1())
+        response = await client.post(
+            f"/prediction/{full_model.id}/submit?run_id={run_id}",
+            json=full_model.active_build.input_json,
+            headers=headers,
+        )
+        assert response.status_code == 202
+        assert response.json()["status"] == schema.RunStatus.Queued
+
+        for _ in range(600):
+            response = await client.get(f"/run/{run_id}", headers=headers)
+            assert response.status_code == 200
+            run = schema.Run(**response.json())
+            if not run.is_pending():
+                break
+            await asyncio.sleep(1)
+
+        assert run.status == schema.RunStatus.Finished
+        assert run.output_json != None
+
+    response = await client.get(f"/run/{uuid.uuid1()}", headers=headers)
+    assert response.status_code == 404
+
+    response = await client.get("/run/not-a-run-id", headers=headers)
+    assert response.status_code == 404
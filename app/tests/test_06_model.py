@@ -14,6 +14,7 @@ from app.auth import auth_bearer
 
 from app.db import schema
 from app.db import crud
+import uuid
 
 
 @pytest.fixture
@@ -115,3 +116,48 @@ async def test_me_models(client, storage):
     assert my_model.description == data["description"]
     assert my_model.credits == data["credits"]
     assert my_model.active_build.release_notes == data["release_notes"]
+
+    data = {"config_json": {"prediction_cache": False}}
+    response = await client.put(f"/model/{my_model.id}", json=data, headers=headers)
+    assert response.status_code == 200
+    assert schema.Model(**response.json()).get_config("prediction_cache") == False
+
+    data = {"config_json": "not an object"}
+    response = await client.put(f"/model/{my_model.id}", json=data, headers=headers)
+    assert response.status_code == 400
+
+    data = {"config_json": None}
+    response = await client.put(f"/model/{my_model.id}", json=data, headers=headers)
+    assert response.status_code == 200
+    assert schema.Model(**response.json()).get_config("prediction_cache", True)
+
+
+@pytest.mark.asyncio
+async def test_model_rate_limit(client, storage):
+    headers = {
+        "Accept": "application/json",
+        "Authorization": f"Bearer {storage['token']}",
+    }
+
+    response = await client.get(f"/model/me?status=Public", headers=headers)
+    my_model = schema.Model(**response.json()[0])
+
+    data = {"config_json": {"rate_per_second": 0.001, "rate_burst": 1}}
+    response = await client.put(f"/model/{my_model.id}", json=data, headers=headers)
+    assert response.status_code == 200
+
+    # the first prediction takes the only token
+    response = await client.post(
+        f"/prediction/{my_model.id}?run_id={uuid.uuid1()}", json={}, headers=headers
+    )
+    assert response.status_code == 200
+
+    response = await client.post(
+        f"/prediction/{my_model.id}?run_id={uuid.uuid1()}", json={}, headers=headers
+    )
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) > 0
+
+    data = {"config_json": None}
+    response = await client.put(f"/model/{my_model.id}", json=data, headers=headers)
+    assert response.status_code == 200
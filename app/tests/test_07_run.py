@@ -79,3 +79,61 @@ async def test_fetch_runs(client, storage):
     for run in runs:
         assert run.model_id == model_id
         assert run.build_id == build_id
+
+
+@pytest.mark.asyncio
+async def test_fetch_runs_cursor(client, storage):
+
+    headers = {"Accept": "application/json"}
+
+    response = await client.get(f"/model/", headers=headers)
+    assert response.status_code == 200
+    model_id: str = response.json()[0]["id"]
+
+    response = await client.get(f"/run/?model_id={model_id}&limit=1", headers=headers)
+    assert response.status_code == 200
+    first_page: List[schema.Run] = [schema.Run(**m) for m in response.json()]
+    assert len(first_page) == 1
+    cursor = response.headers.get("X-Next-Cursor")
+    assert cursor != None
+
+    response = await client.get(
+        f"/run/?model_id={model_id}&limit=1&cursor={cursor}", headers=headers
+    )
+    assert response.status_code == 200
+    for run in [schema.Run(**m) for m in response.json()]:
+        assert run.id != first_page[0].id
+        assert run.created_at <= first_page[0].created_at
+
+    response = await client.get(f"/run/?cursor=abc", headers=headers)
+    assert response.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_media_refs(client, storage):
+
+    headers = {"Accept": "application/json"}
+
+    response = await client.get(f"/run/?media_refs=true&limit=50", headers=headers)
+    assert response.status_code == 200
+    runs: List[schema.Run] = [schema.Run(**m) for m in response.json()]
+    refs = [
+        value
+        for run in runs
+        for fields in [run.input_json, run.output_json or {}]
+        for value in fields.values()
+        if isinstance(value, str) and value.startswith("/media/")
+    ]
+    assert len(refs) > 0
+    for run in runs:
+        for ref, thumb_ref in run.thumb_json.items():
+            assert thumb_ref == ref + "?thumb=true"
+
+    response = await client.get(refs[0], headers=headers, allow_redirects=False)
+    assert response.status_code == 307
+    assert response.headers["Location"].startswith("https://")
+    assert "max-age" in response.headers["Cache-Control"]
+
+    run_id = refs[0].split("/")[2]
+    response = await client.get(f"/media/{run_id}/missing", allow_redirects=False)
+    assert response.status_code == 404
@@ -0,0 +1,230 @@
+import asyncio
+import json
+import time
+
+import httpx
+import pytest
+from botocore.credentials import Credentials
+from fastapi import FastAPI, Request, Response
+
+from app.helpers import boto_helper
+from app.helpers.boto_helper import backoff_seconds
+from app.helpers.circuit_breaker import CircuitBreaker, CircuitOpen, get_breaker
+from app.helpers.lambda_invoker import (
+    LambdaInvokeError,
+    LambdaInvoker,
+    parse_result,
+    parse_retry_after,
+)
+from app.helpers.settings import settings
+
+FUNCTION_ARN = "arn:aws:lambda:us-west-2:123456789012:function:model-abc"
+
+# local stand-in for the lambda Invoke api
+lambda_api = FastAPI()
+lambda_state: dict = {"in_flight": 0, "max_in_flight": 0, "calls": []}
+
+
+@lambda_api.post("/2015-03-31/functions/{function_name}/invocations")
+async def invocations(function_name: str, request: Request):
+    payload = await request.json()
+    lambda_state["calls"].append(
+        {
+            "function_name": function_name,
+            "authorization": request.headers.get("Authorization"),
+        }
+    )
+
+    if payload.get("throttle"):
+        return Response(
+            content=json.dumps(
+                {"message": "Rate exceeded", "Type": "User", "retryAfterSeconds": "2"}
+            ),
+            status_code=429,
+            headers={"x-amzn-ErrorType": "TooManyRequestsException"},
+        )
+
+    if payload.get("fail"):
+        return Response(
+            content=json.dumps(
+                {
+                    "errorMessage": "model failed",
+                    "errorType": payload.get("error_type", "ValueError"),
+                    "stackTrace": ["line 1", "line 2"],
+                }
+            ),
+            headers={"X-Amz-Function-Error": "Unhandled"},
+        )
+
+    lambda_state["in_flight"] += 1
+    lambda_state["max_in_flight"] = max(
+        lambda_state["max_in_flight"], lambda_state["in_flight"]
+    )
+    await asyncio.sleep(payload.get("sleep", 0))
+    lambda_state["in_flight"] -= 1
+
+    result = {"text output": payload["body"]["text input"]}
+    return {
+        "statusCode": 200,
+        "body": json.dumps({"duration ms": 0.25, "result": json.dumps(result)}),
+    }
+
+
+def create_invoker(max_concurrency: int = 10) -> LambdaInvoker:
+    return LambdaInvoker(
+        region_name="us-west-2",
+        get_credentials=lambda: Credentials("AKIDEXAMPLE", "secret"),
+        endpoint_url="http://lambda.local",
+        max_concurrency=max_concurrency,
+        transport=httpx.ASGITransport(app=lambda_api),
+    )
+
+
+@pytest.mark.asyncio
+async def test_invoke_result():
+    lambda_state["calls"].clear()
+    invoker = create_invoker()
+    res_json = await invoker.invoke(
+        function_name=FUNCTION_ARN, payload={"body": {"text input": "hello"}}
+    )
+    await invoker.close()
+
+    result, duration_ms = parse_result(res_json)
+    assert result == {"text output": "hello"}
+    assert duration_ms == 250
+
+    call = lambda_state["calls"][0]
+    assert call["function_name"] == FUNCTION_ARN
+    assert call["authorization"].startswith(
+        "AWS4-HMAC-SHA256 Credential=AKIDEXAMPLE/"
+    )
+    assert "/us-west-2/lambda/aws4_request" in call["authorization"]
+
+
+@pytest.mark.asyncio
+async def test_invoke_function_error():
+    invoker = create_invoker()
+    res_json = await invoker.invoke(function_name=FUNCTION_ARN, payload={"fail": True})
+    await invoker.close()
+
+    with pytest.raises(Exception) as e:
+        parse_result(res_json)
+    assert str(e.value).split("\r\n")[0] == "model failed"
+
+
+@pytest.mark.asyncio
+async def test_invoke_throttled():
+    invoker = create_invoker()
+    with pytest.raises(LambdaInvokeError) as e:
+        await invoker.invoke(function_name=FUNCTION_ARN, payload={"throttle": True})
+    await invoker.close()
+
+    assert e.value.status_code == 429
+    assert e.value.error_type == "TooManyRequestsException"
+    assert e.value.retry_after == 2
+
+
+def test_parse_retry_after():
+    assert parse_retry_after("3") == 3.0
+    assert parse_retry_after(None) == None
+    assert parse_retry_after("soon") == None
+    # an http date in the past means now
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0
+
+
+@pytest.mark.asyncio
+async def test_new_loop_closes_previous_client():
+    invoker = create_invoker()
+    await invoker.invoke(
+        function_name=FUNCTION_ARN, payload={"body": {"text input": "a"}}
+    )
+    previous = invoker._client
+
+    # as if the invoker had been used from another event loop before
+    invoker._loop = None
+    await invoker.invoke(
+        function_name=FUNCTION_ARN, payload={"body": {"text input": "b"}}
+    )
+    assert invoker._client is not previous
+    assert previous.is_closed
+    await invoker.close()
+
+
+@pytest.mark.asyncio
+async def test_invoke_max_concurrency():
+    lambda_state["max_in_flight"] = 0
+    invoker = create_invoker(max_concurrency=2)
+    results = await asyncio.gather(
+        *[
+            invoker.invoke(
+                function_name=FUNCTION_ARN,
+                payload={"body": {"text input": str(i)}, "sleep": 0.05},
+            )
+            for i in range(6)
+        ]
+    )
+    await invoker.close()
+
+    assert [parse_result(r)[0]["text output"] for r in results] == [
+        str(i) for i in range(6)
+    ]
+    assert lambda_state["max_in_flight"] == 2
+
+
+def test_circuit_breaker():
+    breaker = CircuitBreaker("model-abc", failure_threshold=2, reset_seconds=0.1)
+    breaker.failure()
+    breaker.before_call()
+    breaker.failure()
+    assert breaker.state == "open"
+    with pytest.raises(CircuitOpen):
+        breaker.before_call()
+
+    time.sleep(0.1)
+    # one trial call at a time once the reset time has passed
+    breaker.before_call()
+    assert breaker.state == "half_open"
+    with pytest.raises(CircuitOpen):
+        breaker.before_call()
+
+    breaker.success(duration_ms=10)
+    assert breaker.state == "closed"
+    breaker.before_call()
+
+
+def test_backoff_seconds():
+    for attempt in range(1, 10):
+        delay = backoff_seconds(attempt=attempt)
+        assert 0 <= delay <= settings.LAMBDA_RETRY_MAX_SECONDS
+    assert backoff_seconds(attempt=1, retry_after=2) >= 2
+
+
+@pytest.mark.asyncio
+async def test_function_errors_open_circuit(monkeypatch):
+    invoker = create_invoker()
+    monkeypatch.setattr(boto_helper, "lambda_invoker", invoker)
+    function_name = FUNCTION_ARN + "-failing"
+
+    # exceptions in the model's code are about the input
+    for _ in range(settings.LAMBDA_BREAKER_FAILURES):
+        with pytest.raises(Exception) as e:
+            await boto_helper.invoke_lambda_function(
+                function_name=function_name, function_params={"fail": True}
+            )
+        assert str(e.value).startswith("model failed")
+    assert get_breaker(function_name).state == "closed"
+
+    # timeouts are the function's
+    params = {"fail": True, "error_type": "Sandbox.Timedout"}
+    for _ in range(settings.LAMBDA_BREAKER_FAILURES):
+        with pytest.raises(Exception):
+            await boto_helper.invoke_lambda_function(
+                function_name=function_name, function_params=params
+            )
+
+    assert get_breaker(function_name).state == "open"
+    with pytest.raises(CircuitOpen):
+        await boto_helper.invoke_lambda_function(
+            function_name=function_name, function_params=params
+        )
+    await invoker.close()
@@ -0,0 +1,62 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from app.helpers.asyncwrapper import Bulkhead, BulkheadFull, async_iterate
+
+
+def wait_until_active(bulkhead: Bulkhead):
+    for _ in range(100):
+        if bulkhead.stats()["active"] == 1:
+            return
+        time.sleep(0.01)
+
+
+@pytest.mark.asyncio
+async def test_bulkhead_cancel_queued():
+    bulkhead = Bulkhead("test", max_workers=1, max_queue=2)
+    loop = asyncio.get_event_loop()
+    release = threading.Event()
+
+    running = bulkhead.run(loop, lambda: release.wait(5))
+    wait_until_active(bulkhead)
+    waiting = bulkhead.run(loop, lambda: "ran")
+    assert bulkhead.stats()["queued"] == 1
+
+    # a cancelled caller gives its queue slot back even though it never ran
+    waiting.cancel()
+    await asyncio.sleep(0)
+    release.set()
+    await running
+
+    stats = bulkhead.stats()
+    assert stats["queued"] == 0
+    assert stats["active"] == 0
+
+    assert await bulkhead.run(loop, lambda: "ran") == "ran"
+
+
+@pytest.mark.asyncio
+async def test_bulkhead_full():
+    bulkhead = Bulkhead("test", max_workers=1, max_queue=1)
+    loop = asyncio.get_event_loop()
+    release = threading.Event()
+
+    running = bulkhead.run(loop, lambda: release.wait(5))
+    wait_until_active(bulkhead)
+    queued = bulkhead.run(loop, lambda: "ran")
+    with pytest.raises(BulkheadFull):
+        bulkhead.run(loop, lambda: "ran")
+    release.set()
+    assert await queued == "ran"
+    await running
+
+    assert bulkhead.stats()["queued"] == 0
+
+
+@pytest.mark.asyncio
+async def test_async_iterate():
+    items = [item async for item in async_iterate(iter(range(3)), bulkhead="docker")]
+    assert items == [0, 1, 2]
@@ -0,0 +1,97 @@
+import uuid
+from datetime import datetime, timezone
+from typing import Dict, List
+
+import pytest
+from sqlalchemy.exc import DataError, OperationalError
+
+from app.db.run_writer import RunWriter, RunWriterFull
+
+
+class LocalRunWriter(RunWriter):
+    # stand-in for postgres, which rejects a whole insert for one bad row
+    def __init__(self):
+        super().__init__(flush_interval_ms=1000, max_rows=100, max_pending=1000)
+        self.written: List[Dict] = []
+        self.database_up = True
+
+    async def _insert(self, rows: List[Dict]):
+        if not self.database_up:
+            raise OperationalError("INSERT", {}, Exception("connection refused"))
+        if any(row["output_json"].get("bad") for row in rows):
+            raise DataError("INSERT", {}, Exception("invalid input syntax for json"))
+        self.written += rows
+
+    async def _update_builds(self, last_runs: Dict[str, datetime]):
+        pass
+
+
+def new_row(output_json: dict) -> Dict:
+    return {
+        "id": str(uuid.uuid1()),
+        "output_json": output_json,
+        "build_id": "build",
+        "model_id": "model",
+        "created_at": datetime.now(timezone.utc),
+    }
+
+
+@pytest.mark.asyncio
+async def test_bad_row_costs_one_row():
+    writer = LocalRunWriter()
+    rows = [new_row({"i": i}) for i in range(5)]
+    rows.insert(2, new_row({"bad": True}))
+    for row in rows:
+        await writer.add(row)
+
+    await writer.flush()
+
+    assert [row["output_json"] for row in writer.written] == [
+        {"i": i} for i in range(5)
+    ]
+    assert writer.stats()["pending_rows"] == 0
+    for row in rows:
+        assert not writer.is_pending(row["id"])
+
+    # later flushes are not held up by the dropped row
+    await writer.add(new_row({"i": 5}))
+    await writer.flush()
+    assert writer.written[-1]["output_json"] == {"i": 5}
+
+
+@pytest.mark.asyncio
+async def test_rows_kept_while_database_down():
+    writer = LocalRunWriter()
+    writer.database_up = False
+    rows = [new_row({"i": i}) for i in range(3)]
+    for row in rows:
+        await writer.add(row)
+
+    await writer.flush()
+    assert writer.stats()["pending_rows"] == 3
+    assert writer.is_pending(rows[0]["id"])
+
+    writer.database_up = True
+    await writer.flush()
+    assert [row["output_json"] for row in writer.written] == [
+        {"i": i} for i in range(3)
+    ]
+    assert writer.stats()["pending_rows"] == 0
+
+
+@pytest.mark.asyncio
+async def test_full_writer_flushes_instead_of_dropping():
+    writer = LocalRunWriter()
+    writer.max_pending = 2
+    for i in range(3):
+        await writer.add(new_row({"i": i}))
+
+    # the third add flushed the first two
+    assert [row["output_json"] for row in writer.written] == [{"i": 0}, {"i": 1}]
+    assert writer.stats()["pending_rows"] == 1
+
+    writer.database_up = False
+    await writer.add(new_row({"i": 3}))
+    with pytest.raises(RunWriterFull):
+        await writer.add(new_row({"i": 4}))
+    assert writer.stats()["pending_rows"] == 2
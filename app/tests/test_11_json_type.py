@@ -0,0 +1,19 @@
+import json
+
+from app.db import model
+
+
+def test_sanitize_json():
+    # what json.dumps writes for a model that returned nan and a nul byte
+    value = json.loads(
+        '{"score": NaN, "range": [-Infinity, 1.5], "text\\u0000": "a\\u0000b"}'
+    )
+    assert model.sanitize_json(value) == {
+        "score": None,
+        "range": [None, 1.5],
+        "text": "ab",
+    }
+
+    json_type = model.Run.__table__.c.output_json.type
+    assert json_type.process_bind_param({"x": float("inf")}, None) == {"x": None}
+    assert json_type.process_bind_param(None, None) == None
@@ -9,5 +9,7 @@ fi
 
 if [ "$APPLICATION_NAME" == "YHatFastApi" ]
 then
+    venv/bin/python -m app.main db-migrate
+    pm2 start "venv/bin/python -m app.service.run_worker.run_worker" --name run_worker
     pm2 start "venv/bin/python -m uvicorn app.api:app  --host 0.0.0.0 --port 8000 --http h11 --timeout-keep-alive 120" --name fastapi
 fi